@@ -1,13 +1,217 @@
-from flask import Flask, request, jsonify, render_template
+import hashlib
+import inspect
+import math
+from datetime import datetime, timezone
+from functools import wraps
+from urllib.parse import urlencode
+from flask import Flask, Response, request, jsonify, make_response, render_template
 from flask_cors import CORS
-from database import init_db
-from models import User, Book, BorrowingRecord, Reservation, Review
+from database import init_db, pool_stats
+import compression
+import models
+from models import User, Book, BorrowingRecord, Reservation, Review, Recommendation
+from pagination import encode_cursor, page_args
+import metrics
+import passwords
+import ratelimit
+import scheduler
+import serializers
+from passwords import HashingOverloaded
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for Android app
+app.json = serializers.JSONProvider(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'Link', 'ETag', 'Last-Modified'])  # Enable CORS for Android app
 
-# Initialize database on first run
-init_db()
+def create_app():
+    """Prepare the database and background jobs and return the app.
+
+    Entry point for WSGI/ASGI servers (see wsgi.py and asgi.py). Call it
+    once per worker process, after fork: init_db is serialized across
+    workers and skips the DDL once the schema is current, and every
+    worker opens its own connections.
+    """
+    init_db()
+    if scheduler.SCHEDULER_ENABLED:
+        scheduler.scheduler.start()
+    return app
+
+def page_response(page):
+    """JSON list response; the next-page cursor goes in X-Next-Cursor and Link"""
+    response = jsonify(page)
+    if page.version:
+        compression.cacheable(response, f'{page.version}|{response.mimetype}',
+                              ttl=models.CACHE_TTL)
+    if page.next_key is not None:
+        cursor = encode_cursor(page.next_key)
+        args = request.args.to_dict()
+        args['after'] = cursor
+        next_url = f'{request.base_url}?{urlencode(args)}'
+        response.headers['X-Next-Cursor'] = cursor
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+NDJSON = 'application/x-ndjson'
+
+def stream_format():
+    """'ndjson' or 'json' if the client wants a streamed list, else None"""
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON])
+    if best == NDJSON:
+        return 'ndjson'
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return 'json'
+    return None
+
+def stream_response(batches, fmt):
+    """Stream row batches as NDJSON or as one JSON array, chunk by chunk"""
+    def generate():
+        if fmt == 'ndjson':
+            for batch in batches:
+                yield serializers.ndjson_lines(batch)
+            return
+
+        yield b'['
+        separator = b''
+        for batch in batches:
+            yield separator + serializers.json_items(batch)
+            separator = b','
+        yield b']'
+
+    mimetype = NDJSON if fmt == 'ndjson' else 'application/json'
+    return Response(generate(), mimetype=mimetype)
+
+# Most items a batch endpoint accepts in one request
+MAX_BATCH_SIZE = 100
+
+def id_list(values, name):
+    """Validate the IDs of a batch request: a JSON list or comma-separated string.
+    
+    Raises ValueError on bad input.
+    """
+    if isinstance(values, str):
+        try:
+            values = [int(value) for value in values.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f'{name} must be integers')
+    if not isinstance(values, list) or not values:
+        raise ValueError(f'{name} must be a non-empty list')
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        raise ValueError(f'{name} must be integers')
+    if len(values) > MAX_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_BATCH_SIZE} {name} per request')
+    return values
+
+def list_response(fetch):
+    """Serve a list endpoint: a bounded page, or a stream if requested.
+    
+    fetch is called with limit, after, fields and stream keyword arguments.
+    Streamed lists are not capped and carry no next-page cursor.
+    """
+    fmt = stream_format()
+    try:
+        limit, after, fields = page_args(request.args, bounded=fmt is None)
+        result = fetch(limit=limit, after=after, fields=fields, stream=fmt is not None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if fmt:
+        return stream_response(result, fmt), 200
+    return page_response(result), 200
+
+def conditional(get_version):
+    """Answer conditional GETs from a cheap version lookup.
+    
+    get_version takes the view's arguments and returns a model version dict
+    (or None). If the client's If-None-Match / If-Modified-Since still
+    match, a 304 is returned without running the view; otherwise the
+    response is sent with a strong ETag and Last-Modified.
+    
+    A view whose body may come from a cache sets response.version to the
+    version the body was read at. If that is not the current version, the
+    ETag is built from the body's version instead and Last-Modified is
+    left out, so an older body never carries a newer version's validators.
+    """
+    def etag_for(version):
+        # The representation also depends on the query string, Accept and
+        # the content coding
+        seed = (f"{request.full_path}|{request.headers.get('Accept', '')}|"
+                f"{compression.negotiate()}|{version}")
+        return hashlib.sha1(seed.encode()).hexdigest()
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = get_version(*args, **kwargs)
+            if current is None:
+                return view(*args, **kwargs)
+
+            etag = etag_for(current['version'])
+            last_modified = None
+            if current['last_modified']:
+                last_modified = datetime.fromisoformat(
+                    current['last_modified']).replace(tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                since = request.if_modified_since
+                not_modified = bool(since and last_modified and last_modified <= since)
+            if not_modified:
+                response = Response(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                body_version = getattr(response, 'version', None)
+                if body_version is not None and body_version != current['version']:
+                    etag = etag_for(body_version)
+                    last_modified = None
+                compression.cacheable(response, etag)
+            response.set_etag(etag)
+            response.vary.add('Accept')
+            response.vary.add('Accept-Encoding')
+            if last_modified:
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+@app.before_request
+def start_request_metrics():
+    metrics.start_request()
+
+@app.before_request
+def enforce_rate_limits():
+    """Reject over-limit requests before the view does any work"""
+    limited = ratelimit.check()
+    if limited is None:
+        return None
+    policy, wait = limited
+    response = jsonify({'error': 'Too many requests, please retry later', 'limit': policy.name})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
+
+@app.after_request
+def record_request_metrics(response):
+    """Record the request; generated bodies count once they have been sent"""
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    method, status = request.method, response.status_code
+    if inspect.isgenerator(response.response):
+        response.call_on_close(lambda: metrics.finish_request(route, method, status))
+    else:
+        metrics.finish_request(route, method, status)
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Compress per Accept-Encoding; runs before the metrics hook, so
+    compression counts towards request latency"""
+    return compression.compress_response(response)
+
+@app.errorhandler(HashingOverloaded)
+def hashing_overloaded(e):
+    """Too many password hashes queued: shed load instead of piling up"""
+    response = jsonify({'error': 'Server busy, please retry shortly'})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
 
 # Landing page
 @app.route('/')
@@ -55,18 +259,39 @@ def login():
 # Book endpoints
 @app.route('/api/books', methods=['GET'])
 def get_books():
-    """Get all books with optional search and category filter"""
+    """Get a page of books with optional search and category filter,
+    or specific books with ?ids=1,2,3"""
+    if 'ids' in request.args:
+        try:
+            book_ids = id_list(request.args['ids'], 'ids')
+            _, _, fields = page_args(request.args)
+            return jsonify(Book.get_many(book_ids, fields)), 200
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
     search = request.args.get('search')
     category = request.args.get('category')
-    books = Book.get_all(search, category)
-    return jsonify(books), 200
+    return list_response(lambda **page: Book.get_all(search, category, **page))
+
+@app.route('/api/books/top', methods=['GET'])
+def get_top_rated_books():
+    """Get a page of the highest-rated books"""
+    try:
+        min_reviews = int(request.args.get('min_reviews', 1))
+    except ValueError:
+        return jsonify({'error': 'min_reviews must be an integer'}), 400
+    return list_response(lambda **page: Book.get_top_rated(min_reviews, **page))
 
 @app.route('/api/books/<int:book_id>', methods=['GET'])
+@conditional(Book.get_version)
 def get_book(book_id):
     """Get a specific book by ID"""
     book = Book.get_by_id(book_id)
     if book:
-        return jsonify(book), 200
+        response = jsonify(book)
+        # A cached copy can be older than the version conditional() looked up
+        response.version = str(book['row_version'])
+        return response, 200
     else:
         return jsonify({'error': 'Book not found'}), 404
 
@@ -81,13 +306,33 @@ def borrow_book():
     if not all([user_id, book_id]):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    book = Book.get_by_id(book_id)
-    if not book or book['available_copies'] <= 0:
+    record_id = BorrowingRecord.create(user_id, book_id)
+    if record_id is None:
         return jsonify({'error': 'Book not available'}), 400
     
-    record_id = BorrowingRecord.create(user_id, book_id)
     return jsonify({'message': 'Book borrowed successfully', 'record_id': record_id}), 201
 
+@app.route('/api/borrow/batch', methods=['POST'])
+def borrow_books():
+    """Borrow several books for one user in a single transaction"""
+    data = request.json
+    user_id = data.get('user_id')
+    if not user_id:
+        return jsonify({'error': 'Missing required fields'}), 400
+    try:
+        book_ids = id_list(data.get('book_ids'), 'book_ids')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = []
+    for book_id, record_id in zip(book_ids, BorrowingRecord.create_batch(user_id, book_ids)):
+        if record_id is None:
+            results.append({'book_id': book_id, 'status': 400, 'error': 'Book not available'})
+        else:
+            results.append({'book_id': book_id, 'status': 201, 'record_id': record_id})
+    borrowed = sum(1 for result in results if result['status'] == 201)
+    return jsonify({'borrowed': borrowed, 'results': results}), 200
+
 @app.route('/api/return/<int:record_id>', methods=['POST'])
 def return_book(record_id):
     """Return a borrowed book"""
@@ -95,13 +340,32 @@ def return_book(record_id):
     if fine is not None:
         return jsonify({'message': 'Book returned successfully', 'fine': fine}), 200
     else:
-        return jsonify({'error': 'Record not found'}), 404
+        return jsonify({'error': 'Record not found or already returned'}), 404
+
+@app.route('/api/return/batch', methods=['POST'])
+def return_books():
+    """Return several borrowed books in a single transaction"""
+    data = request.json
+    try:
+        record_ids = id_list(data.get('record_ids'), 'record_ids')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results = []
+    for record_id, fine in zip(record_ids, BorrowingRecord.return_batch(record_ids)):
+        if fine is None:
+            results.append({'record_id': record_id, 'status': 404,
+                            'error': 'Record not found or already returned'})
+        else:
+            results.append({'record_id': record_id, 'status': 200, 'fine': fine})
+    returned = sum(1 for result in results if result['status'] == 200)
+    return jsonify({'returned': returned, 'results': results}), 200
 
 @app.route('/api/user/<int:user_id>/borrowed', methods=['GET'])
+@conditional(BorrowingRecord.get_user_borrowed_version)
 def get_user_borrowed(user_id):
-    """Get all books borrowed by a user"""
-    records = BorrowingRecord.get_user_borrowed(user_id)
-    return jsonify(records), 200
+    """Get a page of books borrowed by a user"""
+    return list_response(lambda **page: BorrowingRecord.get_user_borrowed(user_id, **page))
 
 # Reservation endpoints
 @app.route('/api/reserve', methods=['POST'])
@@ -118,10 +382,19 @@ def reserve_book():
     return jsonify({'message': 'Book reserved successfully', 'reservation_id': reservation_id}), 201
 
 @app.route('/api/user/<int:user_id>/reservations', methods=['GET'])
+@conditional(Reservation.get_user_reservations_version)
 def get_user_reservations(user_id):
-    """Get all reservations for a user"""
-    reservations = Reservation.get_user_reservations(user_id)
-    return jsonify(reservations), 200
+    """Get a page of a user's pending reservations, or ready holds with ?status=ready"""
+    status = request.args.get('status', 'pending')
+    if status not in ('pending', 'ready'):
+        return jsonify({'error': "status must be 'pending' or 'ready'"}), 400
+    return list_response(
+        lambda **page: Reservation.get_user_reservations(user_id, status, **page))
+
+@app.route('/api/books/<int:book_id>/holds', methods=['GET'])
+def get_book_holds(book_id):
+    """Get a page of a book's hold queue, next in line first"""
+    return list_response(lambda **page: Reservation.get_book_queue(book_id, **page))
 
 # Review endpoints
 @app.route('/api/reviews', methods=['POST'])
@@ -143,16 +416,53 @@ def create_review():
     return jsonify({'message': 'Review created successfully', 'review_id': review_id}), 201
 
 @app.route('/api/books/<int:book_id>/reviews', methods=['GET'])
+@conditional(Review.get_book_reviews_version)
 def get_book_reviews(book_id):
-    """Get all reviews for a book"""
-    reviews = Review.get_book_reviews(book_id)
-    return jsonify(reviews), 200
+    """Get a page of reviews for a book"""
+    return list_response(lambda **page: Review.get_book_reviews(book_id, **page))
+
+# Recommendation endpoints
+@app.route('/api/books/<int:book_id>/similar', methods=['GET'])
+def get_similar_books(book_id):
+    """Get a page of books read by the same readers as this one, most similar first"""
+    return list_response(lambda **page: Recommendation.get_similar(book_id, **page))
+
+@app.route('/api/user/<int:user_id>/recommendations', methods=['GET'])
+def get_user_recommendations(user_id):
+    """Get books a user may like, from the books they borrowed and reviewed"""
+    try:
+        limit, _, fields = page_args(request.args)
+        return jsonify(Recommendation.get_for_user(user_id, limit, fields)), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Simple health check"""
-    return jsonify({'status': 'healthy', 'message': 'Library API is running'}), 200
+    return jsonify({
+        'status': 'healthy',
+        'message': 'Library API is running',
+        'db_pool': pool_stats(),
+        'book_cache': models.book_cache.stats(),
+        'password_hashing': passwords.pool_stats(),
+        'scheduler': scheduler.scheduler.stats(),
+        'compression': compression.stats(),
+        'ratelimit': ratelimit.stats()
+    }), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Request latency, SQL and pool metrics in Prometheus text format"""
+    body = metrics.render({
+        'db_pool': pool_stats(),
+        'book_cache': models.book_cache.stats(),
+        'password_hashing': passwords.pool_stats(),
+        'scheduler': scheduler.scheduler.stats(),
+        'compression': compression.stats(),
+        'ratelimit': ratelimit.stats(),
+    })
+    return Response(body, mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     print("Starting Library Access API...")
@@ -161,4 +471,5 @@ if __name__ == '__main__':
     print("  - Landing page: http://localhost:5001/")
     print("  - Health check: http://localhost:5001/api/health")
     print("  - View books: http://localhost:5001/api/books")
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    print("\nDevelopment server; in production run: gunicorn -c gunicorn.conf.py wsgi:app")
+    create_app().run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""ASGI entry point, for uvicorn and other ASGI servers (needs asgiref).
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+
+Requests still run on the synchronous Flask app, in asgiref's thread pool.
+"""
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+app = WsgiToAsgi(create_app())
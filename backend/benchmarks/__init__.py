@@ -0,0 +1,8 @@
+"""Benchmarks for the Library Access API.
+
+Run from the backend directory, e.g. ``python -m benchmarks.borrow_stress``.
+"""
+import os
+
+# Benchmarks drive the API far harder than any one client is allowed to
+os.environ.setdefault('LIBRARY_RATELIMIT', '0')
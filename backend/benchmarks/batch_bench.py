@@ -0,0 +1,64 @@
+"""Batch endpoints vs one request per item.
+
+Checks out, returns and looks up a stack of books for one patron, first
+with N calls to /api/borrow, /api/return/<id> and /api/books/<id>, then
+with one call each to /api/borrow/batch, /api/return/batch and
+/api/books?ids=, and reports items/sec for both.
+
+    python -m benchmarks.batch_bench --items 10 50 --rounds 20
+"""
+import argparse
+
+import models
+from database import get_db_connection
+from importer import import_books
+from benchmarks.common import temp_database, timer
+
+BOOKS = 100
+
+def _seed():
+    conn = get_db_connection()
+    conn.execute("INSERT INTO users (username, email, password_hash) VALUES ('desk', 'desk@example.com', 'x')")
+    conn.commit()
+    conn.close()
+    import_books({'isbn': f'{9790000000000 + i}', 'title': f'Book {i}', 'author': 'Bench',
+                  'total_copies': 1000} for i in range(BOOKS))
+
+def single(client, book_ids):
+    record_ids = [client.post('/api/borrow', json={'user_id': 1, 'book_id': book_id}).json['record_id']
+                  for book_id in book_ids]
+    for record_id in record_ids:
+        client.post(f'/api/return/{record_id}')
+    for book_id in book_ids:
+        client.get(f'/api/books/{book_id}')
+
+def batch(client, book_ids):
+    results = client.post('/api/borrow/batch', json={'user_id': 1, 'book_ids': book_ids}).json['results']
+    client.post('/api/return/batch', json={'record_ids': [r['record_id'] for r in results]})
+    client.get('/api/books?ids=' + ','.join(map(str, book_ids)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    from app import app
+    print(f"{'items':>6} {'mode':>7} {'items/s':>9} {'ms/stack':>9}")
+    for items in args.items:
+        for label, run in (('single', single), ('batch', batch)):
+            with temp_database():
+                _seed()
+                client = app.test_client()
+                with timer() as elapsed:
+                    for round_no in range(args.rounds):
+                        models.book_cache.clear()  # Look-ups should hit the database
+                        start = (round_no * items) % BOOKS
+                        run(client, [(start + i) % BOOKS + 1 for i in range(items)])
+            seconds = elapsed['seconds']
+            # borrow + return + lookup per item
+            print(f"{items:>6} {label:>7} {items * args.rounds * 3 / seconds:>9.0f} "
+                  f"{seconds / args.rounds * 1000:>9.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Concurrent borrow/return stress test.
+
+Many threads race to borrow a handful of copies. The run fails if more
+loans are issued than copies exist or if available_copies goes negative,
+and reports borrows/sec for the transactional borrow path.
+
+    python -m benchmarks.borrow_stress --threads 16 --attempts 200
+"""
+import argparse
+import threading
+
+from database import get_db_connection
+from models import BorrowingRecord
+from benchmarks.common import temp_database, timer
+
+def _seed(copies, users):
+    conn = get_db_connection()
+    conn.executemany(
+        'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+        [(f'user{i}', f'user{i}@example.com', 'x') for i in range(users)]
+    )
+    conn.execute('''
+        INSERT INTO books (isbn, title, author, total_copies, available_copies)
+        VALUES ('0000000000', 'Stress Test', 'Bench', ?, ?)
+    ''', (copies, copies))
+    conn.commit()
+    conn.close()
+
+def run(threads, attempts, copies, return_every):
+    with temp_database():
+        _seed(copies, threads)
+        counts = {'borrowed': 0, 'rejected': 0, 'returned': 0}
+        lock = threading.Lock()
+        start = threading.Barrier(threads)
+
+        def worker(user_id):
+            start.wait()
+            held = []
+            for i in range(attempts):
+                record_id = BorrowingRecord.create(user_id, 1)
+                with lock:
+                    counts['borrowed' if record_id else 'rejected'] += 1
+                if record_id:
+                    held.append(record_id)
+                if return_every and held and i % return_every == 0:
+                    BorrowingRecord.return_book(held.pop())
+                    with lock:
+                        counts['returned'] += 1
+
+        pool = [threading.Thread(target=worker, args=(n + 1,)) for n in range(threads)]
+        with timer() as elapsed:
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+
+        conn = get_db_connection()
+        available = conn.execute('SELECT available_copies FROM books WHERE book_id = 1').fetchone()[0]
+        on_loan = conn.execute(
+            "SELECT COUNT(*) FROM borrowing_records WHERE status = 'borrowed'"
+        ).fetchone()[0]
+        conn.close()
+
+    ok = (available >= 0 and on_loan + available == copies
+          and counts['borrowed'] - counts['returned'] == on_loan)
+    total = threads * attempts
+    print(f"threads={threads} attempts={total} copies={copies}")
+    print(f"  borrowed={counts['borrowed']} rejected={counts['rejected']} returned={counts['returned']}")
+    print(f"  on_loan={on_loan} available={available} -> {'OK' if ok else 'INCONSISTENT'}")
+    print(f"  {total / elapsed['seconds']:.0f} borrow attempts/sec, "
+          f"{counts['borrowed'] / elapsed['seconds']:.0f} borrows/sec")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--attempts', type=int, default=200, help='borrow attempts per thread')
+    parser.add_argument('--copies', type=int, default=500)
+    parser.add_argument('--return-every', type=int, default=3,
+                        help='return a held copy every N attempts (0 = never)')
+    args = parser.parse_args()
+    if not run(args.threads, args.attempts, args.copies, args.return_every):
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
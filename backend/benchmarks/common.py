@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+import database
+
+@contextmanager
+def temp_database():
+    """Point the app at a fresh, initialized database in a temp directory"""
+    original = database.DATABASE_NAME
+    workdir = tempfile.mkdtemp(prefix='library-bench-')
+    database.DATABASE_NAME = os.path.join(workdir, 'library.db')
+    try:
+        database.init_db()
+        yield database.DATABASE_NAME
+    finally:
+        database.close_db_connection()
+        database.DATABASE_NAME = original
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@contextmanager
+def timer():
+    """Measure wall-clock time; the yielded dict gets 'seconds' on exit"""
+    result = {}
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - start
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
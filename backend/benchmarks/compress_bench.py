@@ -0,0 +1,70 @@
+"""Compression ratio and CPU per encoding for catalog pages.
+
+For each page size and offered encoding, reports the compressed size,
+the ratio to the uncompressed body and the CPU time to compress it, then
+the CPU per request through the app when every response is compressed
+afresh (payload cache cleared) and when it comes from the payload cache.
+
+    python -m benchmarks.compress_bench --sizes 20 100 500 --requests 200
+"""
+import argparse
+import time
+
+import compression
+from benchmarks.common import temp_database
+from benchmarks.search_bench import load_books
+
+def request_cpu(client, url, encoding, requests, cached):
+    """CPU microseconds per request"""
+    headers = {'Accept-Encoding': encoding}
+    client.get(url, headers=headers).get_data()  # Warm the page and payload caches
+    started = time.process_time()
+    for _ in range(requests):
+        if not cached:
+            compression.payload_cache.clear()
+        client.get(url, headers=headers).get_data()
+    return (time.process_time() - started) / requests * 1e6
+
+def compress_cpu(data, encoding, requests):
+    """(compressed bytes, CPU microseconds) per one-shot compression"""
+    compress = compression.ENCODERS[encoding][0]
+    level = compression.LEVELS[encoding]
+    body = compress(data, level)
+    started = time.process_time()
+    for _ in range(requests):
+        compress(data, level)
+    return len(body), (time.process_time() - started) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    with temp_database():
+        load_books(max(args.sizes))
+        from app import app
+        client = app.test_client()
+
+        print(f"{'rows':>5} {'encoding':<9} {'bytes':>8} {'ratio':>6} {'compress us':>12} "
+              f"{'request us':>11} {'cached us':>10}")
+        for size in args.sizes:
+            url = f'/api/books?limit={size}'
+            data = client.get(url).get_data()
+            plain = request_cpu(client, url, 'identity', args.requests, cached=True)
+            print(f"{size:>5} {'identity':<9} {len(data):>8} {1:>6.1f} {'-':>12} "
+                  f"{plain:>11.0f} {'-':>10}")
+            for encoding in compression.ENCODERS:
+                size_bytes, cpu = compress_cpu(data, encoding, args.requests)
+                fresh = request_cpu(client, url, encoding, args.requests, cached=False)
+                cached = request_cpu(client, url, encoding, args.requests, cached=True)
+                print(f'{size:>5} {encoding:<9} {size_bytes:>8} {len(data) / size_bytes:>6.1f} '
+                      f'{cpu:>12.0f} {fresh:>11.0f} {cached:>10.0f}')
+        missing = [name for name, module in (('brotli', compression.brotli),
+                                             ('zstandard', compression.zstandard))
+                   if module is None]
+        if missing:
+            print(f"({', '.join(missing)} not installed)")
+
+if __name__ == '__main__':
+    main()
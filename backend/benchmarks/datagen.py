@@ -0,0 +1,161 @@
+"""Synthetic library data at configurable scale.
+
+Extends seed_data.py: the sample users and books plus synthetic patrons,
+a synthetic catalog, borrowing history (returned, current and overdue
+loans, with available_copies kept consistent), reviews and the book
+recommendations computed from them. The same seed always produces the
+same data, with dates relative to today.
+
+    python -m benchmarks.datagen library.db --scale medium
+    python -m benchmarks.datagen library.db --users 5000 --books 100000 --loans 200000
+
+Every user's password is seed_data.SAMPLE_PASSWORD.
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import database
+import passwords
+import recommendations
+from importer import BOOK_COLUMNS, import_books
+from models import calculate_fine
+from seed_data import SAMPLE_BOOKS, SAMPLE_PASSWORD, SAMPLE_USERS
+from benchmarks.search_bench import synthetic_books
+
+SCALES = {
+    'small': {'users': 200, 'books': 2000, 'loans': 5000, 'reviews': 4000},
+    'medium': {'users': 2000, 'books': 20000, 'loans': 50000, 'reviews': 40000},
+    'large': {'users': 20000, 'books': 200000, 'loans': 500000, 'reviews': 400000},
+}
+
+HISTORY_DAYS = 365
+LOAN_DAYS = 14
+ACTIVE_LOAN_SHARE = 0.1  # Share of loans still out; some of them overdue
+
+REVIEW_TEXTS = ['Loved it.', 'Could not put it down.', 'Slow start, great ending.',
+                'Not for me.', 'A classic for a reason.', 'Recommended to the whole book club.',
+                None, None]
+
+def _users(count):
+    for username, email, full_name, phone in SAMPLE_USERS:
+        yield username, email, full_name, phone
+    for i in range(count - len(SAMPLE_USERS)):
+        yield f'patron{i}', f'patron{i}@example.com', f'Patron {i}', None
+
+def _books(count):
+    for book in SAMPLE_BOOKS:
+        yield dict(zip(BOOK_COLUMNS, book))
+    for book in synthetic_books(max(0, count - len(SAMPLE_BOOKS))):
+        yield dict(zip(BOOK_COLUMNS, book))
+
+def _loans(rng, users, copies, count, now):
+    """Loan rows and current loans per book, which never exceed its copies"""
+    records, out = [], dict.fromkeys(copies, 0)
+    book_ids = list(copies)
+    for _ in range(count):
+        book_id = rng.choice(book_ids)
+        user_id = rng.randint(1, users)
+        borrowed = now - timedelta(days=rng.uniform(0, HISTORY_DAYS),
+                                   seconds=rng.randint(0, 86399))
+        due = borrowed + timedelta(days=LOAN_DAYS)
+        active = rng.random() < ACTIVE_LOAN_SHARE and out[book_id] < copies[book_id]
+        if active:
+            # Current loans started recently enough that most are not yet due
+            borrowed = now - timedelta(days=rng.uniform(0, LOAN_DAYS * 1.5))
+            due = borrowed + timedelta(days=LOAN_DAYS)
+            out[book_id] += 1
+            records.append((user_id, book_id, borrowed, due, None, 'borrowed', 0.0))
+        else:
+            returned = borrowed + timedelta(days=rng.uniform(1, LOAN_DAYS + 7))
+            records.append((user_id, book_id, borrowed, due, returned, 'returned',
+                            calculate_fine(due, returned)))
+    return records, out
+
+def _reviews(rng, users, books, count):
+    """Distinct (user, book) reviews, ratings skewed towards 4 and 5"""
+    seen = set()
+    count = min(count, users * books)
+    while len(seen) < count:
+        user_id, book_id = rng.randint(1, users), rng.randint(1, books)
+        if (user_id, book_id) in seen:
+            continue
+        seen.add((user_id, book_id))
+        rating = rng.choices((1, 2, 3, 4, 5), weights=(1, 1, 3, 5, 4))[0]
+        yield user_id, book_id, rating, rng.choice(REVIEW_TEXTS)
+
+def generate(users=200, books=2000, loans=5000, reviews=4000, seed=42):
+    """Fill database.DATABASE_NAME (created if needed) with synthetic data.
+
+    Returns the dataset's shape: counts of users, books, loans, active
+    loans and reviews.
+    """
+    rng = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    users = max(users, len(SAMPLE_USERS))
+    books = max(books, len(SAMPLE_BOOKS))
+
+    database.init_db()
+    # One KDF run shared by every patron keeps generation fast
+    password_hash = passwords.hash_password(SAMPLE_PASSWORD)
+    conn = database.get_db_connection()
+    conn.executemany(
+        'INSERT INTO users (username, email, password_hash, full_name, phone) VALUES (?, ?, ?, ?, ?)',
+        [(username, email, password_hash, full_name, phone)
+         for username, email, full_name, phone in _users(users)])
+    conn.commit()
+
+    import_books(_books(books))
+    copies = dict(conn.execute('SELECT book_id, total_copies FROM books'))
+
+    records, active = _loans(rng, users, copies, loans, now)
+    with conn:
+        conn.executemany('''
+            INSERT INTO borrowing_records (user_id, book_id, borrow_date, due_date,
+                                           return_date, status, fine_amount)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', records)
+        conn.executemany(
+            'UPDATE books SET available_copies = available_copies - ? WHERE book_id = ?',
+            [(n, book_id) for book_id, n in active.items() if n])
+
+    with conn:
+        conn.executemany(
+            'INSERT INTO reviews (user_id, book_id, rating, review_text) VALUES (?, ?, ?, ?)',
+            _reviews(rng, users, len(copies), reviews))
+    recommendations.refresh(full=True)
+
+    conn.execute('PRAGMA optimize')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')  # Leave one self-contained file to copy
+    shape = {
+        'users': users,
+        'books': len(copies),
+        'loans': len(records),
+        'active_loans': sum(active.values()),
+        'reviews': conn.execute('SELECT COUNT(*) FROM reviews').fetchone()[0],
+        'seed': seed,
+    }
+    conn.close()
+    return shape
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic library database')
+    parser.add_argument('path', help='database file to create')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for name in SCALES['small']:
+        parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} already exists')
+    sizes = {name: getattr(args, name) or default for name, default in SCALES[args.scale].items()}
+    database.DATABASE_NAME = args.path
+    shape = generate(seed=args.seed, **sizes)
+    print(', '.join(f'{value} {name}' for name, value in shape.items() if name != 'seed'),
+          file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Bulk import throughput.
+
+Writes a synthetic catalog to a temporary CSV (or NDJSON) file and loads
+it with importer.import_file, first into an empty database and then again
+over the same rows to time the upsert path.
+
+    python -m benchmarks.import_bench --rows 1000000 [--format ndjson] [--online]
+"""
+import argparse
+import csv
+import json
+import os
+import tempfile
+
+import importer
+from benchmarks.common import temp_database
+from benchmarks.search_bench import synthetic_books
+
+CATALOG_COLUMNS = importer.BOOK_COLUMNS[:-1]  # synthetic rows have no cover image
+
+def write_catalog(path, rows, fmt):
+    with open(path, 'w', newline='', encoding='utf-8') as out:
+        if fmt == 'csv':
+            writer = csv.writer(out)
+            writer.writerow(CATALOG_COLUMNS)
+            writer.writerows(synthetic_books(rows))
+        else:
+            for row in synthetic_books(rows):
+                out.write(json.dumps(dict(zip(CATALOG_COLUMNS, row))) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--format', choices=sorted(importer.READERS), default='csv')
+    parser.add_argument('--batch-size', type=int, default=importer.DEFAULT_BATCH_SIZE)
+    parser.add_argument('--online', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='library-import-')
+    path = os.path.join(workdir, f'catalog.{args.format}')
+    write_catalog(path, args.rows, args.format)
+    print(f"{args.rows} rows, {os.path.getsize(path) / 1e6:.0f} MB {args.format}, "
+          f"batch size {args.batch_size}, {'online' if args.online else 'deferred indexes'}")
+
+    try:
+        with temp_database():
+            for label in ('insert', 'upsert'):
+                stats = importer.import_file(path, args.format, batch_size=args.batch_size,
+                                             defer=not args.online)
+                print(f"{label:>8}: {stats['rows']} rows in {stats['seconds']}s "
+                      f"({stats['rows_per_sec']} rows/sec, {stats['inserted']} new)")
+    finally:
+        os.remove(path)
+        os.rmdir(workdir)
+
+if __name__ == '__main__':
+    main()
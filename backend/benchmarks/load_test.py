@@ -0,0 +1,168 @@
+"""HTTP load test against gunicorn at different worker counts.
+
+Seeds a SQLite file, starts `gunicorn -c gunicorn.conf.py wsgi:app` on it
+for each worker count, and drives the catalog, borrow and login endpoints
+from concurrent keep-alive clients, reporting requests/sec and p50/p99
+latency per endpoint.
+
+    python -m benchmarks.load_test --workers 1 2 4 --clients 16 --duration 10
+
+The clients run in this process, so on a small machine they compete with
+the server for CPU; compare runs on the same host only.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+import database
+import passwords
+from importer import BOOK_COLUMNS, import_books
+from benchmarks.common import percentile
+from benchmarks.search_bench import search_terms, synthetic_books
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+USERS = 200
+
+def seed(path, books):
+    """Create a catalog of synthetic books with plenty of copies, and users"""
+    database.DATABASE_NAME = path
+    database.init_db()
+    rows = (dict(zip(BOOK_COLUMNS, row), total_copies=100000, available_copies=100000)
+            for row in synthetic_books(books))
+    import_books(rows)
+
+    # One KDF run shared by every user keeps seeding fast
+    password_hash = passwords.hash_password('password123')
+    conn = database.get_db_connection()
+    conn.executemany(
+        'INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)',
+        [(f'load{i}', f'load{i}@example.com', password_hash) for i in range(USERS)])
+    conn.commit()
+    conn.close()
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(path, workers, threads):
+    port = _free_port()
+    env = dict(os.environ, LIBRARY_DATABASE=path, LIBRARY_WORKERS=str(workers),
+               LIBRARY_THREADS=str(threads), LIBRARY_BIND=f'127.0.0.1:{port}',
+               LIBRARY_SCHEDULER='0')
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError('gunicorn did not start')
+
+def _books(rng, terms):
+    if rng.random() < 0.5:
+        return 'GET', f'/api/books?limit=20&search={urllib.parse.quote(rng.choice(terms))}', None
+    return 'GET', f'/api/books/{rng.randint(1, 1000)}', None
+
+def _borrow(rng, terms):
+    body = {'user_id': rng.randint(1, USERS), 'book_id': rng.randint(1, 1000)}
+    return 'POST', '/api/borrow', body
+
+def _login(rng, terms):
+    return 'POST', '/api/login', {'username': f'load{rng.randrange(USERS)}',
+                                  'password': 'password123'}
+
+ENDPOINTS = {'books': _books, 'borrow': _borrow, 'login': _login}
+
+def drive(port, make_request, clients, duration):
+    """Run clients keep-alive connections for duration seconds"""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    terms = search_terms()
+    deadline = time.monotonic() + duration
+
+    def client(seed):
+        rng = random.Random(seed)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, codes = [], {}
+        while time.monotonic() < deadline:
+            method, url, body = make_request(rng, terms)
+            payload = json.dumps(body) if body is not None else None
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            started = time.perf_counter()
+            try:
+                conn.request(method, url, payload, headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = 'error'
+            mine.append((time.perf_counter() - started) * 1000)
+            codes[status] = codes.get(status, 0) + 1
+        conn.close()
+        with lock:
+            latencies.extend(mine)
+            for status, count in codes.items():
+                statuses[status] = statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per endpoint')
+    parser.add_argument('--books', type=int, default=10000)
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS),
+                        default=['books', 'borrow', 'login'])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='library-load-')
+    path = os.path.join(workdir, 'library.db')
+    try:
+        seed(path, args.books)
+        print(f"{args.books} books, {args.clients} clients, {args.threads} threads/worker, "
+              f"{args.duration:g}s per endpoint")
+        print(f"{'workers':>7} {'endpoint':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+        for workers in args.workers:
+            server, port = start_server(path, workers, args.threads)
+            try:
+                for name in args.endpoints:
+                    latencies, statuses = drive(port, ENDPOINTS[name], args.clients,
+                                                args.duration)
+                    print(f"{workers:>7} {name:>8} {len(latencies) / args.duration:>8.0f} "
+                          f"{percentile(latencies, 50):>8.1f} {percentile(latencies, 99):>8.1f}"
+                          f"  {statuses}")
+            finally:
+                server.terminate()
+                server.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Login throughput and latency under concurrent clients.
+
+Drives POST /api/login through Flask's test client from 1, 8 and 64
+threads and reports logins/sec, p50/p99 latency and how many requests
+were shed with 503. --inline hashes on the request thread for comparison.
+
+    python -m benchmarks.login_bench --clients 1 8 64 --requests 200
+"""
+import argparse
+import threading
+import time
+
+import passwords
+from benchmarks.common import temp_database, percentile
+
+USERS = 16
+
+def run(clients, requests):
+    from app import app
+    from models import User
+
+    for i in range(USERS):
+        User.create(f'bench{i}', f'bench{i}@example.com', 'password123')
+
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    per_client = max(1, requests // clients)
+    start = threading.Barrier(clients)
+
+    def client(n):
+        http = app.test_client()
+        start.wait()
+        for i in range(per_client):
+            body = {'username': f'bench{(n + i) % USERS}', 'password': 'password123'}
+            began = time.perf_counter()
+            status = http.post('/api/login', json=body).status_code
+            elapsed = (time.perf_counter() - began) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    began = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - began
+    return statuses.get(200, 0) / wall, percentile(latencies, 50), percentile(latencies, 99), statuses
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--requests', type=int, default=128, help='total logins per run')
+    parser.add_argument('--inline', action='store_true', help='hash on the request thread')
+    args = parser.parse_args()
+
+    if args.inline:
+        passwords._run = lambda fn, *fn_args: fn(*fn_args)
+
+    mode = 'inline' if args.inline else f'{passwords.HASH_EXECUTOR} pool x{passwords.HASH_WORKERS}'
+    print(f"KDF {passwords.PASSWORD_HASH_METHOD}, {mode}, queue limit {passwords.HASH_QUEUE_LIMIT}")
+    print(f"{'clients':>8} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8}  statuses")
+    for clients in args.clients:
+        with temp_database():
+            rate, p50, p99, statuses = run(clients, args.requests)
+        print(f"{clients:>8} {rate:>9.1f} {p50:>8.1f} {p99:>8.1f}  {statuses}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Workloads for the benchmark suite.
+
+A scenario is a weighted mix of API calls. Each simulated client has a
+Session that draws the next call from the mix with its own seeded RNG
+and remembers what it needs for follow-up calls (loans to return, the
+next-page cursor), so a run is reproducible for a given seed and
+dataset. Between them the scenarios cover every API endpoint.
+"""
+import json
+import random
+from collections import namedtuple
+
+from seed_data import SAMPLE_PASSWORD, SAMPLE_USERS
+from benchmarks.search_bench import CATEGORIES, search_terms
+
+Request = namedtuple('Request', 'endpoint method path body')
+
+# Share of the catalog that checkout_rush concentrates on
+HOT_BOOK_SHARE = 0.01
+
+class Session:
+    """One simulated client working against a datagen dataset"""
+
+    def __init__(self, shape, seed):
+        self.shape = shape
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.terms = search_terms()
+        self.loans = []
+        self.cursor = None
+        self.registered = 0
+
+    def user_id(self):
+        return self.rng.randint(1, self.shape['users'])
+
+    def book_id(self, hot=False):
+        books = self.shape['books']
+        if hot:
+            return self.rng.randint(1, max(1, int(books * HOT_BOOK_SHARE)))
+        return self.rng.randint(1, books)
+
+    def next_request(self, mix):
+        makers, weights = mix
+        return self.rng.choices(makers, cum_weights=weights)[0](self)
+
+    def handle(self, request, status, headers, body):
+        """Keep what later requests need from a response"""
+        if request.endpoint == 'list_books':
+            self.cursor = headers.get('X-Next-Cursor') if status == 200 else None
+        elif request.endpoint == 'borrow' and status == 201:
+            self.loans.append(json.loads(body)['record_id'])
+        elif request.endpoint == 'borrow_batch' and status == 200:
+            self.loans.extend(result['record_id'] for result in json.loads(body)['results']
+                              if result['status'] == 201)
+
+def list_books(session):
+    path = '/api/books?limit=20'
+    if session.cursor and session.rng.random() < 0.7:
+        path += f'&after={session.cursor}'
+    elif session.rng.random() < 0.3:
+        path += f'&category={session.rng.choice(CATEGORIES)}'
+    return Request('list_books', 'GET', path, None)
+
+def search(session):
+    term = session.rng.choice(session.terms).replace(' ', '+')
+    return Request('search', 'GET', f'/api/books?limit=20&search={term}', None)
+
+def book(session):
+    return Request('book', 'GET', f'/api/books/{session.book_id()}', None)
+
+def books_by_ids(session):
+    ids = ','.join(str(session.book_id()) for _ in range(10))
+    return Request('books_by_ids', 'GET', f'/api/books?ids={ids}', None)
+
+def top_books(session):
+    return Request('top_books', 'GET', '/api/books/top?limit=20', None)
+
+def borrow(session):
+    return Request('borrow', 'POST', '/api/borrow',
+                   {'user_id': session.user_id(), 'book_id': session.book_id(hot=True)})
+
+def borrow_batch(session):
+    book_ids = sorted({session.book_id(hot=True) for _ in range(5)})
+    return Request('borrow_batch', 'POST', '/api/borrow/batch',
+                   {'user_id': session.user_id(), 'book_ids': book_ids})
+
+def return_loan(session):
+    if not session.loans:
+        return borrow(session)
+    record_id = session.loans.pop(session.rng.randrange(len(session.loans)))
+    return Request('return', 'POST', f'/api/return/{record_id}', None)
+
+def return_batch(session):
+    if len(session.loans) < 2:
+        return borrow_batch(session)
+    record_ids, session.loans = session.loans[:5], session.loans[5:]
+    return Request('return_batch', 'POST', '/api/return/batch', {'record_ids': record_ids})
+
+def reserve(session):
+    return Request('reserve', 'POST', '/api/reserve',
+                   {'user_id': session.user_id(), 'book_id': session.book_id(hot=True)})
+
+def holds(session):
+    return Request('holds', 'GET', f'/api/books/{session.book_id(hot=True)}/holds', None)
+
+def user_borrowed(session):
+    return Request('user_borrowed', 'GET', f'/api/user/{session.user_id()}/borrowed', None)
+
+def user_reservations(session):
+    return Request('user_reservations', 'GET',
+                   f'/api/user/{session.user_id()}/reservations', None)
+
+def book_reviews(session):
+    return Request('book_reviews', 'GET', f'/api/books/{session.book_id()}/reviews', None)
+
+def similar_books(session):
+    return Request('similar_books', 'GET', f'/api/books/{session.book_id()}/similar', None)
+
+def user_recommendations(session):
+    return Request('user_recommendations', 'GET',
+                   f'/api/user/{session.user_id()}/recommendations?limit=10', None)
+
+def create_review(session):
+    return Request('create_review', 'POST', '/api/reviews',
+                   {'user_id': session.user_id(), 'book_id': session.book_id(),
+                    'rating': session.rng.randint(1, 5), 'review_text': 'Benchmark review'})
+
+def login(session):
+    user_id = session.user_id()
+    if user_id <= len(SAMPLE_USERS):
+        username = SAMPLE_USERS[user_id - 1][0]
+    else:
+        username = f'patron{user_id - len(SAMPLE_USERS) - 1}'
+    return Request('login', 'POST', '/api/login',
+                   {'username': username, 'password': SAMPLE_PASSWORD})
+
+def register(session):
+    session.registered += 1
+    name = f'bench{session.seed}x{session.registered}'
+    return Request('register', 'POST', '/api/register',
+                   {'username': name, 'email': f'{name}@example.com', 'password': SAMPLE_PASSWORD})
+
+def landing(session):
+    return Request('landing', 'GET', '/', None)
+
+def health(session):
+    return Request('health', 'GET', '/api/health', None)
+
+def metrics(session):
+    return Request('metrics', 'GET', '/api/metrics', None)
+
+def _mix(*weighted):
+    """(makers, cumulative weights) for Session.next_request"""
+    makers, cum_weights, total = [], [], 0
+    for weight, maker in weighted:
+        total += weight
+        makers.append(maker)
+        cum_weights.append(total)
+    return makers, cum_weights
+
+SCENARIOS = {
+    'browse': _mix((4, list_books), (3, book), (1, books_by_ids), (1, top_books),
+                   (1, book_reviews), (1, similar_books)),
+    'search': _mix((1, search)),
+    'checkout_rush': _mix((4, borrow), (3, return_loan), (1, borrow_batch), (1, return_batch),
+                          (1, reserve), (1, holds), (1, user_borrowed)),
+    'review_reads': _mix((6, book_reviews), (2, top_books), (1, book), (1, create_review)),
+    'accounts': _mix((2, login), (1, register), (3, user_borrowed), (3, user_reservations),
+                     (2, user_recommendations)),
+    'ops': _mix((1, landing), (2, health), (1, metrics)),
+}
@@ -0,0 +1,90 @@
+"""Catalog search latency: LIKE scan vs FTS5 index.
+
+Builds synthetic catalogs of increasing size and times Book.get_all()
+searches through both paths.
+
+    python -m benchmarks.search_bench --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+
+import models
+from importer import BOOK_COLUMNS, import_books
+from models import Book
+from benchmarks.common import temp_database, percentile
+
+SYLLABLES = 'ka lo mi ren tor sa vel din or ith bra qu el zan mor fi ta ly ne gar'.split()
+SURNAMES = 'Smith Garcia Okafor Tanaka Novak Haddad Larsen Moreau Silva Kowalski'.split()
+CATEGORIES = 'Fiction Fantasy Biography History Science Romance Business Poetry'.split()
+
+def _vocabulary(size, rng):
+    """Distinct pseudo-words; earlier words are drawn more often (Zipf-like)"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    words = sorted(words)
+    rng.shuffle(words)
+    weights = [1.0 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+def synthetic_books(count, seed=42, vocabulary_size=20000):
+    """Yield book rows for a reproducible synthetic catalog"""
+    rng = random.Random(seed)
+    words, weights = _vocabulary(vocabulary_size, rng)
+    cum_weights = []
+    total = 0.0
+    for weight in weights:
+        total += weight
+        cum_weights.append(total)
+
+    def pick(k):
+        return rng.choices(words, cum_weights=cum_weights, k=k)
+
+    for i in range(count):
+        title = ' '.join(word.capitalize() for word in pick(rng.randint(2, 5)))
+        author = f'{pick(1)[0].capitalize()} {rng.choice(SURNAMES)}'
+        description = ' '.join(pick(rng.randint(10, 30)))
+        copies = rng.randint(1, 5)
+        yield (f'{9780000000000 + i}', title, author, f'{rng.choice(SURNAMES)} Press',
+               rng.randint(1850, 2024), rng.choice(CATEGORIES), copies, copies, description)
+
+def search_terms(seed=42, vocabulary_size=20000):
+    """Query mix: a few common words, mostly mid- and long-tail ones"""
+    words, _ = _vocabulary(vocabulary_size, random.Random(seed))
+    picks = [words[5], words[50], words[500], words[2000], words[8000], words[15000]]
+    return picks + [f'{words[50]} {words[500]}', words[2000][:4]]
+
+def load_books(count, batch_size=10000):
+    import_books((dict(zip(BOOK_COLUMNS, row)) for row in synthetic_books(count)),
+                 batch_size=batch_size)
+
+def time_searches(use_fts, repeat):
+    models.USE_FTS = use_fts
+    samples, hits = [], 0
+    for _ in range(repeat):
+        for query in search_terms():
+            start = time.perf_counter()
+            hits += len(Book.get_all(query))
+            samples.append((time.perf_counter() - start) * 1000)
+    return samples, hits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'books':>9} {'path':>5} {'p50 ms':>9} {'p99 ms':>9} {'mean ms':>9} {'rows':>8}")
+    for size in args.sizes:
+        with temp_database():
+            load_books(size)
+            for label, use_fts in (('LIKE', False), ('FTS', True)):
+                samples, hits = time_searches(use_fts, args.repeat)
+                print(f"{size:>9} {label:>5} {percentile(samples, 50):>9.2f} "
+                      f"{percentile(samples, 99):>9.2f} {sum(samples) / len(samples):>9.2f} "
+                      f"{hits // args.repeat:>8}")
+    models.USE_FTS = True
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Response size and CPU per encoding for catalog pages.
+
+Requests the same cached /api/books page in each negotiated encoding
+(and as JSON through the standard library encoder, for comparison) and
+reports bytes and CPU time per response.
+
+    python -m benchmarks.serialize_bench --sizes 20 100 500 --requests 200
+"""
+import argparse
+import time
+
+import serializers
+from benchmarks.common import temp_database
+from benchmarks.search_bench import load_books
+
+# (label, Accept header, use orjson)
+ENCODINGS = [
+    ('json (stdlib)', serializers.JSON, False),
+    ('json', serializers.JSON, True),
+    ('columns+json', serializers.COLUMNS_JSON, True),
+    ('msgpack', serializers.MSGPACK, True),
+    ('columns+msgpack', serializers.COLUMNS_MSGPACK, True),
+]
+
+def measure(client, size, accept, requests):
+    """(bytes, CPU microseconds) per response"""
+    url = f'/api/books?limit={size}'
+    headers = {'Accept': accept}
+    body = client.get(url, headers=headers).get_data()  # Warm the page cache
+    started = time.process_time()
+    for _ in range(requests):
+        client.get(url, headers=headers).get_data()
+    return len(body), (time.process_time() - started) / requests * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[20, 100, 500])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    fast_json = serializers.orjson
+    with temp_database():
+        load_books(max(args.sizes))
+        from app import app
+        client = app.test_client()
+
+        print(f"{'rows':>5} {'encoding':<16} {'bytes':>9} {'CPU us':>9} {'vs stdlib':>9}")
+        for size in args.sizes:
+            baseline = None
+            for label, accept, use_orjson in ENCODINGS:
+                if accept in (serializers.MSGPACK, serializers.COLUMNS_MSGPACK) \
+                        and serializers.msgpack is None:
+                    print(f'{size:>5} {label:<16} {"(msgpack not installed)":>29}')
+                    continue
+                if use_orjson and fast_json is None:
+                    print(f'{size:>5} {label:<16} {"(orjson not installed)":>29}')
+                    continue
+                serializers.orjson = fast_json if use_orjson else None
+                try:
+                    size_bytes, cpu = measure(client, size, accept, args.requests)
+                finally:
+                    serializers.orjson = fast_json
+                baseline = baseline or cpu
+                print(f'{size:>5} {label:<16} {size_bytes:>9} {cpu:>9.0f} {baseline / cpu:>8.1f}x')
+
+if __name__ == '__main__':
+    main()
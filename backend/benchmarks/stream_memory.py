@@ -0,0 +1,74 @@
+"""Peak memory of buffered vs streamed GET /api/books.
+
+Each measurement runs in a fresh subprocess and reports how much its peak
+RSS grew while serving the whole catalog in one response. Streamed runs
+still grow a little as SQLite's memory-mapped database pages are touched.
+
+    python -m benchmarks.stream_memory --sizes 10000 50000 200000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+
+from benchmarks.common import temp_database
+from benchmarks.search_bench import load_books
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # macOS reports bytes
+
+def child(db_path, mode, size):
+    """Serve the catalog once in this process and print the RSS growth"""
+    import database
+    database.DATABASE_NAME = db_path
+    import pagination
+    from app import app
+
+    client = app.test_client()
+    if mode == 'buffered':
+        pagination.MAX_PAGE_SIZE = size  # Lift the cap to show the unbounded cost
+        url, headers = f'/api/books?limit={size}', {}
+    elif mode == 'ndjson':
+        url, headers = '/api/books', {'Accept': 'application/x-ndjson'}
+    else:
+        url, headers = '/api/books?stream=1', {}
+
+    client.get('/api/books?limit=1')  # Warm up imports and the connection
+    baseline = _peak_rss_kb()
+    response = client.get(url, headers=headers, buffered=False)
+    sent = sum(len(chunk) for chunk in response.response)
+    response.close()
+    print(json.dumps({'rss_growth_kb': _peak_rss_kb() - baseline, 'bytes': sent}))
+
+def measure(db_path, mode, size):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.stream_memory', '--child', db_path, mode, str(size)],
+        capture_output=True, text=True, check=True, cwd=os.getcwd()
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 200000])
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        db_path, mode, size = args.child
+        child(db_path, mode, int(size))
+        return
+
+    print(f"{'books':>8} {'mode':>9} {'MB sent':>9} {'peak RSS growth MB':>19}")
+    for size in args.sizes:
+        with temp_database() as db_path:
+            load_books(size)
+            for mode in ('buffered', 'json', 'ndjson'):
+                result = measure(db_path, mode, size)
+                print(f"{size:>8} {mode:>9} {result['bytes'] / 2**20:>9.1f} "
+                      f"{result['rss_growth_kb'] / 1024:>19.1f}")
+
+if __name__ == '__main__':
+    main()
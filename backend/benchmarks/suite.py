@@ -0,0 +1,272 @@
+"""Scenario benchmark suite with JSON results and regression checks.
+
+Generates a dataset once (benchmarks/datagen.py), then runs each
+scenario (benchmarks/scenarios.py) on a fresh copy of it, through
+Flask's test client in this process and/or through gunicorn on a local
+port, and writes throughput and latency per scenario and endpoint as
+JSON.
+
+    python -m benchmarks.suite run --scale small --driver client http -o new.json
+    python -m benchmarks.suite compare base.json new.json --threshold 15
+
+compare exits with status 1 if any scenario's throughput fell, or its
+p50/p99 latency rose, by more than the threshold percentage.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+os.environ.setdefault('LIBRARY_SCHEDULER', '0')  # Keep background sweeps out of the numbers
+
+import database
+import models
+from benchmarks.common import percentile
+from benchmarks.datagen import SCALES, generate
+from benchmarks.load_test import start_server
+from benchmarks.scenarios import SCENARIOS, Session
+
+class TestClientDriver:
+    """Requests through Flask's test client, in this process"""
+
+    def __init__(self, db_path):
+        from app import create_app
+        database.DATABASE_NAME = db_path
+        models.book_cache.clear()
+        self.app = create_app()
+
+    def connect(self):
+        return self.app.test_client()
+
+    def request(self, client, method, path, body):
+        response = client.open(path, method=method, json=body)
+        data = response.get_data()
+        response.close()
+        return response.status_code, response.headers, data
+
+    def close(self):
+        database.close_db_connection()
+
+class HttpDriver:
+    """Requests over keep-alive HTTP connections to a gunicorn server"""
+
+    def __init__(self, db_path, workers=2, threads=4):
+        self.server, self.port = start_server(db_path, workers, threads)
+
+    def connect(self):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+
+    def request(self, conn, method, path, body):
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, payload, headers)
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+
+    def close(self):
+        self.server.terminate()
+        self.server.wait()
+
+DRIVERS = {'client': TestClientDriver, 'http': HttpDriver}
+
+def run_scenario(driver, mix, shape, clients, requests, warmup, seed):
+    """Drive one scenario; returns (samples, seconds) with samples of
+    (endpoint, latency ms, status)"""
+    samples = []
+    lock = threading.Lock()
+    ready = threading.Barrier(clients + 1)
+
+    def client(index):
+        session = Session(shape, seed * 1000 + index)
+        conn = driver.connect()
+        mine = []
+        for i in range(warmup + requests):
+            if i == warmup:
+                ready.wait()
+            request = session.next_request(mix)
+            started = time.perf_counter()
+            try:
+                status, headers, body = driver.request(conn, request.method, request.path,
+                                                       request.body)
+                session.handle(request, status, headers, body)
+            except (OSError, http.client.HTTPException):
+                status = 'error'
+                conn = driver.connect()
+            if i >= warmup:
+                mine.append((request.endpoint, (time.perf_counter() - started) * 1000, status))
+        with lock:
+            samples.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+def _latency(latencies):
+    return {'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3)}
+
+def summarize(samples, seconds):
+    """Throughput, latency percentiles and status counts, overall and per endpoint"""
+    statuses, endpoints, errors = {}, {}, 0
+    for endpoint, latency, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        endpoints.setdefault(endpoint, []).append(latency)
+        errors += status == 'error' or status >= 500
+    return dict(
+        requests=len(samples),
+        seconds=round(seconds, 3),
+        rps=round(len(samples) / seconds, 1) if seconds else 0.0,
+        **_latency([latency for _, latency, _ in samples]),
+        errors=errors,
+        statuses=statuses,
+        endpoints={name: dict(count=len(latencies), **_latency(latencies))
+                   for name, latencies in sorted(endpoints.items())},
+    )
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _copy_database(template, path):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.copyfile(template, path)
+
+def run(args):
+    sizes = {name: getattr(args, name) or default for name, default in SCALES[args.scale].items()}
+    workdir = tempfile.mkdtemp(prefix='library-suite-')
+    template = os.path.join(workdir, 'template.db')
+    path = os.path.join(workdir, 'library.db')
+    results = {}
+    try:
+        database.DATABASE_NAME = template
+        shape = generate(seed=args.seed, **sizes)
+        for driver_name in args.driver:
+            for name in args.scenarios:
+                _copy_database(template, path)
+                if driver_name == 'http':
+                    driver = HttpDriver(path, args.workers, args.threads)
+                else:
+                    driver = TestClientDriver(path)
+                try:
+                    samples, seconds = run_scenario(driver, SCENARIOS[name], shape, args.clients,
+                                                    args.requests, args.warmup, args.seed)
+                finally:
+                    driver.close()
+                summary = results[f'{driver_name}/{name}'] = summarize(samples, seconds)
+                print(f"{driver_name:>6} {name:<14} {summary['rps']:>8.0f} req/s  "
+                      f"p50 {summary['p50_ms']:>7.2f} ms  p99 {summary['p99_ms']:>7.2f} ms  "
+                      f"errors {summary['errors']}", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': args.scale,
+            'dataset': shape,
+            'clients': args.clients,
+            'requests_per_client': args.requests,
+            'warmup': args.warmup,
+            'workers': args.workers,
+            'threads': args.threads,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(report, out, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+def _change(before, after):
+    return (after - before) / before * 100 if before else 0.0
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    print(f"{'scenario':<22} {'req/s':>16} {'p50 ms':>16} {'p99 ms':>16}")
+    for name, before in baseline['results'].items():
+        after = candidate['results'].get(name)
+        if after is None:
+            print(f'{name:<22} missing from {args.candidate}')
+            continue
+        rps = _change(before['rps'], after['rps'])
+        p50 = _change(before['p50_ms'], after['p50_ms'])
+        p99 = _change(before['p99_ms'], after['p99_ms'])
+        flags = [label for label, worse in (('throughput', -rps), ('p50', p50), ('p99', p99))
+                 if worse > args.threshold]
+        regressions += bool(flags)
+        print(f"{name:<22} {after['rps']:>8.0f} {rps:>+6.1f}% {after['p50_ms']:>8.2f} {p50:>+6.1f}%"
+              f" {after['p99_ms']:>8.2f} {p99:>+6.1f}%"
+              + (f"  REGRESSION ({', '.join(flags)})" if flags else ''))
+
+    for key in ('commit', 'scale', 'cpus', 'clients'):
+        if baseline['meta'].get(key) != candidate['meta'].get(key):
+            print(f"note: {key} differs ({baseline['meta'].get(key)} -> "
+                  f"{candidate['meta'].get(key)})")
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='Scenario benchmarks for the library API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run scenarios and write JSON results')
+    run_parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    for name in SCALES['small']:
+        run_parser.add_argument(f'--{name}', type=int, help=f'override the number of {name}')
+    run_parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS),
+                            default=list(SCENARIOS))
+    run_parser.add_argument('--driver', nargs='+', choices=sorted(DRIVERS), default=['client'])
+    run_parser.add_argument('--clients', type=int, default=4)
+    run_parser.add_argument('--requests', type=int, default=250, help='per client')
+    run_parser.add_argument('--warmup', type=int, default=20, help='untimed requests per client')
+    run_parser.add_argument('--workers', type=int, default=2, help='gunicorn workers (http)')
+    run_parser.add_argument('--threads', type=int, default=4, help='threads per worker (http)')
+    run_parser.add_argument('--seed', type=int, default=42)
+    run_parser.add_argument('-o', '--output', help='results file (default: stdout)')
+
+    compare_parser = commands.add_parser('compare', help='flag regressions between two runs')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=15.0,
+                                help='percent change that counts as a regression')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+if __name__ == '__main__':
+    main()
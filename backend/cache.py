@@ -0,0 +1,180 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+class CacheBackend:
+    """Storage interface for the model read-through cache.
+
+    Entries carry tags; invalidating a tag drops every entry tagged with it.
+    Cached values are shared between callers and must not be mutated.
+    """
+
+    def get(self, key, default=None):
+        """Return the cached value, or default on a miss"""
+        raise NotImplementedError
+
+    def set(self, key, value, tags=(), token=None, ttl=None):
+        """Store value under key.
+
+        token is the generation() seen before the value was read from the
+        database; if anything was invalidated since, the value may already
+        be stale and is not stored. ttl overrides the cache's lifetime for
+        this entry, in seconds.
+        """
+        raise NotImplementedError
+
+    def generation(self):
+        """Counter that changes whenever entries are invalidated"""
+        raise NotImplementedError
+
+    def invalidate_tags(self, *tags):
+        """Drop every entry carrying any of the given tags"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Drop every entry"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Return hit/miss/eviction counters"""
+        raise NotImplementedError
+
+class LRUCache(CacheBackend):
+    """In-process LRU cache with a per-entry TTL and a size bound"""
+
+    def __init__(self, max_entries=1024, ttl=30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}                # tag -> set of keys
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0,
+                          'expirations': 0, 'invalidations': 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return default
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return entry[1]
+
+    def set(self, key, value, tags=(), token=None, ttl=None):
+        with self._lock:
+            if token is not None and token != self._generation:
+                return
+            self._remove(key)
+            expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+            self._entries[key] = (expires_at, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def generation(self):
+        with self._lock:
+            return self._generation
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if self._remove(key):
+                        self._counters['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._tags.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        return stats
+
+    def _remove(self, key):
+        """Drop key and its tag links; caller holds the lock"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+        return True
+
+class RedisCache(CacheBackend):
+    """Cache stored in Redis, or anything with the same get/set/delete/
+    incr/sadd/smembers/expire/scan_iter API, so it can be shared across
+    processes.
+
+    Values are stored as JSON. Evictions happen inside the server and are
+    not counted here.
+    """
+
+    def __init__(self, client, ttl=30, prefix='library:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def get(self, key, default=None):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self._count('misses')
+            return default
+        self._count('hits')
+        return json.loads(raw)
+
+    def set(self, key, value, tags=(), token=None, ttl=None):
+        if token is not None and token != self.generation():
+            return
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            self.client.sadd(tag_key, key)
+            self.client.expire(tag_key, max(ttl, self.ttl))
+
+    def generation(self):
+        return int(self.client.get(self.prefix + 'generation') or 0)
+
+    def invalidate_tags(self, *tags):
+        self.client.incr(self.prefix + 'generation')
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            keys = [self.prefix + (k.decode() if isinstance(k, bytes) else k)
+                    for k in self.client.smembers(tag_key)]
+            if keys:
+                self._count('invalidations', self.client.delete(*keys))
+            self.client.delete(tag_key)
+
+    def clear(self):
+        self.client.incr(self.prefix + 'generation')
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            if key not in (self.prefix + 'generation', (self.prefix + 'generation').encode()):
+                self.client.delete(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,79 @@
+"""Conditional-GET regression check for the list endpoints.
+
+Takes a list's validators, removes a row from the list, and checks that
+neither If-None-Match nor If-Modified-Since with the old validators gets
+a 304. Exits non-zero on any stale 304.
+
+    python check_conditional_gets.py
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault('LIBRARY_SCHEDULER', '0')
+
+import database
+import models
+from benchmarks.common import temp_database
+
+def _seed(conn):
+    conn.executemany('''
+        INSERT INTO books (isbn, title, author, category, total_copies, available_copies)
+        VALUES (?, ?, ?, 'Fiction', 1, 1)
+    ''', [('1111111111', 'River Song', 'A. Writer'),
+          ('2222222222', 'Stone Garden', 'B. Writer'),
+          ('3333333333', 'Paper Moon', 'C. Writer')])
+    conn.executemany('''
+        INSERT INTO users (user_id, username, email, password_hash) VALUES (?, ?, ?, 'x')
+    ''', [(n, f'patron{n}', f'patron{n}@example.com') for n in (1, 2)])
+    conn.commit()
+
+def _stale(client, url, change):
+    """Names of the validators that still get 304 after change() runs"""
+    first = client.get(url)
+    # Last-Modified has one-second resolution
+    time.sleep(1.1)
+    change()
+    stale = []
+    for name, headers in [('If-None-Match', {'If-None-Match': first.headers['ETag']}),
+                          ('If-Modified-Since', {'If-Modified-Since': first.headers['Last-Modified']})]:
+        if client.get(url, headers=headers).status_code == 304:
+            stale.append(name)
+    return stale
+
+def _return_newest_loan():
+    models.BorrowingRecord.create(1, 1)
+    newest = models.BorrowingRecord.create(1, 2)
+    return lambda: models.BorrowingRecord.return_book(newest)
+
+def _fulfil_hold():
+    models.BorrowingRecord.create(2, 3)
+    models.Reservation.create(1, 3)
+    models.Reservation.create(1, 1)
+    return lambda: models.BorrowingRecord.create(1, 1)
+
+# url -> setup returning the change that drops a row from that list
+CASES = {
+    '/api/user/1/borrowed': _return_newest_loan,
+    '/api/user/1/reservations': _fulfil_hold,
+}
+
+def main():
+    from app import app
+    failures = 0
+    for url, setup in CASES.items():
+        with temp_database():
+            conn = database.get_db_connection()
+            _seed(conn)
+            conn.close()
+            change = setup()
+            stale = _stale(app.test_client(), url, change)
+            for name in stale:
+                print(f"FAIL     {url}: stale 304 for {name} after a row left the list")
+            failures += len(stale)
+
+    print(f"{failures} problem(s)" if failures else "No stale 304s")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
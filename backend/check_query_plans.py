@@ -0,0 +1,209 @@
+"""Query-plan regression check for every SQL statement in models.py.
+
+Runs each model method against a small scratch database, captures the
+statements it executes through the sqlite3 trace callback, and runs
+EXPLAIN QUERY PLAN on each one. Exits non-zero if any plan does a full
+table SCAN or builds a TEMP B-TREE, or if a model method has no entry
+in SCENARIOS.
+
+    python check_query_plans.py [-v]
+"""
+import inspect
+import re
+import sys
+from datetime import datetime, timedelta
+
+import database
+import models
+from benchmarks.common import temp_database
+
+# Plans that are full scans on purpose: (SQL pattern, reason)
+ALLOWED_SCANS = [
+    (r'FROM books b LEFT JOIN book_rating_stats s ON s\.book_id = b\.book_id '
+     r'WHERE 1=1 ORDER BY b\.book_id( LIMIT \d+)?$',
+     'first page of the unfiltered catalog walks the primary key'),
+    (r'FROM book_rating_stats s .* WHERE s\.review_count >= \d+ ORDER BY s\.average_rating DESC',
+     'first page of top-rated books walks idx_rating_stats_top from the top'),
+    (r'WHERE books_fts MATCH .* ORDER BY books_fts\.rank, b\.book_id',
+     'FTS5 materializes and ranks every match anyway; book_id only breaks ties'),
+]
+
+def _hold_queue_cycle():
+    """Hold both copies of book 2, queue three more users (and have the
+    first user reserve again), then borrow one hold and return it"""
+    for user_id in (1, 101, 102, 103, 104, 1):
+        models.Reservation.create(user_id, 2)
+    record_id = models.BorrowingRecord.create(1, 2)
+    models.BorrowingRecord.return_book(record_id)
+
+# Calls exercising every public model method. Records created by earlier
+# calls (user 1, books 1-2, records 1-5) are reused by later ones.
+SCENARIOS = {
+    'User.create': lambda: models.User.create('plancheck', 'plan@example.com', 'secret'),
+    'User.authenticate': lambda: models.User.authenticate('plancheck', 'secret'),
+    'User.get_by_id': lambda: models.User.get_by_id(1),
+    'Book.get_all': lambda: (
+        models.Book.get_all(),
+        models.Book.get_all(limit=10, after=[1]),
+        models.Book.get_all(search='river', limit=10),
+        models.Book.get_all(category='Fiction', limit=10, after=[1]),
+        models.Book.get_all(search='river', category='Fiction', fields=['title']),
+    ),
+    'Book.get_by_id': lambda: models.Book.get_by_id(1),
+    'Book.get_many': lambda: (
+        models.Book.get_many([2, 1, 3]),
+        models.Book.get_many([1, 2], fields=['title']),
+    ),
+    'Book.get_top_rated': lambda: (
+        models.Book.get_top_rated(),
+        models.Book.get_top_rated(3, limit=10, after=[4.5, 3, 1]),
+    ),
+    'Book.get_version': lambda: models.Book.get_version(1),
+    'Book.update_availability': lambda: models.Book.update_availability(2, 1),
+    'BorrowingRecord.create': lambda: models.BorrowingRecord.create(1, 1),
+    'BorrowingRecord.return_book': lambda: models.BorrowingRecord.return_book(1),
+    'BorrowingRecord.create_batch': lambda: models.BorrowingRecord.create_batch(1, [1, 2, 2]),
+    'BorrowingRecord.return_batch': lambda: models.BorrowingRecord.return_batch([2, 3, 4, 9]),
+    'BorrowingRecord.accrue_fines': lambda: (
+        models.BorrowingRecord.create(1, 1),
+        models.BorrowingRecord.accrue_fines(datetime.now() + timedelta(days=30), batch_size=1),
+    ),
+    'BorrowingRecord.get_user_borrowed': lambda: (
+        models.BorrowingRecord.get_user_borrowed(1),
+        models.BorrowingRecord.get_user_borrowed(1, limit=10, after=['2000-01-01', 1]),
+    ),
+    'BorrowingRecord.get_user_borrowed_version':
+        lambda: models.BorrowingRecord.get_user_borrowed_version(1),
+    'Reservation.create': lambda: _hold_queue_cycle(),
+    'Reservation.expire_overdue': lambda: (
+        models.Reservation.expire_overdue(batch_size=1),
+        models.Reservation.expire_overdue(datetime.now() + timedelta(days=30)),
+    ),
+    'Reservation.get_book_queue': lambda: (
+        models.Reservation.get_book_queue(2),
+        models.Reservation.get_book_queue(2, limit=10, after=[1]),
+    ),
+    'Reservation.get_user_reservations': lambda: (
+        models.Reservation.get_user_reservations(1),
+        models.Reservation.get_user_reservations(1, 'ready'),
+        models.Reservation.get_user_reservations(1, limit=10, after=['2000-01-01', 1]),
+    ),
+    'Reservation.get_user_reservations_version':
+        lambda: models.Reservation.get_user_reservations_version(1),
+    'Review.create': lambda: models.Review.create(1, 1, 5, 'Great'),
+    'Review.get_book_reviews': lambda: (
+        models.Review.get_book_reviews(1),
+        models.Review.get_book_reviews(1, limit=10, after=['2100-01-01', 1]),
+    ),
+    'Review.get_book_reviews_version': lambda: models.Review.get_book_reviews_version(1),
+    'Recommendation.get_similar': lambda: (
+        models.Recommendation.get_similar(1),
+        models.Recommendation.get_similar(1, limit=10, after=[1], fields=['title', 'score']),
+    ),
+    'Recommendation.get_for_user': lambda: (
+        models.Recommendation.get_for_user(1),
+        models.Recommendation.get_for_user(1, 5, fields=['title']),
+    ),
+}
+
+PLAN_STATEMENTS = ('SELECT', 'UPDATE', 'DELETE', 'WITH', 'INSERT')
+
+# Schema probes and FTS5's own shadow-table queries are not ours to index
+INTERNAL_SQL = re.compile(r"sqlite_master|'main'\.")
+
+def model_methods():
+    """Names of all public model methods, e.g. 'Book.get_all'"""
+    names = set()
+    for class_name, cls in inspect.getmembers(models, inspect.isclass):
+        if cls.__module__ != models.__name__:
+            continue
+        for name, _ in inspect.getmembers(cls, inspect.isfunction):
+            if not name.startswith('_'):
+                names.add(f'{class_name}.{name}')
+    return names
+
+def _seed(conn):
+    conn.executemany('''
+        INSERT INTO books (isbn, title, author, category, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, 2, 2)
+    ''', [('1111111111', 'River Song', 'A. Writer', 'Fiction'),
+          ('2222222222', 'Stone Garden', 'B. Writer', 'Poetry')])
+    # Patrons queueing behind user 1 (whom User.create adds) in _hold_queue_cycle
+    conn.executemany('''
+        INSERT INTO users (user_id, username, email, password_hash) VALUES (?, ?, ?, 'x')
+    ''', [(n, f'patron{n}', f'patron{n}@example.com') for n in range(101, 105)])
+    conn.executemany('''
+        INSERT INTO book_similarities (book_id, rank, similar_book_id, score) VALUES (?, 1, ?, 0.5)
+    ''', [(1, 2), (2, 1)])
+    conn.commit()
+
+def capture_statements():
+    """Run every scenario and return {method: [sql, ...]}"""
+    captured = {}
+    current = []
+    connections = [database.db_connection, database.read_connection]
+    for connection in connections:
+        with connection() as conn:
+            conn.set_trace_callback(current.append)
+    try:
+        for method, scenario in SCENARIOS.items():
+            models.book_cache.clear()  # Cached reads would skip the SQL
+            current.clear()
+            scenario()
+            captured[method] = [sql for sql in current
+                                if sql.lstrip().upper().startswith(PLAN_STATEMENTS)
+                                and not INTERNAL_SQL.search(sql)]
+    finally:
+        for connection in connections:
+            with connection() as conn:
+                conn.set_trace_callback(None)
+    return captured
+
+def plan_problems(conn, sql):
+    """Return (plan lines, problems) for one statement"""
+    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    flat = ' '.join(sql.split())
+    if any(re.search(pattern, flat) for pattern, _ in ALLOWED_SCANS):
+        return plan, []
+
+    problems = []
+    for line in plan:
+        if line.startswith('SCAN ') and 'VIRTUAL TABLE' not in line:
+            problems.append(line)
+        elif 'USE TEMP B-TREE' in line:
+            problems.append(line)
+    return plan, problems
+
+def main():
+    verbose = '-v' in sys.argv[1:]
+    failures = 0
+
+    with temp_database():
+        conn = database.get_db_connection()
+        _seed(conn)
+
+        missing = model_methods() - set(SCENARIOS)
+        for method in sorted(missing):
+            print(f"MISSING  {method}: add it to SCENARIOS")
+            failures += 1
+
+        for method, statements in capture_statements().items():
+            for sql in statements:
+                plan, problems = plan_problems(conn, sql)
+                flat = ' '.join(sql.split())
+                if problems:
+                    failures += 1
+                    print(f"FAIL     {method}: {flat}")
+                    for line in plan:
+                        print(f"           {line}")
+                elif verbose:
+                    print(f"ok       {method}: {flat}")
+                    for line in plan:
+                        print(f"           {line}")
+        conn.close()
+
+    print(f"{failures} problem(s)" if failures else "All query plans use indexes")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""Response compression, chosen by Accept-Encoding.
+
+gzip is always offered; br and zstd are offered (and preferred) when the
+brotli and zstandard packages are installed. Bodies under MIN_SIZE bytes
+are sent uncompressed, as the saving would not cover the overhead.
+Streamed lists are compressed chunk by chunk, flushing after each batch.
+
+A response whose body is fully determined by a version can be marked
+with cacheable(): conditional GETs by their ETag, cached catalog pages by
+the cache entry they were read from. Its compressed bytes are kept in
+payload_cache under that version and the encoding, so a hot page is
+compressed once rather than on every request.
+
+    LIBRARY_COMPRESSION=0            turn compression off (e.g. behind a compressing proxy)
+    LIBRARY_COMPRESS_MIN_SIZE=1024   smallest body worth compressing, in bytes
+"""
+import gzip
+import inspect
+import os
+import threading
+import time
+import zlib
+
+from flask import request
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_ENABLED = os.environ.get('LIBRARY_COMPRESSION', '1') != '0'
+MIN_SIZE = int(os.environ.get('LIBRARY_COMPRESS_MIN_SIZE', 1024))
+
+# Per-encoding levels: quick enough to run on every uncached response
+LEVELS = {'br': 5, 'zstd': 3, 'gzip': 6}
+
+# Compressed bodies by version and encoding. A new version means a new
+# key, so entries never go stale; the TTL only frees dead versions sooner.
+PAYLOAD_CACHE_ENTRIES = 256
+PAYLOAD_CACHE_TTL = 300  # seconds
+payload_cache = LRUCache(PAYLOAD_CACHE_ENTRIES, PAYLOAD_CACHE_TTL)
+
+class _GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+class _BrotliStream:
+    def __init__(self, level):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+class _ZstdStream:
+    def __init__(self, level):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(
+            zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush()
+
+# encoding -> (one-shot compress(data, level), streaming compressor class),
+# in order of preference when the client accepts several equally
+ENCODERS = {}
+if brotli is not None:
+    ENCODERS['br'] = (lambda data, level: brotli.compress(data, quality=level), _BrotliStream)
+if zstandard is not None:
+    ENCODERS['zstd'] = (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                        _ZstdStream)
+ENCODERS['gzip'] = (lambda data, level: gzip.compress(data, level, mtime=0), _GzipStream)
+
+_lock = threading.Lock()
+_counters = {}  # encoding -> counters
+
+def _record(encoding, size_in, size_out, cpu_seconds=0.0, cached=False):
+    with _lock:
+        counters = _counters.get(encoding)
+        if counters is None:
+            counters = _counters[encoding] = {'responses': 0, 'cached': 0, 'bytes_in': 0,
+                                              'bytes_out': 0, 'cpu_seconds': 0.0}
+        counters['responses'] += 1
+        counters['cached'] += cached
+        counters['bytes_in'] += size_in
+        counters['bytes_out'] += size_out
+        counters['cpu_seconds'] += cpu_seconds
+
+def stats():
+    """Per-encoding counters with compression ratio and CPU time, plus
+    the payload cache's counters"""
+    with _lock:
+        encodings = {encoding: dict(counters) for encoding, counters in _counters.items()}
+    for counters in encodings.values():
+        counters['cpu_seconds'] = round(counters['cpu_seconds'], 6)
+        counters['ratio'] = (round(counters['bytes_in'] / counters['bytes_out'], 2)
+                             if counters['bytes_out'] else 0.0)
+    return {
+        'enabled': COMPRESSION_ENABLED,
+        'min_size': MIN_SIZE,
+        'offered': ','.join(ENCODERS),
+        'encodings': encodings,
+        **{f'payload_cache_{name}': value for name, value in payload_cache.stats().items()},
+    }
+
+def _reset_after_fork():
+    """Give a forked worker its own lock, counters and payload cache"""
+    global _lock, _counters, payload_cache
+    _lock = threading.Lock()
+    _counters = {}
+    payload_cache = LRUCache(PAYLOAD_CACHE_ENTRIES, PAYLOAD_CACHE_TTL)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def negotiate():
+    """The content coding to answer the current request with, or None"""
+    if not COMPRESSION_ENABLED:
+        return None
+    return request.accept_encodings.best_match(ENCODERS)
+
+def cacheable(response, version, ttl=None):
+    """Mark a response whose body is fully determined by version (a string
+    that changes whenever the body would), so its compressed bytes can be
+    reused. ttl caps how long they are kept, e.g. at the lifetime of the
+    cache entry the body was read from."""
+    response.payload_version = version
+    response.payload_ttl = ttl
+    return response
+
+def _compressible(mimetype):
+    return mimetype.startswith('text/') or mimetype.endswith(('json', 'msgpack'))
+
+def _compress_stream(chunks, encoding):
+    """Compress a generated body chunk by chunk"""
+    compressor = ENCODERS[encoding][1](LEVELS[encoding])
+    size_in = size_out = 0
+    cpu_seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            started = time.thread_time()
+            data = compressor.compress(chunk)
+            cpu_seconds += time.thread_time() - started
+            size_in += len(chunk)
+            size_out += len(data)
+            if data:
+                yield data
+        data = compressor.finish()
+        size_out += len(data)
+        yield data
+    finally:
+        chunks.close()
+        _record(encoding, size_in, size_out, cpu_seconds)
+
+def compress_response(response):
+    """Compress a response body in the encoding negotiated for the request.
+
+    Adds Vary: Accept-Encoding to compressible responses. Bodies already
+    compressed for the same version are taken from payload_cache.
+    """
+    if (not COMPRESSION_ENABLED or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers or response.direct_passthrough
+            or not _compressible(response.mimetype or '')):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate()
+    if encoding is None:
+        return response
+
+    if inspect.isgenerator(response.response):
+        response.response = _compress_stream(response.response, encoding)
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    version = getattr(response, 'payload_version', None)
+    key = f'{version}|{encoding}' if version else None
+    body = payload_cache.get(key) if key else None
+    if body is not None:
+        _record(encoding, response.content_length or 0, len(body), cached=True)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_SIZE:
+            return response
+        started = time.thread_time()
+        body = ENCODERS[encoding][0](data, LEVELS[encoding])
+        _record(encoding, len(data), len(body), time.thread_time() - started)
+        if len(body) >= len(data):
+            return response
+        if key:
+            ttl = getattr(response, 'payload_ttl', None)
+            payload_cache.set(key, body, ttl=PAYLOAD_CACHE_TTL if ttl is None
+                              else min(ttl, PAYLOAD_CACHE_TTL))
+
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
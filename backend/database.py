@@ -1,17 +1,775 @@
+import os
+import random
 import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from urllib.parse import quote
 
-DATABASE_NAME = 'library.db'
+import metrics
 
-def get_db_connection():
-    """Create and return a database connection"""
-    conn = sqlite3.connect(DATABASE_NAME)
+try:
+    import fcntl
+except ImportError:  # Windows: lock files are not enforced
+    fcntl = None
+
+DATABASE_NAME = os.environ.get('LIBRARY_DATABASE', 'library.db')
+
+# Model reads run on a separate read-only connection (LIBRARY_READ_ROUTING=0
+# keeps them on the primary)
+READ_ROUTING = os.environ.get('LIBRARY_READ_ROUTING', '1') != '0'
+
+# Copy of the database for reporting; defaults to <database>-snapshot.db
+SNAPSHOT_NAME = os.environ.get('LIBRARY_SNAPSHOT')
+
+# Applied once to every new connection
+CONNECTION_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',  # 256 MB
+    'PRAGMA cache_size = -16000',    # ~16 MB
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Applied to read-only connections; journal settings belong to the primary
+READER_PRAGMAS = tuple(
+    pragma for pragma in CONNECTION_PRAGMAS if 'journal_mode' not in pragma
+    and 'synchronous' not in pragma) + ('PRAGMA query_only = 1',)
+
+# Full-text search index over the catalog (external content on books)
+BOOKS_FTS_TABLE = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+        title, author, description, publisher,
+        content='books', content_rowid='book_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+'''
+
+# Relevance weights for title, author, description, publisher
+BOOKS_FTS_RANK = 'bm25(10.0, 5.0, 1.0, 2.0)'
+
+# FTS5's default automerge level and pending-terms size, restored after
+# a full rebuild. The rebuild itself buffers BOOKS_FTS_REBUILD_HASHSIZE
+# bytes of terms per segment, so it writes far fewer segments.
+BOOKS_FTS_AUTOMERGE = 4
+BOOKS_FTS_HASHSIZE = 1024 * 1024
+BOOKS_FTS_REBUILD_HASHSIZE = 64 * 1024 * 1024
+
+# Triggers keeping books_fts in sync with books
+BOOKS_FTS_TRIGGERS = {
+    'books_fts_insert': '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+            INSERT INTO books_fts (rowid, title, author, description, publisher)
+            VALUES (new.book_id, new.title, new.author, new.description, new.publisher);
+        END
+    ''',
+    'books_fts_delete': '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, description, publisher)
+            VALUES ('delete', old.book_id, old.title, old.author, old.description, old.publisher);
+        END
+    ''',
+    'books_fts_update': '''
+        CREATE TRIGGER IF NOT EXISTS books_fts_update
+        AFTER UPDATE OF title, author, description, publisher ON books BEGIN
+            INSERT INTO books_fts (books_fts, rowid, title, author, description, publisher)
+            VALUES ('delete', old.book_id, old.title, old.author, old.description, old.publisher);
+            INSERT INTO books_fts (rowid, title, author, description, publisher)
+            VALUES (new.book_id, new.title, new.author, new.description, new.publisher);
+        END
+    ''',
+}
+
+# Tables whose rows carry row_version/updated_at for ETags: table -> primary key
+VERSIONED_TABLES = {
+    'books': 'book_id',
+    'borrowing_records': 'record_id',
+    'reservations': 'reservation_id',
+    'reviews': 'review_id',
+}
+
+def _version_triggers(table, key):
+    """Triggers stamping a versioned table's rows with the next change_counter
+    value on every insert and update.
+    
+    Rows inserted with a row_version of their own (bulk imports take one
+    value per batch) are left as they are.
+    """
+    bump = f'''
+            UPDATE change_counter SET seq = seq + 1 WHERE id = 1;
+            UPDATE {table}
+            SET row_version = (SELECT seq FROM change_counter WHERE id = 1),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE {key} = new.{key};
+        '''
+    return [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_insert
+            AFTER INSERT ON {table} WHEN new.row_version = 0
+            BEGIN {bump} END''',
+        # The WHEN clause skips the trigger's own row_version update
+        f'''
+            CREATE TRIGGER IF NOT EXISTS {table}_version_update
+            AFTER UPDATE ON {table} WHEN new.row_version = old.row_version
+            BEGIN {bump} END''',
+    ]
+
+def _row_version_statements():
+    """DDL giving every versioned table a row_version and updated_at.
+    
+    Versions come from one database-wide counter, so the newest row of any
+    set always has the highest version: count(*) plus max(row_version) is
+    enough to tell whether a list has changed.
+    """
+    statements = [
+        '''CREATE TABLE IF NOT EXISTS change_counter (
+               id INTEGER PRIMARY KEY CHECK (id = 1),
+               seq INTEGER NOT NULL
+           )''',
+        'INSERT OR IGNORE INTO change_counter (id, seq) VALUES (1, 0)',
+    ]
+    for table, key in VERSIONED_TABLES.items():
+        statements.append(f'ALTER TABLE {table} ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0')
+        if table != 'reviews':
+            statements.append(f'ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP')
+        statements.append(f'UPDATE {table} SET updated_at = COALESCE(updated_at, created_at)')
+        statements += _version_triggers(table, key)
+
+    # Covering indexes for the list endpoints' version checks
+    statements += [
+        '''CREATE INDEX IF NOT EXISTS idx_borrowing_user_status_version
+           ON borrowing_records (user_id, status, row_version, updated_at)''',
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_user_status_version
+           ON reservations (user_id, status, row_version, updated_at)''',
+        '''CREATE INDEX IF NOT EXISTS idx_reviews_book_version
+           ON reviews (book_id, row_version, updated_at)''',
+    ]
+    return statements
+
+# Rebuilds book_rating_stats from scratch out of the reviews table
+REBUILD_RATING_STATS = [
+    'DELETE FROM book_rating_stats',
+    '''INSERT INTO book_rating_stats (book_id, review_count, rating_sum, rating_1, rating_2,
+                                      rating_3, rating_4, rating_5, average_rating)
+       SELECT book_id, COUNT(*), SUM(rating),
+              SUM(rating = 1), SUM(rating = 2), SUM(rating = 3), SUM(rating = 4), SUM(rating = 5),
+              AVG(rating)
+       FROM reviews
+       GROUP BY book_id''',
+]
+
+def _rating_stats_delta(sign, ref):
+    """UPDATE applying one review (ref is 'new' or 'old') to its book's stats"""
+    return f'''
+        UPDATE book_rating_stats
+        SET review_count = review_count {sign} 1,
+            rating_sum = rating_sum {sign} {ref}.rating,
+            rating_1 = rating_1 {sign} ({ref}.rating = 1),
+            rating_2 = rating_2 {sign} ({ref}.rating = 2),
+            rating_3 = rating_3 {sign} ({ref}.rating = 3),
+            rating_4 = rating_4 {sign} ({ref}.rating = 4),
+            rating_5 = rating_5 {sign} ({ref}.rating = 5),
+            average_rating = COALESCE(
+                (rating_sum {sign} {ref}.rating) * 1.0 / NULLIF(review_count {sign} 1, 0), 0)
+        WHERE book_id = {ref}.book_id;
+        UPDATE books SET row_version = row_version WHERE book_id = {ref}.book_id;
+    '''
+
+# Per-book rating aggregates, kept current by triggers on reviews. Touching
+# the book row bumps its row_version so book ETags change with the ratings.
+RATING_STATS_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS book_rating_stats (
+           book_id INTEGER PRIMARY KEY,
+           review_count INTEGER NOT NULL DEFAULT 0,
+           rating_sum INTEGER NOT NULL DEFAULT 0,
+           rating_1 INTEGER NOT NULL DEFAULT 0,
+           rating_2 INTEGER NOT NULL DEFAULT 0,
+           rating_3 INTEGER NOT NULL DEFAULT 0,
+           rating_4 INTEGER NOT NULL DEFAULT 0,
+           rating_5 INTEGER NOT NULL DEFAULT 0,
+           average_rating REAL NOT NULL DEFAULT 0,
+           FOREIGN KEY (book_id) REFERENCES books (book_id) ON DELETE CASCADE
+       )''',
+    # Book.get_top_rated walks this index from the top
+    '''CREATE INDEX IF NOT EXISTS idx_rating_stats_top
+       ON book_rating_stats (average_rating, review_count)''',
+    f'''CREATE TRIGGER IF NOT EXISTS reviews_stats_insert AFTER INSERT ON reviews BEGIN
+            INSERT OR IGNORE INTO book_rating_stats (book_id) VALUES (new.book_id);
+            {_rating_stats_delta('+', 'new')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS reviews_stats_delete AFTER DELETE ON reviews BEGIN
+            {_rating_stats_delta('-', 'old')}
+        END''',
+    f'''CREATE TRIGGER IF NOT EXISTS reviews_stats_update
+        AFTER UPDATE OF rating, book_id ON reviews BEGIN
+            {_rating_stats_delta('-', 'old')}
+            INSERT OR IGNORE INTO book_rating_stats (book_id) VALUES (new.book_id);
+            {_rating_stats_delta('+', 'new')}
+        END''',
+] + REBUILD_RATING_STATS
+
+# Per-book FIFO hold queues. A pending reservation's queue_seq is its
+# place counting from the start of the queue and served counts holds already
+# given a copy, so queue position is queue_seq - served: one lookup each.
+HOLD_QUEUE_STATEMENTS = [
+    'ALTER TABLE reservations ADD COLUMN queue_seq INTEGER',
+    '''CREATE TABLE IF NOT EXISTS hold_queues (
+           book_id INTEGER PRIMARY KEY,
+           tail_seq INTEGER NOT NULL DEFAULT 0,
+           served INTEGER NOT NULL DEFAULT 0,
+           updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           FOREIGN KEY (book_id) REFERENCES books (book_id) ON DELETE CASCADE
+       )''',
+    # Head of the queue, and renumbering behind a reservation that leaves
+    '''CREATE INDEX IF NOT EXISTS idx_reservations_book_queue
+       ON reservations (book_id, status, queue_seq)''',
+    # Existing pending reservations queue in the order they were made.
+    # A correlated count rather than UPDATE ... FROM with ROW_NUMBER(),
+    # which older SQLite builds (before 3.33) cannot run.
+    '''UPDATE reservations SET queue_seq = (
+           SELECT COUNT(*) FROM reservations AS earlier
+           WHERE earlier.book_id = reservations.book_id
+             AND earlier.status = 'pending'
+             AND (COALESCE(earlier.reservation_date, '') < COALESCE(reservations.reservation_date, '')
+                  OR (COALESCE(earlier.reservation_date, '') = COALESCE(reservations.reservation_date, '')
+                      AND earlier.reservation_id <= reservations.reservation_id)))
+       WHERE status = 'pending' ''',
+    '''INSERT INTO hold_queues (book_id, tail_seq)
+       SELECT book_id, MAX(queue_seq) FROM reservations
+       WHERE status = 'pending' GROUP BY book_id''',
+]
+
+# Precomputed "readers also borrowed" neighbours (see recommendations.py):
+# the top-K similar books per book, clustered by book for one-range lookups.
+# recommendation_state remembers the last loan and review already counted.
+RECOMMENDATION_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS book_similarities (
+           book_id INTEGER NOT NULL,
+           rank INTEGER NOT NULL,
+           similar_book_id INTEGER NOT NULL,
+           score REAL NOT NULL,
+           PRIMARY KEY (book_id, rank),
+           FOREIGN KEY (book_id) REFERENCES books (book_id) ON DELETE CASCADE
+       ) WITHOUT ROWID''',
+    '''CREATE TABLE IF NOT EXISTS recommendation_state (
+           id INTEGER PRIMARY KEY CHECK (id = 1),
+           last_record_id INTEGER NOT NULL DEFAULT 0,
+           last_review_id INTEGER NOT NULL DEFAULT 0,
+           built_at TIMESTAMP,
+           full_built_at TIMESTAMP
+       )''',
+    'INSERT OR IGNORE INTO recommendation_state (id) VALUES (1)',
+    # Recommendation.get_for_user: a user's loans, newest first, and reviews
+    '''CREATE INDEX IF NOT EXISTS idx_borrowing_user_borrowed
+       ON borrowing_records (user_id, borrow_date, book_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_reviews_user
+       ON reviews (user_id, book_id, rating)''',
+]
+
+# Triggers and indexes a bulk import drops while it loads (see importer.py)
+# are saved here first, in the same transaction, so an import that is
+# killed mid-load leaves their DDL behind for init_db() to restore.
+DEFERRED_SCHEMA_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS deferred_schema (
+           name TEXT PRIMARY KEY,
+           sql TEXT NOT NULL
+       )''',
+]
+
+# Bumped by bulk writers in other processes (importer.py), so every
+# process drops its cached books, not only the writer's own
+CACHE_GENERATION_STATEMENTS = [
+    '''CREATE TABLE IF NOT EXISTS cache_generation (
+           id INTEGER PRIMARY KEY CHECK (id = 1),
+           seq INTEGER NOT NULL
+       )''',
+    'INSERT OR IGNORE INTO cache_generation (id, seq) VALUES (1, 0)',
+]
+
+# A queued reservation only gets an expiry_date once a copy is held for
+# it. SQLite cannot drop NOT NULL in place, so the table is rebuilt with
+# its indexes and triggers.
+RESERVATION_COLUMNS = ('reservation_id, user_id, book_id, reservation_date, expiry_date, status, '
+                       'created_at, row_version, updated_at, queue_seq')
+RESERVATION_EXPIRY_STATEMENTS = [
+    '''CREATE TABLE reservations_rebuilt (
+           reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+           user_id INTEGER NOT NULL,
+           book_id INTEGER NOT NULL,
+           reservation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           expiry_date TIMESTAMP,
+           status TEXT DEFAULT 'pending',
+           created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+           row_version INTEGER NOT NULL DEFAULT 0,
+           updated_at TIMESTAMP,
+           queue_seq INTEGER,
+           FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+           FOREIGN KEY (book_id) REFERENCES books (book_id) ON DELETE CASCADE
+       )''',
+    f'''INSERT INTO reservations_rebuilt ({RESERVATION_COLUMNS})
+        SELECT {RESERVATION_COLUMNS} FROM reservations''',
+    'DROP TABLE reservations',
+    'ALTER TABLE reservations_rebuilt RENAME TO reservations',
+    '''CREATE INDEX IF NOT EXISTS idx_reservations_user_status_date
+       ON reservations (user_id, status, reservation_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_reservations_user_status_version
+       ON reservations (user_id, status, row_version, updated_at)''',
+    '''CREATE INDEX IF NOT EXISTS idx_reservations_status_expiry
+       ON reservations (status, expiry_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_reservations_book_queue
+       ON reservations (book_id, status, queue_seq)''',
+    *_version_triggers('reservations', 'reservation_id'),
+    "UPDATE reservations SET expiry_date = NULL WHERE status = 'pending'",
+]
+
+# Bulk imports keep the version triggers live, so the insert triggers
+# must not restamp the rows they load
+VERSION_INSERT_STATEMENTS = [
+    statement
+    for table, key in VERSIONED_TABLES.items()
+    for statement in (f'DROP TRIGGER IF EXISTS {table}_version_insert',
+                      _version_triggers(table, key)[0])
+]
+
+# Recommendation.get_for_user reads a user's most recent reviews only
+RECENT_REVIEWS_STATEMENTS = [
+    'DROP INDEX IF EXISTS idx_reviews_user',
+    '''CREATE INDEX IF NOT EXISTS idx_reviews_user_created
+       ON reviews (user_id, created_at, book_id, rating)''',
+]
+
+# Versioned schema migrations, applied in order by migrate().
+# PRAGMA user_version records the last migration applied.
+MIGRATIONS = [
+    (1, 'Secondary indexes for model queries', [
+        # BorrowingRecord.get_user_borrowed: user_id + status, ORDER BY due_date
+        '''CREATE INDEX IF NOT EXISTS idx_borrowing_user_status_due
+           ON borrowing_records (user_id, status, due_date)''',
+        # Reservation.get_user_reservations: user_id + status, ORDER BY reservation_date
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_user_status_date
+           ON reservations (user_id, status, reservation_date)''',
+        # Review.get_book_reviews: book_id, ORDER BY created_at DESC
+        '''CREATE INDEX IF NOT EXISTS idx_reviews_book_created
+           ON reviews (book_id, created_at)''',
+        # Book.get_all category filter
+        '''CREATE INDEX IF NOT EXISTS idx_books_category
+           ON books (category)''',
+    ]),
+    (2, 'Row versions for conditional GETs', _row_version_statements()),
+    (3, 'Book rating aggregates', RATING_STATS_STATEMENTS),
+    (4, 'Indexes for background sweeps', [
+        # Reservation.expire_overdue: pending reservations past expiry_date
+        '''CREATE INDEX IF NOT EXISTS idx_reservations_status_expiry
+           ON reservations (status, expiry_date)''',
+        # BorrowingRecord.accrue_fines: open loans in due_date order
+        '''CREATE INDEX IF NOT EXISTS idx_borrowing_status_due
+           ON borrowing_records (status, due_date)''',
+    ]),
+    (5, 'Reservation hold queues', HOLD_QUEUE_STATEMENTS),
+    (6, 'Book recommendations', RECOMMENDATION_STATEMENTS),
+    (7, 'Deferred bulk-load schema', DEFERRED_SCHEMA_STATEMENTS),
+    (8, 'Queued reservations without an expiry', RESERVATION_EXPIRY_STATEMENTS),
+    (9, 'Version triggers that keep imported versions', VERSION_INSERT_STATEMENTS),
+    (10, 'Shared cache generation', CACHE_GENERATION_STATEMENTS),
+    (11, 'Recent reviews per user', RECENT_REVIEWS_STATEMENTS),
+]
+
+_local = threading.local()
+_stats_lock = threading.Lock()
+_pool_stats = {'hits': 0, 'misses': 0, 'reader_hits': 0, 'reader_misses': 0}
+
+def _reset_after_fork():
+    """A forked worker must not reuse the parent's connections; start fresh"""
+    global _local, _stats_lock
+    _local = threading.local()
+    _stats_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def lock_file(path, blocking=True):
+    """Take an exclusive lock on path, shared by every process on the host.
+    
+    Returns the open file; closing it releases the lock. With
+    blocking=False, returns None if another process holds it.
+    """
+    handle = open(path, 'a')
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        handle.close()
+        return None
+    return handle
+
+def _uri(path, **params):
+    """file: URI for path with query parameters such as mode=ro"""
+    query = '&'.join(f'{key}={value}' for key, value in params.items())
+    return f"file:{quote(os.path.abspath(path))}?{query}"
+
+def _connect(readonly=False):
+    """Open a new connection and apply the tuned PRAGMAs"""
+    if readonly:
+        conn = sqlite3.connect(_uri(DATABASE_NAME, mode='ro'), uri=True, timeout=5.0,
+                               factory=metrics.TimedConnection)
+    else:
+        conn = sqlite3.connect(DATABASE_NAME, timeout=5.0, factory=metrics.TimedConnection)
+    metrics.connection_opened()
     conn.row_factory = sqlite3.Row  # Access columns by name
+    for pragma in READER_PRAGMAS if readonly else CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_db_connection():
+    """Create and return a new (unpooled) database connection"""
+    return _connect()
+
+def _pooled_connection():
+    """Return this thread's connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.database == DATABASE_NAME:
+        with _stats_lock:
+            _pool_stats['hits'] += 1
+        return conn
+    
+    if conn is not None:
+        conn.close()
+    conn = _connect()
+    metrics.trace_statements(conn)
+    _local.conn = conn
+    _local.database = DATABASE_NAME
+    _local.depth = 0
+    with _stats_lock:
+        _pool_stats['misses'] += 1
     return conn
 
+def _pooled_reader():
+    """Return this thread's read-only connection, opening it on first use"""
+    conn = getattr(_local, 'reader', None)
+    if conn is not None and _local.reader_database == DATABASE_NAME:
+        with _stats_lock:
+            _pool_stats['reader_hits'] += 1
+        return conn
+
+    if conn is not None:
+        conn.close()
+    conn = _connect(readonly=True)
+    metrics.trace_statements(conn)
+    _local.reader = conn
+    _local.reader_database = DATABASE_NAME
+    with _stats_lock:
+        _pool_stats['reader_misses'] += 1
+    return conn
+
+@contextmanager
+def read_connection():
+    """Borrow this thread's read-only connection, for queries that write nothing.
+    
+    Inside a db_connection() block the primary is used instead, so reads
+    made during a transaction see its uncommitted writes. Outside one,
+    reads never take part in (or wait behind) a write transaction.
+    """
+    if not READ_ROUTING or getattr(_local, 'depth', 0):
+        with db_connection() as conn:
+            yield conn
+        return
+    yield _pooled_reader()
+
+@contextmanager
+def db_connection():
+    """Borrow this thread's pooled connection.
+    
+    The outermost block commits on success and rolls back on error, so
+    nested model calls share one connection and one transaction.
+    """
+    conn = _pooled_connection()
+    _local.depth += 1
+    try:
+        yield conn
+    except BaseException:
+        if _local.depth == 1 and conn.in_transaction:
+            conn.rollback()
+        raise
+    else:
+        if _local.depth == 1 and conn.in_transaction:
+            conn.commit()
+    finally:
+        _local.depth -= 1
+
+def _is_busy(error):
+    """True if an OperationalError is SQLITE_BUSY / SQLITE_LOCKED"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def run_in_transaction(work, retries=5):
+    """Run work(conn) inside one BEGIN IMMEDIATE transaction.
+    
+    The write lock is taken up front so read-then-write logic cannot race
+    another writer. SQLITE_BUSY is retried with jittered backoff; if we are
+    already inside a transaction, work simply joins it.
+    """
+    for attempt in range(retries + 1):
+        with db_connection() as conn:
+            if conn.in_transaction:
+                return work(conn)
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                result = work(conn)
+                conn.commit()
+                return result
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if not _is_busy(e) or attempt == retries:
+                    raise
+            except BaseException:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+        time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+
+def close_db_connection():
+    """Close this thread's pooled connections, if any"""
+    for name in ('conn', 'reader'):
+        conn = getattr(_local, name, None)
+        if conn is not None:
+            conn.close()
+            setattr(_local, name, None)
+
+def snapshot_path():
+    """Where the reporting snapshot of the current database lives"""
+    return SNAPSHOT_NAME or os.path.splitext(DATABASE_NAME)[0] + '-snapshot.db'
+
+def refresh_snapshot(path=None):
+    """Copy the database to the snapshot file with the sqlite3 backup API.
+    
+    The copy is made in one backup step, inside a single read transaction,
+    which in WAL mode does not block writers. It is written to a temporary
+    file that then replaces the snapshot, so connections to the old
+    snapshot keep reading it undisturbed. Returns the number of pages copied.
+    """
+    path = path or snapshot_path()
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    source = _connect(readonly=True)
+    try:
+        target = sqlite3.connect(temp_path)
+        try:
+            source.backup(target)
+            target.execute('PRAGMA journal_mode = DELETE')  # One self-contained file
+            pages = target.execute('PRAGMA page_count').fetchone()[0]
+        finally:
+            target.close()
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    finally:
+        source.close()
+    return pages
+
+def snapshot_connection(max_age=None):
+    """Open a read-only connection to the reporting snapshot.
+    
+    The snapshot is made first if there is none yet, or if it is older
+    than max_age seconds. It is opened as immutable: the file is only ever
+    replaced, never changed in place, so no locks are taken.
+    """
+    path = snapshot_path()
+    if not os.path.exists(path) or (
+            max_age is not None and time.time() - os.path.getmtime(path) > max_age):
+        refresh_snapshot(path)
+    conn = sqlite3.connect(_uri(path, mode='ro', immutable=1), uri=True)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def create_books_fts(conn):
+    """Create the catalog FTS5 index and its triggers.
+    
+    Returns False if this SQLite build has no FTS5 support.
+    """
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'books_fts'"
+    ).fetchone()
+    try:
+        conn.execute(BOOKS_FTS_TABLE)
+    except sqlite3.OperationalError:
+        return False
+    
+    for ddl in BOOKS_FTS_TRIGGERS.values():
+        conn.execute(ddl)
+    if not exists:
+        # Index books that were added before the FTS table existed
+        conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+        conn.execute(
+            "INSERT INTO books_fts (books_fts, rank) VALUES ('rank', ?)", (BOOKS_FTS_RANK,)
+        )
+    return True
+
+_fts_available = {}
+
+def fts_available(conn):
+    """True if the current database has the books_fts index"""
+    if DATABASE_NAME not in _fts_available:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+        ).fetchone()
+        _fts_available[DATABASE_NAME] = row is not None
+    return _fts_available[DATABASE_NAME]
+
+def rebuild_books_fts(conn):
+    """Rebuild the catalog search index from books in one pass; call
+    inside a write transaction"""
+    if not fts_available(conn):
+        return
+    # No merging while rebuilding. The few large segments left are not
+    # measurably slower to search than one (an 'optimize' here took a
+    # sixth of a 1M-row import), and automerge folds them together as
+    # later writes come in.
+    conn.execute("INSERT INTO books_fts (books_fts, rank) VALUES ('automerge', 0)")
+    conn.execute("INSERT INTO books_fts (books_fts, rank) VALUES ('hashsize', ?)",
+                 (BOOKS_FTS_REBUILD_HASHSIZE,))
+    conn.execute("INSERT INTO books_fts (books_fts) VALUES ('rebuild')")
+    conn.execute("INSERT INTO books_fts (books_fts, rank) VALUES ('hashsize', ?)",
+                 (BOOKS_FTS_HASHSIZE,))
+    conn.execute("INSERT INTO books_fts (books_fts, rank) VALUES ('automerge', ?)",
+                 (BOOKS_FTS_AUTOMERGE,))
+
+def import_lock(blocking=True):
+    """Lock held by a bulk import while triggers and indexes are deferred"""
+    return lock_file(DATABASE_NAME + '.import-lock', blocking)
+
+def defer_schema(conn, names):
+    """Drop these triggers/indexes, saving their DDL in deferred_schema.
+    
+    Returns the names actually dropped.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute(
+            f"SELECT type, name, sql FROM sqlite_master WHERE name IN ({', '.join('?' * len(names))})",
+            names,
+        ).fetchall()
+        conn.executemany('INSERT OR REPLACE INTO deferred_schema (name, sql) VALUES (?, ?)',
+                         [(name, sql) for _, name, sql in rows])
+        for kind, name, _ in rows:
+            conn.execute(f'DROP {kind.upper()} {name}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [name for _, name, _ in rows]
+
+def restore_deferred_schema(conn):
+    """Recreate every trigger/index in deferred_schema, then rebuild the
+    search index the dropped triggers stopped maintaining.
+    
+    Writers are blocked until the rebuild commits. Returns the names
+    restored ([] if nothing was deferred).
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        rows = conn.execute('SELECT name, sql FROM deferred_schema').fetchall()
+        if rows:
+            existing = {row[0] for row in conn.execute('SELECT name FROM sqlite_master')}
+            for name, sql in rows:
+                if name not in existing:
+                    conn.execute(sql)
+            conn.execute('DELETE FROM deferred_schema')
+            rebuild_books_fts(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return [name for name, _ in rows]
+
+def _restore_interrupted_import(conn):
+    """Put back triggers/indexes left dropped by an import that was killed"""
+    if not conn.execute('SELECT 1 FROM deferred_schema LIMIT 1').fetchone():
+        return
+    lock = import_lock(blocking=False)
+    if lock is None:
+        return  # Still loading; the import restores them itself
+    try:
+        names = restore_deferred_schema(conn)
+    finally:
+        lock.close()
+    if names:
+        print(f"Restored {', '.join(names)} after an interrupted import")
+
+def schema_version(conn):
+    """Return the number of the last migration applied"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Apply pending migrations, each in its own transaction"""
+    for version, description, statements in MIGRATIONS:
+        if version <= schema_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Re-check under the write lock in case another process got here first
+            if version <= schema_version(conn):
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Applied migration {version}: {description}")
+
+def rebuild_rating_stats():
+    """Recompute book_rating_stats from the reviews table (backfill/repair)"""
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for statement in REBUILD_RATING_STATS:
+            conn.execute(statement)
+        count = conn.execute('SELECT COUNT(*) FROM book_rating_stats').fetchone()[0]
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    print(f"Rebuilt rating stats for {count} books")
+    return count
+
+def pool_stats():
+    """Return connection pool hit/miss counters, for primary and read-only connections"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    total = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / total, 4) if total else 0.0
+    return stats
+
 def init_db():
-    """Initialize the database with tables"""
+    """Initialize the database with tables.
+    
+    Safe to call from every worker at startup: concurrent runs are
+    serialized by a lock file next to the database, and once the schema
+    is current no DDL runs at all, unless a bulk import was killed before
+    putting back the triggers and indexes it deferred.
+    """
+    lock = lock_file(DATABASE_NAME + '.init-lock')
+    try:
+        _init_db()
+    finally:
+        lock.close()
+
+def _init_db():
     conn = get_db_connection()
+    if schema_version(conn) == MIGRATIONS[-1][0]:
+        _restore_interrupted_import(conn)
+        conn.close()
+        return
     cursor = conn.cursor()
     
     # Users table
@@ -71,7 +829,7 @@ def init_db():
             user_id INTEGER NOT NULL,
             book_id INTEGER NOT NULL,
             reservation_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            expiry_date TIMESTAMP NOT NULL,
+            expiry_date TIMESTAMP,
             status TEXT DEFAULT 'pending',
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
@@ -94,9 +852,17 @@ def init_db():
         )
     ''')
     
+    # Catalog search index (skipped if SQLite lacks FTS5)
+    create_books_fts(conn)
+    _fts_available.pop(DATABASE_NAME, None)
+    
     conn.commit()
+    migrate(conn)
+    _restore_interrupted_import(conn)
     conn.close()
     print("Database initialized successfully!")
 
 if __name__ == '__main__':
     init_db()
+    if 'rebuild-rating-stats' in sys.argv[1:]:
+        rebuild_rating_stats()
@@ -0,0 +1,20 @@
+"""Gunicorn settings.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+LIBRARY_BIND, LIBRARY_WORKERS and LIBRARY_THREADS override the defaults.
+"""
+import os
+
+bind = os.environ.get('LIBRARY_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('LIBRARY_WORKERS', os.cpu_count() or 2))
+threads = int(os.environ.get('LIBRARY_THREADS', 4))
+worker_class = 'gthread'
+
+# Each worker imports the app after fork, so it runs create_app() and opens
+# its own SQLite connections instead of inheriting the master's
+preload_app = False
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,262 @@
+"""Bulk catalog import.
+
+Streams book records from CSV or NDJSON into the books table in sized
+transactions, upserting on isbn. Once a load is large next to the
+catalog, the search-index triggers and the category index are dropped
+for the rest of it and put back afterwards, with one FTS rebuild at the
+end instead of per-row index maintenance. The row-version triggers stay,
+so API writes made during the load still change ETags; rows the load
+writes carry their batch's version, which the triggers leave alone. The rebuild
+blocks API writes while it runs, which is why small loads stay online.
+Their DDL is saved in the database first, so init_db() restores them if
+the import is killed.
+
+    python importer.py catalog.csv [--format csv|ndjson] [--batch-size 50000] [--online|--defer]
+
+Records need at least title and author; other columns not in
+BOOK_COLUMNS are ignored. Rows without an isbn are always inserted.
+"""
+import argparse
+import csv
+import json
+import sys
+import time
+
+import database
+import models
+from database import get_db_connection, init_db
+
+BOOK_COLUMNS = ('isbn', 'title', 'author', 'publisher', 'publication_year', 'category',
+                'total_copies', 'available_copies', 'description', 'cover_image_url')
+
+INTEGER_COLUMNS = ('publication_year', 'total_copies', 'available_copies')
+
+DEFAULT_BATCH_SIZE = 50000
+
+# With defer=None, maintenance is deferred once the rows loaded reach the
+# larger of this and the catalog's size before the import: from there the
+# per-row trigger work outweighs one rebuild of the whole index
+DEFER_MIN_ROWS = 100000
+
+# Existing books keep their loans: available_copies moves by the change in
+# total_copies instead of being overwritten.
+UPSERT_BOOK = f'''
+    INSERT INTO books ({', '.join(BOOK_COLUMNS)}, row_version, updated_at)
+    VALUES ({', '.join('?' * len(BOOK_COLUMNS))}, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT (isbn) DO UPDATE SET
+        title = excluded.title,
+        author = excluded.author,
+        publisher = excluded.publisher,
+        publication_year = excluded.publication_year,
+        category = excluded.category,
+        available_copies = MAX(0, available_copies + excluded.total_copies - total_copies),
+        total_copies = excluded.total_copies,
+        description = excluded.description,
+        cover_image_url = excluded.cover_image_url,
+        row_version = excluded.row_version,
+        updated_at = excluded.updated_at
+'''
+
+# Per-row work on books that is deferred until the load is done
+DEFERRED_TRIGGERS = ('books_fts_insert', 'books_fts_delete', 'books_fts_update')
+DEFERRED_INDEXES = ('idx_books_category',)
+
+# PRAGMAs for the importer's own connection. A crash mid-load can lose the
+# last batches but not corrupt the database; rerunning the import upserts.
+LOAD_PRAGMAS = (
+    'PRAGMA synchronous = OFF',
+    'PRAGMA cache_size = -262144',  # ~256 MB
+)
+
+def read_csv(stream):
+    """Yield one dict per non-blank CSV row (header row required)"""
+    # csv.DictReader does the same per row in Python; zip runs in C
+    rows = csv.reader(stream)
+    header = next(rows, None)
+    if header is None:
+        return
+    for row in rows:
+        if row:
+            yield dict(zip(header, row))
+
+def read_ndjson(stream):
+    """Yield one dict per non-blank line of newline-delimited JSON"""
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+def detect_format(path):
+    """Guess the input format from the file extension"""
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+_INTEGER_POSITIONS = [BOOK_COLUMNS.index(column) for column in INTEGER_COLUMNS]
+_TOTAL, _AVAILABLE = BOOK_COLUMNS.index('total_copies'), BOOK_COLUMNS.index('available_copies')
+
+def book_row(record):
+    """Turn an input record into an UPSERT_BOOK parameter tuple.
+
+    Raises ValueError if the record is missing title/author or has a
+    non-numeric count.
+    """
+    values = [(value.strip() or None) if value.__class__ is str else value
+              for value in map(record.get, BOOK_COLUMNS)]
+    if not values[1] or not values[2]:
+        raise ValueError('title and author are required')
+
+    for i in _INTEGER_POSITIONS:
+        if values[i] is not None:
+            values[i] = int(values[i])
+    if values[_TOTAL] is None:
+        values[_TOTAL] = 1
+    if values[_AVAILABLE] is None:
+        values[_AVAILABLE] = values[_TOTAL]
+    return tuple(values)
+
+def _defer_maintenance(conn):
+    """Take the import lock and drop the deferred triggers/indexes"""
+    lock = database.import_lock()
+    try:
+        database.defer_schema(conn, DEFERRED_TRIGGERS + DEFERRED_INDEXES)
+    except Exception:
+        lock.close()
+        raise
+    return lock
+
+def _restore_maintenance(conn, lock):
+    """Recreate the dropped triggers/indexes, rebuild the search index and
+    release the import lock"""
+    try:
+        database.restore_deferred_schema(conn)
+    finally:
+        lock.close()
+
+def _next_version(conn):
+    """Take one value from the change counter for a whole batch"""
+    conn.execute('UPDATE change_counter SET seq = seq + 1 WHERE id = 1')
+    return conn.execute('SELECT seq FROM change_counter WHERE id = 1').fetchone()[0]
+
+def _load_batch(conn, batch, last_book_id):
+    """Upsert one batch; returns the IDs of books that existed before the
+    import (book_id <= last_book_id) and were updated"""
+    isbns = json.dumps([row[0] for row in batch if row[0] is not None])
+    for attempt in range(6):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            version = _next_version(conn)
+            conn.executemany(UPSERT_BOOK, [row + (version,) for row in batch])
+            # API workers check this to drop their own cached books
+            conn.execute('UPDATE cache_generation SET seq = seq + 1 WHERE id = 1')
+            updated = []
+            if last_book_id:
+                updated = [row[0] for row in conn.execute('''
+                    SELECT book_id FROM books
+                    WHERE isbn IN (SELECT value FROM json_each(?)) AND book_id <= ?
+                ''', (isbns, last_book_id))]
+            conn.commit()
+            return updated
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if not database._is_busy(e) or attempt == 5:
+                raise
+            time.sleep(0.01 * 2 ** attempt)
+
+def import_books(records, batch_size=DEFAULT_BATCH_SIZE, defer=None, progress=None):
+    """Upsert an iterable of book records (dicts) into the catalog.
+
+    Records are consumed lazily and written batch_size rows per
+    transaction. After each one this process's cached pages of the books
+    written are dropped, and other processes drop all their cached books
+    within models.CACHE_SYNC_INTERVAL. With defer=True the search index
+    and category index are taken down during the load; writes made by
+    other connections meanwhile do not reach the search index until the
+    final rebuild, which blocks API writes while it runs, so run large
+    loads outside serving hours. defer=None defers only once the load
+    reaches DEFER_MIN_ROWS and the catalog's own size; defer=False never
+    does. progress(rows_so_far) is called after each batch.
+
+    Returns a stats dict with rows, inserted, rejected, seconds and
+    rows_per_sec.
+    """
+    conn = get_db_connection()
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    stats = {'rows': 0, 'inserted': 0, 'rejected': 0}
+    started = time.perf_counter()
+    before, last_book_id = conn.execute('SELECT COUNT(*), MAX(book_id) FROM books').fetchone()
+    if defer is None:
+        defer_at = max(DEFER_MIN_ROWS, before)
+    else:
+        defer_at = 0 if defer else None
+    lock = None
+
+    def load(batch):
+        nonlocal lock
+        if lock is None and defer_at is not None and stats['rows'] + len(batch) >= defer_at:
+            lock = _defer_maintenance(conn)
+        models.invalidate_books(*_load_batch(conn, batch, last_book_id))
+        models.invalidate_catalog()
+        stats['rows'] += len(batch)
+
+    try:
+        batch = []
+        for record in records:
+            try:
+                batch.append(book_row(record))
+            except (ValueError, TypeError):
+                stats['rejected'] += 1
+                continue
+            if len(batch) >= batch_size:
+                load(batch)
+                batch = []
+                if progress:
+                    progress(stats['rows'])
+        if batch:
+            load(batch)
+    finally:
+        if lock is not None:
+            _restore_maintenance(conn, lock)
+
+    stats['inserted'] = conn.execute('SELECT COUNT(*) FROM books').fetchone()[0] - before
+    conn.execute('PRAGMA optimize')
+    conn.close()
+
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['rows_per_sec'] = round(stats['rows'] / stats['seconds']) if stats['seconds'] else 0
+    return stats
+
+def import_file(path, fmt=None, **options):
+    """Import a CSV or NDJSON file ('-' reads stdin)"""
+    reader = READERS[fmt or detect_format(path)]
+    if path == '-':
+        return import_books(reader(sys.stdin), **options)
+    with open(path, newline='', encoding='utf-8') as stream:
+        return import_books(reader(stream), **options)
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import books from CSV or NDJSON')
+    parser.add_argument('path', help="input file, or '-' for stdin")
+    parser.add_argument('--format', choices=sorted(READERS))
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    maintenance = parser.add_mutually_exclusive_group()
+    maintenance.add_argument('--online', dest='defer', action='store_false', default=None,
+                             help='keep triggers and indexes live during the whole load')
+    maintenance.add_argument('--defer', dest='defer', action='store_true',
+                             help='drop triggers and indexes from the start of the load')
+    args = parser.parse_args()
+
+    if args.path == '-' and not args.format:
+        parser.error('--format is required when reading stdin')
+
+    init_db()
+    stats = import_file(args.path, args.format, batch_size=args.batch_size,
+                        defer=args.defer,
+                        progress=lambda rows: print(f"  {rows} rows", file=sys.stderr))
+    print(f"Imported {stats['rows']} books ({stats['inserted']} new, "
+          f"{stats['rejected']} rejected) in {stats['seconds']}s "
+          f"({stats['rows_per_sec']} rows/sec)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Request metrics and slow-request profiling.
+
+Every request records its latency, the SQL statements it ran, the time
+spent in SQLite and the connections it opened, per route. render()
+formats them, plus the component stats from /api/health, in the
+Prometheus text format served at /api/metrics.
+
+SQL is observed at the connection layer: database.py opens connections
+as TimedConnection, which times execute/fetch/commit calls, and installs
+a trace callback on pooled connections that counts every statement
+SQLite runs, including the BEGIN/COMMIT the sqlite3 module issues.
+
+Set LIBRARY_PROFILE_SLOW_MS to sample the stacks of in-flight requests
+and write the samples of any request slower than that to
+LIBRARY_PROFILE_DIR, one file per request in the folded format read by
+flamegraph.pl and speedscope.
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+
+# Opt-in: write a profile for requests slower than this (milliseconds)
+PROFILE_SLOW_MS = float(os.environ.get('LIBRARY_PROFILE_SLOW_MS', 0))
+PROFILE_INTERVAL = float(os.environ.get('LIBRARY_PROFILE_INTERVAL_MS', 5)) / 1000
+PROFILE_DIR = os.environ.get('LIBRARY_PROFILE_DIR', 'profiles')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+CONNECTION_BUCKETS = (0, 1, 2, 5)
+
+# name -> (help, buckets) for the per-request histograms, labelled by route and method
+HISTOGRAMS = {
+    'library_http_request_duration_seconds': ('Request latency', LATENCY_BUCKETS),
+    'library_http_request_sql_statements': ('SQL statements run per request', STATEMENT_BUCKETS),
+    'library_http_request_sql_seconds': ('Time spent in SQLite per request', LATENCY_BUCKETS),
+    'library_http_request_db_connections': ('Database connections opened per request',
+                                            CONNECTION_BUCKETS),
+}
+
+class Histogram:
+    """Bucketed observation counts, cumulative only when rendered"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+class RequestStats:
+    """What the request on this thread has done so far"""
+    __slots__ = ('started', 'statements', 'sql_seconds', 'connections')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.connections = 0
+
+_local = threading.local()
+_lock = threading.Lock()
+_requests = Counter()  # (route, method, status) -> count
+_slow_requests = Counter()  # (route, method) -> count
+_histograms = {name: {} for name in HISTOGRAMS}  # name -> {(route, method): Histogram}
+
+def _current():
+    return getattr(_local, 'request', None)
+
+def _add_sql_time(seconds):
+    stats = getattr(_local, 'request', None)
+    if stats is not None:
+        stats.sql_seconds += seconds
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that adds the time spent stepping statements to the request"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def fetchmany(self, size=None):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return super().__next__()
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose cursors, commits and rollbacks are timed"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+    def rollback(self):
+        started = time.perf_counter()
+        try:
+            super().rollback()
+        finally:
+            _add_sql_time(time.perf_counter() - started)
+
+def _count_statement(statement):
+    """sqlite3 trace callback; statements run by triggers start with '--'"""
+    stats = getattr(_local, 'request', None)
+    if stats is not None and not statement.startswith('--'):
+        stats.statements += 1
+
+def connection_opened():
+    """Called by database.py for every new connection"""
+    stats = _current()
+    if stats is not None:
+        stats.connections += 1
+
+def trace_statements(conn):
+    """Count the statements conn runs towards the current request"""
+    conn.set_trace_callback(_count_statement)
+
+class StackSampler:
+    """Samples the Python stacks of the threads serving requests"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._samples = {}  # thread ident -> Counter of folded stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, ident):
+        with self._lock:
+            self._samples[ident] = Counter()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='library-profiler',
+                                                daemon=True)
+                self._thread.start()
+
+    def untrack(self, ident):
+        """Stop sampling a thread and return its samples"""
+        with self._lock:
+            return self._samples.pop(ident, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, samples in self._samples.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[fold_stack(frame)] += 1
+
+def fold_stack(frame):
+    """One line of a folded stack: outermost frame first, ';'-separated"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+_sampler = StackSampler(PROFILE_INTERVAL) if PROFILE_SLOW_MS > 0 else None
+
+def write_profile(route, method, seconds, samples):
+    """Write one request's samples as <time>-<method>-<route>-<ms>ms.folded"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    name = ''.join(c if c.isalnum() else '_' for c in route).strip('_') or 'root'
+    path = os.path.join(PROFILE_DIR, f'{datetime.now():%Y%m%dT%H%M%S.%f}-{method}-{name}'
+                                     f'-{seconds * 1000:.0f}ms.folded')
+    with open(path, 'w') as out:
+        for stack, count in samples.most_common():
+            out.write(f'{stack} {count}\n')
+    return path
+
+def start_request():
+    """Begin collecting for the request on this thread"""
+    _local.request = RequestStats()
+    if _sampler is not None:
+        _sampler.track(threading.get_ident())
+
+def finish_request(route, method, status):
+    """Record the request on this thread; returns its duration in seconds"""
+    stats = _current()
+    if stats is None:
+        return None
+    _local.request = None
+    seconds = time.perf_counter() - stats.started
+    samples = _sampler.untrack(threading.get_ident()) if _sampler is not None else None
+
+    labels = (route, method)
+    observations = (seconds, stats.statements, stats.sql_seconds, stats.connections)
+    with _lock:
+        _requests[(route, method, status)] += 1
+        for name, value in zip(HISTOGRAMS, observations):
+            histogram = _histograms[name].get(labels)
+            if histogram is None:
+                histogram = _histograms[name][labels] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+        slow = samples is not None and seconds * 1000 >= PROFILE_SLOW_MS
+        if slow:
+            _slow_requests[labels] += 1
+
+    if slow and samples:
+        write_profile(route, method, seconds, samples)
+    return seconds
+
+def _reset_after_fork():
+    """Metrics are per process; a forked worker starts from zero"""
+    global _local, _lock, _sampler
+    _local = threading.local()
+    _lock = threading.Lock()
+    _requests.clear()
+    _slow_requests.clear()
+    for histograms in _histograms.values():
+        histograms.clear()
+    if _sampler is not None:
+        _sampler = StackSampler(PROFILE_INTERVAL)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+def _component_samples(prefix, stats, labels, samples):
+    """Flatten a stats dict into (name, labels, value); nested dicts become name labels"""
+    for key, value in stats.items():
+        name = f'{prefix}_{key}'
+        if isinstance(value, bool):
+            samples.append((name, labels, int(value)))
+        elif isinstance(value, (int, float)):
+            samples.append((name, labels, value))
+        elif isinstance(value, dict) and all(isinstance(v, dict) for v in value.values()):
+            for child, child_stats in value.items():
+                _component_samples(name, child_stats, dict(labels, name=child), samples)
+    return samples
+
+def render(components=None):
+    """Prometheus text exposition of the request metrics.
+
+    components maps a name to a stats dict (as returned by pool_stats()
+    and friends); its numeric values are exported as library_<name>_<key>
+    gauges.
+    """
+    lines = []
+    with _lock:
+        lines.append('# HELP library_http_requests_total Requests served')
+        lines.append('# TYPE library_http_requests_total counter')
+        for (route, method, status), count in sorted(_requests.items()):
+            lines.append(f'library_http_requests_total'
+                         f'{_labels(route=route, method=method, status=status)} {count}')
+
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for (route, method), histogram in sorted(_histograms[name].items()):
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    labels = _labels(route=route, method=method, le=bound)
+                    lines.append(f'{name}_bucket{labels} {cumulative}')
+                labels = _labels(route=route, method=method)
+                lines.append(f'{name}_sum{labels} {round(histogram.sum, 6)}')
+                lines.append(f'{name}_count{labels} {cumulative}')
+
+        if _sampler is not None:
+            lines.append('# HELP library_http_slow_requests_total Requests profiled as slow')
+            lines.append('# TYPE library_http_slow_requests_total counter')
+            for (route, method), count in sorted(_slow_requests.items()):
+                lines.append(f'library_http_slow_requests_total'
+                             f'{_labels(route=route, method=method)} {count}')
+
+    families = {}
+    for component, stats in (components or {}).items():
+        for name, labels, value in _component_samples(f'library_{component}', stats, {}, []):
+            families.setdefault(name, []).append((labels, value))
+    for name, samples in families.items():
+        lines.append(f'# TYPE {name} gauge')
+        for labels, value in samples:
+            lines.append(f'{name}{_labels(**labels) if labels else ""} {value}')
+    return '\n'.join(lines) + '\n'
@@ -1,230 +1,964 @@
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import get_db_connection
+import heapq
+import itertools
+import json
+import os
+import re
+import time
+from database import db_connection, read_connection, run_in_transaction, fts_available
 from datetime import datetime, timedelta
+from cache import LRUCache
+from pagination import Page
+from passwords import hash_password, verify_password, needs_rehash, HashingOverloaded
+
+FINE_PER_DAY = 0.50  # $0.50 per day overdue
+
+# Days a patron has to collect a copy held for their reservation
+HOLD_PICKUP_DAYS = 7
+
+# Use the books_fts index for catalog search when the database has one
+USE_FTS = True
+
+# Rows fetched per fetchmany() call when streaming list results
+STREAM_BATCH_SIZE = 500
+
+# A user's recommendations come from the best RECOMMENDATION_NEIGHBOURS
+# neighbours of the last RECOMMENDATION_HISTORY distinct books in their
+# history. Only their last RECOMMENDATION_ROWS loans and reviews are read
+# (rereads make a few loans per book), which bounds the rows read per lookup.
+RECOMMENDATION_HISTORY = 20
+RECOMMENDATION_NEIGHBOURS = 10
+RECOMMENDATION_ROWS = RECOMMENDATION_HISTORY * 4
+
+# Read-through cache for book detail and catalog pages
+CACHE_TTL = 30  # seconds
+CACHE_MAX_ENTRIES = 2048
+book_cache = LRUCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+# Numbers catalog pages read from the database, so every fetch of a key
+# gets a new Page.version, including a refetch after the cached entry
+# merely expired (e.g. following another process's write)
+_page_fetches = itertools.count(1)
+
+# Bulk imports run in another process and bump cache_generation instead.
+# Cached reads compare it with the last value seen, at most every
+# CACHE_SYNC_INTERVAL seconds, and clear this process's cache if it moved.
+CACHE_SYNC_INTERVAL = 1.0  # seconds
+_cache_sync = {'seq': None, 'checked_at': float('-inf')}
+
+def _sync_book_cache():
+    """Clear an in-process book_cache after another process's bulk write"""
+    now = time.monotonic()
+    if now - _cache_sync['checked_at'] < CACHE_SYNC_INTERVAL:
+        return
+    _cache_sync['checked_at'] = now
+    with read_connection() as conn:
+        seq = conn.execute('SELECT seq FROM cache_generation WHERE id = 1').fetchone()[0]
+    if seq != _cache_sync['seq']:
+        # A shared backend already saw the writer's own invalidations
+        if _cache_sync['seq'] is not None and isinstance(book_cache, LRUCache):
+            book_cache.clear()
+        _cache_sync['seq'] = seq
+
+def set_cache_backend(backend):
+    """Swap the book cache for another CacheBackend (e.g. a RedisCache)"""
+    global book_cache
+    book_cache = backend
+
+def invalidate_books(*book_ids):
+    """Drop cached detail and catalog pages that contain these books"""
+    if book_ids:
+        book_cache.invalidate_tags(*(f'book:{book_id}' for book_id in book_ids))
+
+def invalidate_catalog():
+    """Drop every cached catalog page.
+    
+    Call after adding or deleting books, or editing fields that decide which
+    searches or categories a book appears in.
+    """
+    book_cache.invalidate_tags('catalog')
+
+def _columns(alias, names):
+    """Map output field names to qualified column expressions"""
+    return {name: f'{alias}.{name}' for name in names.split()}
+
+def _paged_query(from_where, params, field_map, fields, order_keys,
+                 limit=None, after=None, descending=False):
+    """Build a keyset-paginated query.
+    
+    order_keys are the SQL expressions that define the sort order; the last
+    one must be unique. after holds their values from the previous page.
+    """
+    fields = fields or list(field_map)
+    unknown = [name for name in fields if name not in field_map]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+
+    columns = [f'{field_map[name]} AS {name}' for name in fields]
+    columns += [f'{expr} AS _k{i}' for i, expr in enumerate(order_keys)]
+    query = f"SELECT {', '.join(columns)} {from_where}"
+    params = list(params)
+
+    if after is not None:
+        if not isinstance(after, (list, tuple)) or len(after) != len(order_keys):
+            raise ValueError('Invalid cursor')
+        query += f" AND ({', '.join(order_keys)}) {'<' if descending else '>'} "
+        query += f"({', '.join('?' * len(after))})"
+        params.extend(after)
+
+    direction = ' DESC' if descending else ''
+    query += ' ORDER BY ' + ', '.join(expr + direction for expr in order_keys)
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit + 1)  # One extra row tells us whether there is a next page
+    return query, params
+
+def _key_start(cursor):
+    """Column names of a _paged_query, and where its _k* sort keys begin"""
+    columns = [description[0] for description in cursor.description]
+    for i, name in enumerate(columns):
+        if name.startswith('_k'):
+            return columns, i
+    return columns, len(columns)
+
+def _fetch_page(cursor, limit):
+    """Turn the rows of a _paged_query into a Page"""
+    cursor.row_factory = None  # Plain tuples; the Page holds the names once
+    rows = cursor.fetchall()
+    columns, width = _key_start(cursor)
+    next_key = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_key = list(rows[-1][width:])
+    return Page(columns[:width], [row[:width] for row in rows], next_key)
+
+def _stream_batches(query, params, limit, batch_size):
+    """Yield Pages of up to batch_size rows, fetchmany() at a time, up to limit rows"""
+    with read_connection() as conn:
+        cursor = conn.execute(query, params)
+    cursor.row_factory = None
+    columns, width = _key_start(cursor)
+    columns = columns[:width]
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        rows = cursor.fetchmany(size)
+        if not rows:
+            break
+        if remaining is not None:
+            remaining -= len(rows)
+        yield Page(columns, [row[:width] for row in rows])
+    cursor.close()
+
+def _run_paged(query, params, limit, stream=False):
+    """Run a _paged_query.
+    
+    Returns a Page, or with stream=True a generator of Pages so the
+    caller never holds more than STREAM_BATCH_SIZE rows at once.
+    """
+    if stream:
+        return _stream_batches(query, params, limit, STREAM_BATCH_SIZE)
+    with read_connection() as conn:
+        return _fetch_page(conn.execute(query, params), limit)
+
+def _list_version(query, params):
+    """Run a count/max(row_version)/last-change validator query.
+    
+    The last change must cover rows that left the list as well as those
+    still in it, or a removal would leave Last-Modified where it was.
+    """
+    with read_connection() as conn:
+        count, version, last_modified = conn.execute(query, params).fetchone()
+    return {'version': f'{count}-{version or 0}', 'last_modified': last_modified or None}
+
+def _left_list_at(table, statuses):
+    """Scalar subquery for when a user's row last moved to one of statuses,
+    one index seek per status; '' if never"""
+    seeks = [f'''COALESCE((SELECT updated_at FROM {table}
+                          WHERE user_id = ? AND status = '{status}'
+                          ORDER BY row_version DESC LIMIT 1), '')'''
+             for status in statuses]
+    return seeks[0] if len(seeks) == 1 else f"MAX({', '.join(seeks)})"
+
+def interaction_weight(borrowed, rating=None):
+    """How strongly a user's loan and/or review of a book says they liked it.
+    
+    A loan counts 1 and a review adds (rating - 3) / 2, so a 5-star review
+    doubles a loan and a 1-star review cancels it out. Never negative.
+    """
+    weight = 1.0 if borrowed else 0.0
+    if rating is not None:
+        weight += (rating - 3) / 2
+    return max(weight, 0.0)
+
+def calculate_fine(due_date, return_date):
+    """Fine owed for returning a book on return_date"""
+    if return_date <= due_date:
+        return 0.0
+    return (return_date - due_date).days * FINE_PER_DAY
 
 class User:
     @staticmethod
     def create(username, email, password, full_name=None, phone=None):
         """Create a new user"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        password_hash = generate_password_hash(password)
-        
-        try:
-            cursor.execute('''
-                INSERT INTO users (username, email, password_hash, full_name, phone)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (username, email, password_hash, full_name, phone))
-            conn.commit()
+        password_hash = hash_password(password)
+
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute('''
+                    INSERT INTO users (username, email, password_hash, full_name, phone)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (username, email, password_hash, full_name, phone))
+            except Exception as e:
+                return None
             user_id = cursor.lastrowid
-            conn.close()
-            return {'user_id': user_id, 'username': username, 'email': email}
-        except Exception as e:
-            conn.close()
-            return None
-    
+        return {'user_id': user_id, 'username': username, 'email': email}
+
     @staticmethod
     def authenticate(username, password):
-        """Verify user credentials"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        conn.close()
-        
-        if user and check_password_hash(user['password_hash'], password):
-            return dict(user)
-        return None
-    
+        """Verify user credentials, upgrading hashes made with old KDF settings"""
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE username = ?', (username,))
+            user = cursor.fetchone()
+
+        if not user or not verify_password(user['password_hash'], password):
+            return None
+
+        user = dict(user)
+        if needs_rehash(user['password_hash']):
+            try:
+                new_hash = hash_password(password)
+            except HashingOverloaded:
+                return user  # Upgrade on a quieter login instead
+            with db_connection() as conn:
+                # Only replace the hash we verified, in case it changed meanwhile
+                conn.execute('''
+                    UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE user_id = ? AND password_hash = ?
+                ''', (new_hash, user['user_id'], user['password_hash']))
+            user['password_hash'] = new_hash
+        return user
+
     @staticmethod
     def get_by_id(user_id):
         """Get user by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
+            user = cursor.fetchone()
         return dict(user) if user else None
 
+RATING_STATS_JOIN = 'LEFT JOIN book_rating_stats s ON s.book_id = b.book_id'
+
 class Book:
+    FIELDS = {**_columns('b', '''book_id isbn title author publisher publication_year category
+                                total_copies available_copies description cover_image_url
+                                created_at updated_at'''),
+              'average_rating': 's.average_rating',
+              'review_count': 'COALESCE(s.review_count, 0)'}
+
     @staticmethod
-    def get_all(search=None, category=None):
-        """Get all books with optional search and category filter"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        query = 'SELECT * FROM books WHERE 1=1'
-        params = []
+    def get_all(search=None, category=None, limit=None, after=None, fields=None,
+                stream=False):
+        """Get books with optional search and category filter.
         
+        Returns a Page of at most limit books, starting after the keyset
+        cursor from a previous page. fields restricts the columns returned.
+        With stream=True, returns a generator of row batches instead.
+        Pages are cached; streams are not.
+        """
         if search:
-            query += ' AND (title LIKE ? OR author LIKE ?)'
-            params.extend([f'%{search}%', f'%{search}%'])
-        
-        if category:
-            query += ' AND category = ?'
-            params.append(category)
-        
-        cursor.execute(query, params)
-        books = cursor.fetchall()
-        conn.close()
-        return [dict(book) for book in books]
-    
+            search = ' '.join(search.lower().split())
+        if stream:
+            return Book._query_all(search, category, limit, after, fields, stream=True)
+
+        key = 'catalog:' + json.dumps([search, category, limit, after, fields])
+        _sync_book_cache()
+        cached = book_cache.get(key)
+        if cached is not None:
+            return Page(*cached)
+
+        # book_id is needed to tag the page for invalidation
+        token = book_cache.generation()
+        query_fields = fields
+        if fields and 'book_id' not in fields:
+            query_fields = list(fields) + ['book_id']
+        page = Book._query_all(search, category, limit, after, query_fields)
+
+        tags = ['catalog'] + [f'book:{book_id}' for book_id in page.column('book_id')]
+        if query_fields is not fields:
+            page = page.without('book_id')
+        # Lets responses reuse their encoded bytes until the entry is refetched
+        page.version = f'{key}@{os.getpid()}.{next(_page_fetches)}'
+        book_cache.set(key, [page.columns, page.rows, page.next_key, page.version], tags, token)
+        return page
+
+    @staticmethod
+    def _query_all(search, category, limit, after, fields, stream=False):
+        """Run the catalog query behind get_all"""
+        with read_connection() as conn:
+            match = Book._fts_query(search) if USE_FTS and fts_available(conn) else None
+
+            if match:
+                # Ranked full-text search with prefix matching
+                from_where = f'''
+                    FROM books_fts
+                    JOIN books b ON b.book_id = books_fts.rowid
+                    {RATING_STATS_JOIN}
+                    WHERE books_fts MATCH ?
+                '''
+                params = [match]
+                order_keys = ['books_fts.rank', 'b.book_id']
+            else:
+                from_where = f'FROM books b {RATING_STATS_JOIN} WHERE 1=1'
+                params = []
+                order_keys = ['b.book_id']
+                if search:
+                    from_where += ' AND (b.title LIKE ? OR b.author LIKE ?)'
+                    params.extend([f'%{search}%', f'%{search}%'])
+
+            if category:
+                from_where += ' AND b.category = ?'
+                params.append(category)
+
+            query, params = _paged_query(from_where, params, Book.FIELDS, fields,
+                                         order_keys, limit, after)
+        return _run_paged(query, params, limit, stream)
+
+    @staticmethod
+    def _fts_query(search):
+        """Turn free text into an FTS5 query matching every word as a prefix"""
+        if not search:
+            return None
+        words = re.findall(r'\w+', search)
+        return ' '.join(f'"{word}"*' for word in words) or None
+
+    @staticmethod
+    def get_top_rated(min_reviews=1, limit=None, after=None, fields=None, stream=False):
+        """Get books by average rating, highest first, from the rating stats index"""
+        query, params = _paged_query('''
+            FROM book_rating_stats s
+            JOIN books b ON b.book_id = s.book_id
+            WHERE s.review_count >= ?
+        ''', [min_reviews], Book.FIELDS, fields,
+            ['s.average_rating', 's.review_count', 's.book_id'], limit, after, descending=True)
+        return _run_paged(query, params, limit, stream)
+
     @staticmethod
     def get_by_id(book_id):
-        """Get book by ID"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM books WHERE book_id = ?', (book_id,))
-        book = cursor.fetchone()
-        conn.close()
-        return dict(book) if book else None
-    
+        """Get book by ID, with its rating aggregates"""
+        key = f'book:{book_id}'
+        _sync_book_cache()
+        book = book_cache.get(key)
+        if book is not None:
+            return book
+
+        token = book_cache.generation()
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT b.*, s.average_rating, COALESCE(s.review_count, 0) AS review_count,
+                       s.rating_1, s.rating_2, s.rating_3, s.rating_4, s.rating_5
+                FROM books b {RATING_STATS_JOIN}
+                WHERE b.book_id = ?
+            ''', (book_id,))
+            book = cursor.fetchone()
+        if not book:
+            return None
+        book = dict(book)
+        book['rating_histogram'] = {str(stars): book.pop(f'rating_{stars}') or 0
+                                    for stars in range(1, 6)}
+        book_cache.set(key, book, [key], token)
+        return book
+
+    @staticmethod
+    def get_many(book_ids, fields=None):
+        """Get several books in one query, in the order requested.
+        
+        IDs that do not exist are left out; duplicates are returned once.
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        if not book_ids:
+            return []
+        query_fields = fields
+        if fields and 'book_id' not in fields:
+            query_fields = list(fields) + ['book_id']
+        query, params = _paged_query(f'''
+            FROM books b {RATING_STATS_JOIN}
+            WHERE b.book_id IN ({', '.join('?' * len(book_ids))})
+        ''', book_ids, Book.FIELDS, query_fields, ['b.book_id'])
+        page = _run_paged(query, params, None)
+        by_id = dict(zip(page.column('book_id'), page))
+
+        books = [by_id[book_id] for book_id in book_ids if book_id in by_id]
+        if query_fields is not fields:
+            for book in books:
+                del book['book_id']
+        return books
+
+    @staticmethod
+    def get_version(book_id):
+        """Get the book's row version and last change time, or None"""
+        with read_connection() as conn:
+            row = conn.execute('''
+                SELECT row_version, updated_at FROM books WHERE book_id = ?
+            ''', (book_id,)).fetchone()
+        if not row:
+            return None
+        return {'version': str(row['row_version']), 'last_modified': row['updated_at']}
+
     @staticmethod
     def update_availability(book_id, change):
         """Update available copies (change can be +1 or -1)"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE books 
-            SET available_copies = available_copies + ? 
-            WHERE book_id = ?
-        ''', (change, book_id))
-        conn.commit()
-        conn.close()
+        with db_connection() as conn:
+            conn.execute('''
+                UPDATE books
+                SET available_copies = available_copies + ?
+                WHERE book_id = ?
+            ''', (change, book_id))
+        invalidate_books(book_id)
 
 class BorrowingRecord:
+    FIELDS = {**_columns('br', '''record_id user_id book_id borrow_date due_date return_date
+                                 status fine_amount created_at updated_at'''),
+              **_columns('b', 'title author isbn')}
+
     @staticmethod
     def create(user_id, book_id, days=14):
-        """Create a new borrowing record"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        due_date = datetime.now() + timedelta(days=days)
-        
-        cursor.execute('''
-            INSERT INTO borrowing_records (user_id, book_id, due_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, book_id, due_date))
-        conn.commit()
-        record_id = cursor.lastrowid
-        conn.close()
+        """Borrow a book; returns the record ID, or None if no copy is available.
         
-        # Decrease available copies
-        Book.update_availability(book_id, -1)
+        A copy held for one of the user's reservations is used first.
+        """
+        due_date = datetime.now() + timedelta(days=days)
+
+        def borrow(conn):
+            # A copy held for this user's reservation is already off the shelf
+            if not Reservation._collect_hold(conn, user_id, book_id):
+                # Claim a copy only if one is left, so concurrent borrowers
+                # can never drive available_copies negative
+                cursor = conn.execute('''
+                    UPDATE books
+                    SET available_copies = available_copies - 1
+                    WHERE book_id = ? AND available_copies > 0
+                ''', (book_id,))
+                if cursor.rowcount == 0:
+                    return None
+
+            cursor = conn.execute('''
+                INSERT INTO borrowing_records (user_id, book_id, due_date)
+                VALUES (?, ?, ?)
+            ''', (user_id, book_id, due_date))
+            return cursor.lastrowid
+
+        record_id = run_in_transaction(borrow)
+        if record_id is not None:
+            invalidate_books(book_id)
         return record_id
-    
+
     @staticmethod
     def return_book(record_id):
-        """Mark a book as returned"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get the record
-        cursor.execute('SELECT * FROM borrowing_records WHERE record_id = ?', (record_id,))
-        record = cursor.fetchone()
+        """Mark a book as returned; returns the fine, or None if not on loan.
         
-        if not record:
-            conn.close()
+        The copy goes to the head of the book's hold queue if anyone is
+        waiting, otherwise back on the shelf.
+        """
+        def give_back(conn):
+            record = conn.execute('''
+                SELECT book_id, due_date FROM borrowing_records
+                WHERE record_id = ? AND status = 'borrowed'
+            ''', (record_id,)).fetchone()
+
+            if not record:
+                return None
+
+            return_date = datetime.now()
+            fine = calculate_fine(datetime.fromisoformat(record['due_date']), return_date)
+
+            conn.execute('''
+                UPDATE borrowing_records
+                SET return_date = ?, status = 'returned', fine_amount = ?
+                WHERE record_id = ?
+            ''', (return_date, fine, record_id))
+
+            Reservation._assign_copy(conn, record['book_id'], return_date)
+            return fine, record['book_id']
+
+        result = run_in_transaction(give_back)
+        if result is None:
             return None
+        fine, book_id = result
+        invalidate_books(book_id)
+        return fine
+
+    @staticmethod
+    def create_batch(user_id, book_ids, days=14):
+        """Borrow several books in one transaction.
         
-        # Calculate fine if overdue
-        due_date = datetime.fromisoformat(record['due_date'])
-        return_date = datetime.now()
-        fine = 0.0
-        
-        if return_date > due_date:
-            days_overdue = (return_date - due_date).days
-            fine = days_overdue * 0.50  # $0.50 per day
+        Returns a record ID per requested book, in order, or None for books
+        with no copy left; the others are still borrowed. A book listed
+        twice takes two copies. Copies held for the user are used first.
+        """
+        due_date = datetime.now() + timedelta(days=days)
+        distinct = list(dict.fromkeys(book_ids))
+
+        def borrow_all(conn):
+            # BEGIN IMMEDIATE already holds the write lock, so one read of
+            # every book's availability stays true until we commit
+            placeholders = ', '.join('?' * len(distinct))
+            available = dict(conn.execute(f'''
+                SELECT book_id, available_copies FROM books
+                WHERE book_id IN ({placeholders})
+            ''', distinct).fetchall())
+            holds = {}
+            for hold in conn.execute(f'''
+                SELECT reservation_id, book_id FROM reservations
+                WHERE user_id = ? AND status = 'ready' AND book_id IN ({placeholders})
+            ''', [user_id, *distinct]):
+                holds.setdefault(hold['book_id'], []).append(hold['reservation_id'])
+
+            claimed = {}
+            collected = []
+            results = []
+            for book_id in book_ids:
+                if holds.get(book_id):
+                    collected.append((holds[book_id].pop(),))
+                elif available.get(book_id, 0) - claimed.get(book_id, 0) > 0:
+                    claimed[book_id] = claimed.get(book_id, 0) + 1
+                else:
+                    results.append(None)
+                    continue
+                cursor = conn.execute('''
+                    INSERT INTO borrowing_records (user_id, book_id, due_date)
+                    VALUES (?, ?, ?)
+                ''', (user_id, book_id, due_date))
+                results.append(cursor.lastrowid)
+
+            conn.executemany('''
+                UPDATE books
+                SET available_copies = available_copies - ?
+                WHERE book_id = ?
+            ''', [(count, book_id) for book_id, count in claimed.items()])
+            conn.executemany('''
+                UPDATE reservations SET status = 'fulfilled' WHERE reservation_id = ?
+            ''', collected)
+            return results, list(claimed)
+
+        if not distinct:
+            return []
+        results, borrowed = run_in_transaction(borrow_all)
+        invalidate_books(*borrowed)
+        return results
+
+    @staticmethod
+    def return_batch(record_ids):
+        """Return several books in one transaction.
         
-        # Update record
-        cursor.execute('''
-            UPDATE borrowing_records 
-            SET return_date = ?, status = 'returned', fine_amount = ?
-            WHERE record_id = ?
-        ''', (return_date, fine, record_id))
-        conn.commit()
-        conn.close()
+        Returns the fine per requested record, in order, or None for
+        records that are not on loan. Copies go to waiting holds first,
+        as in return_book.
+        """
+        distinct = list(dict.fromkeys(record_ids))
+
+        def give_back_all(conn):
+            records = conn.execute(f'''
+                SELECT record_id, book_id, due_date FROM borrowing_records
+                WHERE record_id IN ({', '.join('?' * len(distinct))}) AND status = 'borrowed'
+            ''', distinct).fetchall()
+
+            return_date = datetime.now()
+            fines = {}
+            returned = {}
+            for record in records:
+                fines[record['record_id']] = calculate_fine(
+                    datetime.fromisoformat(record['due_date']), return_date)
+                returned[record['book_id']] = returned.get(record['book_id'], 0) + 1
+
+            conn.executemany('''
+                UPDATE borrowing_records
+                SET return_date = ?, status = 'returned', fine_amount = ?
+                WHERE record_id = ?
+            ''', [(return_date, fine, record_id) for record_id, fine in fines.items()])
+            for book_id, count in returned.items():
+                for _ in range(count):
+                    Reservation._assign_copy(conn, book_id, return_date)
+            return fines, list(returned)
+
+        if not distinct:
+            return []
+        fines, book_ids = run_in_transaction(give_back_all)
+        invalidate_books(*book_ids)
+        # A record listed twice is only returned once
+        results = []
+        for record_id in record_ids:
+            results.append(fines.pop(record_id, None))
+        return results
+
+    @staticmethod
+    def accrue_fines(now=None, batch_size=500):
+        """Bring fine_amount up to date on loans that are overdue.
         
-        # Increase available copies
-        Book.update_availability(record['book_id'], 1)
-        return fine
-    
+        Walks overdue loans in due_date order, batch_size at a time, and
+        writes only the fines that changed, one short transaction per
+        batch. Returns the number of records updated.
+        """
+        now = now or datetime.now()
+        cutoff = now - timedelta(days=1)  # Less than a day late owes nothing yet
+        after = ('', 0)
+        updated = 0
+        while True:
+            with read_connection() as conn:
+                rows = conn.execute('''
+                    SELECT record_id, due_date, fine_amount FROM borrowing_records
+                    WHERE status = 'borrowed' AND due_date <= ?
+                          AND (due_date, record_id) > (?, ?)
+                    ORDER BY due_date, record_id
+                    LIMIT ?
+                ''', (cutoff, *after, batch_size)).fetchall()
+            if not rows:
+                break
+            after = (rows[-1]['due_date'], rows[-1]['record_id'])
+
+            changes = []
+            for row in rows:
+                fine = calculate_fine(datetime.fromisoformat(row['due_date']), now)
+                if fine != row['fine_amount']:
+                    changes.append((fine, row['record_id']))
+            if changes:
+                # status is re-checked in case the book came back meanwhile
+                run_in_transaction(lambda conn: conn.executemany('''
+                    UPDATE borrowing_records SET fine_amount = ?
+                    WHERE record_id = ? AND status = 'borrowed'
+                ''', changes))
+                updated += len(changes)
+            if len(rows) < batch_size:
+                break
+        return updated
+
     @staticmethod
-    def get_user_borrowed(user_id):
-        """Get all currently borrowed books for a user"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT br.*, b.title, b.author, b.isbn
+    def get_user_borrowed(user_id, limit=None, after=None, fields=None, stream=False):
+        """Get currently borrowed books for a user, soonest due first"""
+        query, params = _paged_query('''
             FROM borrowing_records br
             JOIN books b ON br.book_id = b.book_id
             WHERE br.user_id = ? AND br.status = 'borrowed'
-            ORDER BY br.due_date
-        ''', (user_id,))
-        records = cursor.fetchall()
-        conn.close()
-        return [dict(record) for record in records]
+        ''', [user_id], BorrowingRecord.FIELDS, fields, ['br.due_date', 'br.record_id'],
+            limit, after)
+        return _run_paged(query, params, limit, stream)
+
+    @staticmethod
+    def get_user_borrowed_version(user_id):
+        """Version of a user's borrowed list, from one covering-index query.
+        
+        Last-Modified also counts the latest return, which drops a loan
+        from the list.
+        """
+        return _list_version(f'''
+            SELECT COUNT(*), MAX(row_version),
+                   MAX(COALESCE(MAX(updated_at), ''),
+                       {_left_list_at('borrowing_records', ['returned'])})
+            FROM borrowing_records
+            WHERE user_id = ? AND status = 'borrowed'
+        ''', (user_id, user_id))
 
 class Reservation:
+    """Reservations form a FIFO hold queue per book.
+    
+    A pending reservation's queue_seq is its place in line counted from
+    the start of the queue; hold_queues.served counts the holds already
+    handed a copy, so queue position is queue_seq - served. When a copy
+    comes back the head of the queue becomes 'ready' and keeps that copy
+    until it is borrowed ('fulfilled') or the hold expires.
+    """
+    FIELDS = {**_columns('r', '''reservation_id user_id book_id reservation_date expiry_date
+                                status created_at updated_at'''),
+              **_columns('b', 'title author'),
+              'queue_position': "CASE WHEN r.status = 'pending' THEN r.queue_seq - q.served END"}
+
     @staticmethod
-    def create(user_id, book_id, days=7):
-        """Create a new reservation"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        expiry_date = datetime.now() + timedelta(days=days)
+    def create(user_id, book_id, days=HOLD_PICKUP_DAYS):
+        """Reserve a book.
         
-        cursor.execute('''
-            INSERT INTO reservations (user_id, book_id, expiry_date)
-            VALUES (?, ?, ?)
-        ''', (user_id, book_id, expiry_date))
-        conn.commit()
-        reservation_id = cursor.lastrowid
-        conn.close()
+        If a copy is on the shelf it is held for the user straight away
+        (status 'ready') and lapses after days. Otherwise the reservation
+        joins the back of the book's hold queue, with no expiry until a
+        copy is held for it. A user with a pending or ready reservation
+        for the book already gets that reservation's ID back.
+        """
+        expiry_date = datetime.now() + timedelta(days=days)
+
+        def reserve(conn):
+            existing = conn.execute('''
+                SELECT reservation_id FROM reservations
+                WHERE user_id = ? AND status IN ('pending', 'ready') AND book_id = ?
+                LIMIT 1
+            ''', (user_id, book_id)).fetchone()
+            if existing:
+                return existing[0], False
+
+            # Copies only sit on the shelf when nobody is queueing for them
+            cursor = conn.execute('''
+                UPDATE books
+                SET available_copies = available_copies - 1
+                WHERE book_id = ? AND available_copies > 0
+            ''', (book_id,))
+            if cursor.rowcount:
+                cursor = conn.execute('''
+                    INSERT INTO reservations (user_id, book_id, expiry_date, status)
+                    VALUES (?, ?, ?, 'ready')
+                ''', (user_id, book_id, expiry_date))
+                return cursor.lastrowid, True
+
+            conn.execute('INSERT OR IGNORE INTO hold_queues (book_id) VALUES (?)', (book_id,))
+            conn.execute('''
+                UPDATE hold_queues
+                SET tail_seq = tail_seq + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE book_id = ?
+            ''', (book_id,))
+            cursor = conn.execute('''
+                INSERT INTO reservations (user_id, book_id, queue_seq)
+                SELECT ?, ?, tail_seq FROM hold_queues WHERE book_id = ?
+            ''', (user_id, book_id, book_id))
+            return cursor.lastrowid, False
+
+        reservation_id, held = run_in_transaction(reserve)
+        if held:
+            invalidate_books(book_id)
         return reservation_id
-    
+
     @staticmethod
-    def get_user_reservations(user_id):
-        """Get all reservations for a user"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.*, b.title, b.author
+    def _assign_copy(conn, book_id, now):
+        """Hand a returned copy to the head of the hold queue, or shelve it.
+        
+        Returns the reservation now holding the copy, or None if it went
+        back into available_copies.
+        """
+        head = conn.execute('''
+            SELECT reservation_id FROM reservations
+            WHERE book_id = ? AND status = 'pending'
+            ORDER BY queue_seq
+            LIMIT 1
+        ''', (book_id,)).fetchone()
+        if head is None:
+            conn.execute('''
+                UPDATE books
+                SET available_copies = available_copies + 1
+                WHERE book_id = ?
+            ''', (book_id,))
+            return None
+
+        conn.execute('''
+            UPDATE reservations SET status = 'ready', expiry_date = ?
+            WHERE reservation_id = ?
+        ''', (now + timedelta(days=HOLD_PICKUP_DAYS), head['reservation_id']))
+        conn.execute('''
+            UPDATE hold_queues
+            SET served = served + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE book_id = ?
+        ''', (book_id,))
+        return head['reservation_id']
+
+    @staticmethod
+    def _collect_hold(conn, user_id, book_id):
+        """Mark a copy held for the user as collected; False if none is held"""
+        cursor = conn.execute('''
+            UPDATE reservations SET status = 'fulfilled'
+            WHERE reservation_id = (
+                SELECT reservation_id FROM reservations
+                WHERE user_id = ? AND status = 'ready' AND book_id = ?
+                LIMIT 1
+            )
+        ''', (user_id, book_id))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def expire_overdue(now=None, batch_size=500):
+        """Expire holds not collected by their expiry_date.
+        
+        Queued reservations have no expiry_date until a copy is held for
+        them, so waiting in line never lapses. The copy behind an expired
+        hold passes to the next in line. Works batch_size rows per
+        transaction so the write lock is never held for long. Returns the
+        number of reservations expired.
+        """
+        now = now or datetime.now()
+
+        def expire(conn):
+            rows = conn.execute('''
+                SELECT reservation_id, book_id FROM reservations
+                WHERE status = 'ready' AND expiry_date < ?
+                LIMIT ?
+            ''', (now, batch_size)).fetchall()
+
+            shelved = []
+            for row in rows:
+                conn.execute('''
+                    UPDATE reservations SET status = 'expired' WHERE reservation_id = ?
+                ''', (row['reservation_id'],))
+                if Reservation._assign_copy(conn, row['book_id'], now) is None:
+                    shelved.append(row['book_id'])
+            return len(rows), shelved
+
+        total = 0
+        while True:
+            expired, shelved = run_in_transaction(expire)
+            invalidate_books(*set(shelved))
+            total += expired
+            if expired < batch_size:
+                return total
+
+    @staticmethod
+    def get_user_reservations(user_id, status='pending', limit=None, after=None, fields=None,
+                              stream=False):
+        """Get a user's reservations with the given status, oldest first.
+        
+        Pending reservations carry their queue_position (1 = next in line).
+        """
+        query, params = _paged_query('''
+            FROM reservations r
+            JOIN books b ON r.book_id = b.book_id
+            LEFT JOIN hold_queues q ON q.book_id = r.book_id
+            WHERE r.user_id = ? AND r.status = ?
+        ''', [user_id, status], Reservation.FIELDS, fields,
+            ['r.reservation_date', 'r.reservation_id'], limit, after)
+        return _run_paged(query, params, limit, stream)
+
+    @staticmethod
+    def get_user_reservations_version(user_id):
+        """Version of a user's pending and ready reservations.
+        
+        Includes how far their queues have moved, since queue positions
+        change without the user's own rows changing, and when a
+        reservation was last fulfilled or expired, which drops it from
+        the list.
+        """
+        return _list_version(f'''
+            SELECT COUNT(*),
+                   MAX(r.row_version) || '.' || COALESCE(SUM(q.served), 0),
+                   MAX(COALESCE(MAX(r.updated_at), ''), COALESCE(MAX(q.updated_at), ''),
+                       {_left_list_at('reservations', ['fulfilled', 'expired'])})
+            FROM reservations r
+            LEFT JOIN hold_queues q ON q.book_id = r.book_id
+            WHERE r.user_id = ? AND r.status IN ('pending', 'ready')
+        ''', (user_id, user_id, user_id))
+
+    @staticmethod
+    def get_book_queue(book_id, limit=None, after=None, fields=None, stream=False):
+        """Get the pending reservations for a book in queue order"""
+        query, params = _paged_query('''
             FROM reservations r
             JOIN books b ON r.book_id = b.book_id
-            WHERE r.user_id = ? AND r.status = 'pending'
-            ORDER BY r.reservation_date
-        ''', (user_id,))
-        reservations = cursor.fetchall()
-        conn.close()
-        return [dict(res) for res in reservations]
+            LEFT JOIN hold_queues q ON q.book_id = r.book_id
+            WHERE r.book_id = ? AND r.status = 'pending'
+        ''', [book_id], Reservation.FIELDS, fields, ['r.queue_seq'], limit, after)
+        return _run_paged(query, params, limit, stream)
 
 class Review:
+    FIELDS = {**_columns('r', '''review_id user_id book_id rating review_text created_at
+                                updated_at'''),
+              **_columns('u', 'username full_name')}
+
     @staticmethod
     def create(user_id, book_id, rating, review_text=None):
         """Create a new review"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO reviews (user_id, book_id, rating, review_text)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, book_id, rating, review_text))
-        conn.commit()
-        review_id = cursor.lastrowid
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO reviews (user_id, book_id, rating, review_text)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, book_id, rating, review_text))
+            review_id = cursor.lastrowid
+        # The book's rating aggregates just changed
+        invalidate_books(book_id)
         return review_id
-    
+
     @staticmethod
-    def get_book_reviews(book_id):
-        """Get all reviews for a book"""
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT r.*, u.username, u.full_name
+    def get_book_reviews(book_id, limit=None, after=None, fields=None, stream=False):
+        """Get reviews for a book, newest first"""
+        query, params = _paged_query('''
             FROM reviews r
             JOIN users u ON r.user_id = u.user_id
             WHERE r.book_id = ?
-            ORDER BY r.created_at DESC
+        ''', [book_id], Review.FIELDS, fields, ['r.created_at', 'r.review_id'],
+            limit, after, descending=True)
+        return _run_paged(query, params, limit, stream)
+
+    @staticmethod
+    def get_book_reviews_version(book_id):
+        """Version of a book's reviews, from one covering-index query"""
+        return _list_version('''
+            SELECT COUNT(*), MAX(row_version), MAX(updated_at) FROM reviews
+            WHERE book_id = ?
         ''', (book_id,))
-        reviews = cursor.fetchall()
-        conn.close()
-        return [dict(review) for review in reviews]
+
+class Recommendation:
+    FIELDS = {**Book.FIELDS, 'score': 'bs.score'}
+
+    @staticmethod
+    def get_similar(book_id, limit=None, after=None, fields=None, stream=False):
+        """Get the books most often borrowed and liked by the same readers as
+        this one, most similar first, from the precomputed neighbours"""
+        query, params = _paged_query(f'''
+            FROM book_similarities bs
+            JOIN books b ON b.book_id = bs.similar_book_id
+            {RATING_STATS_JOIN}
+            WHERE bs.book_id = ?
+        ''', [book_id], Recommendation.FIELDS, fields, ['bs.rank'], limit, after)
+        return _run_paged(query, params, limit, stream)
+
+    @staticmethod
+    def get_for_user(user_id, limit=20, fields=None):
+        """Get books a user may like, best first, each with a score.
+        
+        Sums the neighbours of the books in the user's recent history,
+        weighted by how much they liked each, leaving out the books in their
+        last RECOMMENDATION_ROWS loans and reviews. Empty for a user with
+        no history.
+        """
+        with read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None  # Plain tuples: this runs on every lookup
+            loans = [book_id for book_id, in cursor.execute('''
+                SELECT book_id FROM borrowing_records
+                WHERE user_id = ?
+                ORDER BY borrow_date DESC
+                LIMIT ?
+            ''', (user_id, RECOMMENDATION_ROWS))]
+            ratings = dict(cursor.execute('''
+                SELECT book_id, rating FROM reviews
+                WHERE user_id = ?
+                ORDER BY created_at DESC
+                LIMIT ?
+            ''', (user_id, RECOMMENDATION_ROWS)))
+            loaned = set(loans)
+            seen = loaned | set(ratings)
+            recent = list(dict.fromkeys(loans + list(ratings)))[:RECOMMENDATION_HISTORY]
+            weights = {book_id: interaction_weight(book_id in loaned, ratings.get(book_id))
+                       for book_id in recent}
+            weights = {book_id: weight for book_id, weight in weights.items() if weight}
+            if not weights:
+                return []
+            neighbours = cursor.execute(f'''
+                SELECT book_id, similar_book_id, score FROM book_similarities
+                WHERE book_id IN ({', '.join('?' * len(weights))}) AND rank <= ?
+            ''', [*weights, RECOMMENDATION_NEIGHBOURS]).fetchall()
+
+        scores = {}
+        for book_id, similar_id, score in neighbours:
+            if similar_id not in seen:
+                scores[similar_id] = scores.get(similar_id, 0.0) + weights[book_id] * score
+        # Ties go to the lower book_id
+        best = heapq.nlargest(limit, ((score, -book_id) for book_id, score in scores.items()))
+        if not best:
+            return []
+        best = {-negated_id: score for score, negated_id in best}
+
+        query_fields = fields
+        if fields and 'book_id' not in fields:
+            query_fields = list(fields) + ['book_id']
+        books = Book.get_many(list(best), query_fields)
+        for book in books:
+            book['score'] = round(best[book['book_id']], 6)
+            if query_fields is not fields:
+                del book['book_id']
+        return books
@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+class Page:
+    """Rows of a list query: the column names once, plus a tuple per row.
+    
+    Iterating or indexing gives each row as a dict, built on demand; the
+    response serializers encode columns and rows directly. next_key is
+    the sort key of the last row, or None when there are no more rows
+    after this page. version identifies the cache entry a page came from,
+    if any; it changes whenever the entry is refetched.
+    """
+    __slots__ = ('columns', 'rows', 'next_key', 'version')
+
+    def __init__(self, columns=(), rows=(), next_key=None, version=None):
+        self.columns = tuple(columns)
+        self.rows = rows if isinstance(rows, list) else list(rows)
+        self.next_key = next_key
+        self.version = version
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        columns = self.columns
+        for row in self.rows:
+            yield dict(zip(columns, row))
+
+    def __getitem__(self, index):
+        return dict(zip(self.columns, self.rows[index]))
+
+    def column(self, name):
+        """One column's value from every row"""
+        i = self.columns.index(name)
+        return [row[i] for row in self.rows]
+
+    def without(self, name):
+        """A copy of the page without one column"""
+        i = self.columns.index(name)
+        return Page(self.columns[:i] + self.columns[i + 1:],
+                    [row[:i] + row[i + 1:] for row in self.rows], self.next_key)
+
+def encode_cursor(key):
+    """Encode a page's next_key as an opaque URL-safe token"""
+    raw = json.dumps(key, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(key, list) or not all(
+            isinstance(value, (str, int, float)) for value in key):
+        raise ValueError('Invalid cursor')
+    return key
+
+def page_args(args, bounded=True):
+    """Parse limit, after and fields query parameters.
+    
+    Returns (limit, after, fields); raises ValueError on bad input. When
+    bounded is False (streamed responses) limit is optional and uncapped.
+    """
+    limit = args.get('limit', DEFAULT_PAGE_SIZE if bounded else None)
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        if bounded:
+            limit = min(limit, MAX_PAGE_SIZE)
+
+    after = args.get('after')
+    after = decode_cursor(after) if after else None
+
+    fields = args.get('fields')
+    fields = [name.strip() for name in fields.split(',') if name.strip()] if fields else None
+    return limit, after, fields
@@ -0,0 +1,89 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# KDF for new hashes, as a werkzeug method string such as 'scrypt:32768:8:1'
+# or 'pbkdf2:sha256:600000'. Hashes made with other parameters are
+# upgraded on the user's next successful login.
+PASSWORD_HASH_METHOD = os.environ.get('LIBRARY_PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+
+# hashlib's scrypt and pbkdf2 release the GIL, so threads scale across
+# cores; 'process' is available for KDFs that do not
+HASH_EXECUTOR = os.environ.get('LIBRARY_HASH_EXECUTOR', 'thread')
+HASH_WORKERS = int(os.environ.get('LIBRARY_HASH_WORKERS', os.cpu_count() or 2))
+
+# Hashes queued or running before new requests are turned away
+HASH_QUEUE_LIMIT = int(os.environ.get('LIBRARY_HASH_QUEUE_LIMIT', HASH_WORKERS * 4))
+
+class HashingOverloaded(Exception):
+    """Raised when the hashing queue is full; the client should retry later"""
+    retry_after = 1
+
+_lock = threading.Lock()
+_executor = None
+_in_flight = 0
+_method_prefix = None
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            pool = ProcessPoolExecutor if HASH_EXECUTOR == 'process' else ThreadPoolExecutor
+            _executor = pool(max_workers=HASH_WORKERS)
+        return _executor
+
+def _reset_after_fork():
+    """Executor threads do not survive fork(); start fresh in the child"""
+    global _executor, _in_flight, _lock
+    _executor = None
+    _in_flight = 0
+    _lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _release(_=None):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+def _run(fn, *args):
+    """Run fn on the hashing pool and wait for it, or refuse if the queue is full"""
+    global _in_flight
+    with _lock:
+        if _in_flight >= HASH_QUEUE_LIMIT:
+            raise HashingOverloaded()
+        _in_flight += 1
+    try:
+        future = _get_executor().submit(fn, *args)
+    except Exception:
+        _release()
+        raise
+    future.add_done_callback(_release)
+    return future.result()
+
+def hash_password(password):
+    """Hash a password with the configured KDF"""
+    return _run(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(password_hash, password):
+    """Check a password against a stored hash"""
+    return _run(check_password_hash, password_hash, password)
+
+def needs_rehash(password_hash):
+    """True if the hash was made with different KDF parameters"""
+    global _method_prefix
+    if _method_prefix is None:
+        # werkzeug expands defaults (e.g. 'scrypt' -> 'scrypt:32768:8:1')
+        _method_prefix = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return password_hash.split('$', 1)[0] != _method_prefix
+
+def pool_stats():
+    """Hashing pool configuration and current queue depth"""
+    return {
+        'executor': HASH_EXECUTOR,
+        'workers': HASH_WORKERS,
+        'queue_limit': HASH_QUEUE_LIMIT,
+        'in_flight': _in_flight,
+    }
@@ -0,0 +1,259 @@
+"""Per-route token-bucket rate limits, per client IP and per user.
+
+Each policy is a bucket of burst tokens refilled at rate tokens per
+second; a request takes one token from every policy that applies to its
+route, or none at all if any of those buckets is empty, in which case it
+is rejected with 429 and Retry-After.
+The check runs before the view, so a rejected request costs no database
+or password-hashing work.
+
+Buckets live in a store:
+
+    memory   a dict in this process (limits are per worker)
+    shared   a memory-mapped file next to the database, shared by every
+             worker process on the host (the default where fcntl exists)
+
+    LIBRARY_RATELIMIT=0            turn rate limiting off
+    LIBRARY_RATELIMIT_STORE=memory keep buckets per process
+    LIBRARY_RATELIMIT_FILE=path    where the shared buckets live
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from flask import request
+
+import database
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process, so the thread lock is enough
+    fcntl = None
+
+RATELIMIT_ENABLED = os.environ.get('LIBRARY_RATELIMIT', '1') != '0'
+RATELIMIT_STORE = os.environ.get('LIBRARY_RATELIMIT_STORE', 'shared' if fcntl else 'memory')
+RATELIMIT_FILE = os.environ.get('LIBRARY_RATELIMIT_FILE')  # Default: <database>.ratelimit
+
+# scope is 'ip', 'user' or 'user_ip' (a user from one address); a policy
+# with param only applies to requests that have that query parameter
+Policy = namedtuple('Policy', 'name rate burst scope param', defaults=(None,))
+
+# Applies to every endpoint not listed in POLICIES or EXEMPT_ENDPOINTS.
+# Generous per IP, since many phones can share one carrier NAT address.
+DEFAULT_POLICIES = [Policy('api', rate=100.0, burst=300, scope='ip')]
+
+# endpoint -> policies, checked in addition to DEFAULT_POLICIES
+POLICIES = {
+    'get_books': [Policy('search', rate=10.0, burst=30, scope='ip', param='search')],
+    # Every attempt costs a password hash. Guesses at one username are also
+    # limited per address, so attempts from elsewhere cannot lock its owner out
+    'login': [Policy('login', rate=2.0, burst=20, scope='ip'),
+              Policy('login_user', rate=1 / 12, burst=5, scope='user_ip')],
+    'register': [Policy('register', rate=0.5, burst=10, scope='ip')],
+    # The user_id comes from the request, so per user alone anyone could
+    # spend a patron's tokens for them
+    'borrow_book': [Policy('writes_user', rate=5.0, burst=20, scope='user_ip')],
+    'borrow_books': [Policy('writes_user', rate=5.0, burst=20, scope='user_ip')],
+    'reserve_book': [Policy('writes_user', rate=5.0, burst=20, scope='user_ip')],
+    'create_review': [Policy('writes_user', rate=5.0, burst=20, scope='user_ip')],
+}
+
+# Health checks and scrapes come from infrastructure polling on a schedule
+EXEMPT_ENDPOINTS = {'health_check', 'get_metrics', 'static'}
+
+def _refill(tokens, updated, rate, burst, now):
+    """Tokens in a bucket once refilled to now"""
+    return min(burst, tokens + max(0.0, now - updated) * rate)
+
+def _wait(tokens, rate):
+    """Seconds until a bucket holding tokens has one to take, 0.0 if now"""
+    return 0.0 if tokens >= 1 else (1 - tokens) / rate
+
+class MemoryStore:
+    """Buckets in a dict, for one process; the least recently used are
+    forgotten past max_keys"""
+
+    name = 'memory'
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, buckets, now):
+        """Take a token from each (key, rate, burst) bucket, or from none if
+        any is empty; returns each bucket's seconds to wait, all 0.0 if
+        the tokens were taken"""
+        with self._lock:
+            tokens = [_refill(*self._buckets.get(key, (burst, now)), rate, burst, now)
+                      for key, rate, burst in buckets]
+            waits = [_wait(left, rate) for left, (_, rate, _) in zip(tokens, buckets)]
+            if not any(waits):
+                for left, (key, _, _) in zip(tokens, buckets):
+                    self._buckets.pop(key, None)
+                    self._buckets[key] = (left - 1, now)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+        return waits
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+
+class SharedMemoryStore:
+    """Buckets in a memory-mapped file shared by every process on the host.
+
+    The file is a hash table of sets, each of ways slots holding a key's
+    64-bit hash, tokens and last update time. A new key takes the least
+    recently updated slot of its set, so when a set is full an idle key's
+    bucket is forgotten and starts full again. Each set is locked with an
+    fcntl byte-range lock across processes, plus a thread lock within one.
+    """
+
+    name = 'shared'
+    SLOT = struct.Struct('=Qdd')
+
+    def __init__(self, path=None, sets=16384, ways=4):
+        self.path = path  # None: next to the database, resolved on first use
+        self.sets = sets
+        self.ways = ways
+        self._set_size = ways * self.SLOT.size
+        self._lock = threading.Lock()
+        self._file = None
+        self._map = None
+
+    def _open(self):
+        """Map the file, creating or growing it to size on first use"""
+        size = self.sets * self._set_size
+        handle = open(self.path or database.DATABASE_NAME + '.ratelimit', 'a+b')
+        if os.fstat(handle.fileno()).st_size < size:
+            handle.truncate(size)  # New space reads as zeros: empty slots
+        self._map = mmap.mmap(handle.fileno(), size)
+        self._file = handle
+
+    def take(self, buckets, now):
+        """Take a token from each (key, rate, burst) bucket, or from none if
+        any is empty; returns each bucket's seconds to wait, all 0.0 if
+        the tokens were taken"""
+        located = []
+        for key, rate, burst in buckets:
+            digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+            digest = digest or 1  # 0 marks an empty slot
+            located.append((digest, (digest % self.sets) * self._set_size, rate, burst))
+        # Sets are always locked in file order, so processes cannot deadlock
+        starts = sorted({start for _, start, _, _ in located})
+        with self._lock:
+            if self._map is None:
+                self._open()
+            if fcntl is not None:
+                for start in starts:
+                    fcntl.lockf(self._file, fcntl.LOCK_EX, self._set_size, start)
+            try:
+                tokens = [_refill(*self._find(digest, start, burst, now)[1:], rate, burst, now)
+                          for digest, start, rate, burst in located]
+                waits = [_wait(left, rate) for left, (_, _, rate, _) in zip(tokens, located)]
+                if not any(waits):
+                    for left, (digest, start, _, burst) in zip(tokens, located):
+                        way = self._find(digest, start, burst, now)[0]
+                        self.SLOT.pack_into(self._map, start + way * self.SLOT.size,
+                                            digest, left - 1, now)
+                return waits
+            finally:
+                if fcntl is not None:
+                    for start in reversed(starts):
+                        fcntl.lockf(self._file, fcntl.LOCK_UN, self._set_size, start)
+
+    def _find(self, digest, start, burst, now):
+        """(way, tokens, updated) of digest's slot in the set at start; a key
+        not present gets an empty or the least recently updated slot, full"""
+        slots = [self.SLOT.unpack_from(self._map, start + way * self.SLOT.size)
+                 for way in range(self.ways)]
+        for way, (slot_digest, tokens, updated) in enumerate(slots):
+            if slot_digest == digest:
+                return way, tokens, updated
+        return min(range(self.ways), key=lambda i: slots[i][2]), burst, now
+
+    def _reset_after_fork(self):
+        """The mapping is shared with the parent and stays valid; only the
+        thread lock must not be inherited"""
+        self._lock = threading.Lock()
+
+def _make_store():
+    if RATELIMIT_STORE == 'shared':
+        return SharedMemoryStore(RATELIMIT_FILE)
+    return MemoryStore()
+
+store = _make_store()
+
+_lock = threading.Lock()
+_counters = {}  # policy name -> {'allowed': n, 'rejected': n}
+
+def _reset_after_fork():
+    """Give a forked worker its own lock and counters"""
+    global _lock, _counters
+    _lock = threading.Lock()
+    _counters = {}
+    store._reset_after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def _count(name, outcome):
+    with _lock:
+        counters = _counters.setdefault(name, {'allowed': 0, 'rejected': 0})
+        counters[outcome] += 1
+
+def _client_ip():
+    return request.remote_addr or 'unknown'
+
+def _user():
+    """The user a request acts for: the user_id in its URL or JSON body,
+    or the username logging in; None if there is none"""
+    user = (request.view_args or {}).get('user_id')
+    if user is None and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user = data.get('user_id') or data.get('username')
+    return None if user is None else str(user)
+
+def check():
+    """Take a token for every policy on the current request's route, or
+    none if any of their buckets is empty.
+
+    Returns None if the request may proceed, else (policy, seconds until
+    it may be retried).
+    """
+    if not RATELIMIT_ENABLED or request.endpoint in EXEMPT_ENDPOINTS or request.method == 'OPTIONS':
+        return None
+    policies, buckets = [], []
+    for policy in DEFAULT_POLICIES + POLICIES.get(request.endpoint, []):
+        if policy.param and policy.param not in request.args:
+            continue
+        identity = _client_ip() if policy.scope == 'ip' else _user()
+        if identity is None:
+            continue
+        if policy.scope == 'user_ip':
+            identity = f'{identity}@{_client_ip()}'
+        policies.append(policy)
+        buckets.append((f'{policy.name}:{identity}', policy.rate, policy.burst))
+
+    # A request rejected by one policy spends no tokens from the others
+    waits = store.take(buckets, time.time())
+    rejected = [(wait, policy) for wait, policy in zip(waits, policies) if wait]
+    if not rejected:
+        for policy in policies:
+            _count(policy.name, 'allowed')
+        return None
+    for _, policy in rejected:
+        _count(policy.name, 'rejected')
+    wait, policy = max(rejected, key=lambda item: item[0])
+    return policy, wait
+
+def stats():
+    """Requests allowed and rejected per policy"""
+    with _lock:
+        policies = {name: dict(counters) for name, counters in _counters.items()}
+    return {'enabled': RATELIMIT_ENABLED, 'store': store.name, 'policies': policies}
@@ -0,0 +1,247 @@
+"""Offline "readers also borrowed" recommendations.
+
+Builds a book-to-book similarity from borrowing_records and reviews and
+stores each book's top NEIGHBOURS in book_similarities, which
+Recommendation.get_similar and get_for_user read with one index range
+per book.
+
+A user's interest in a book is models.interaction_weight() of their loans
+and review of it. Two books are similar when the same readers liked both:
+the cosine of their per-user weight vectors, damped for pairs that only
+a few readers share:
+
+    score = cosine * common_readers / (common_readers + SHRINKAGE)
+
+With NumPy and SciPy installed the products run as sparse matrix
+multiplications, CHUNK_SIZE books at a time; otherwise they are summed
+in dicts. Both give the same neighbours.
+
+refresh() is incremental. Loans and reviews are only ever appended, so
+the highest IDs already counted mark what is new. A run only recomputes
+the books that share a reader with a book that gained a loan or review.
+Every FULL_REBUILD_INTERVAL seconds it rebuilds every book instead,
+which also catches what the IDs cannot show, such as deleted rows.
+
+    python recommendations.py          # refresh, incrementally when possible
+    python recommendations.py --full   # rebuild every book
+"""
+import argparse
+import heapq
+import math
+import time
+from collections import defaultdict
+
+from database import read_connection, run_in_transaction
+from models import interaction_weight
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+NEIGHBOURS = 20         # Similar books stored per book
+SHRINKAGE = 3.0         # Common readers at which a pair's score is halved
+MAX_USER_BOOKS = 200    # A user's best-liked books that count; bounds the pairs one reader adds
+FULL_REBUILD_INTERVAL = 86400  # seconds
+CHUNK_SIZE = 1024       # Books per sparse product
+WRITE_BATCH_SIZE = 500  # Books per write transaction
+
+def engine():
+    """'scipy' if the vectorized path is available, else 'python'"""
+    return 'python' if sparse is None else 'scipy'
+
+def load_interactions(conn, last_record_id=0, last_review_id=0):
+    """Read every loan and review in one read transaction.
+
+    Returns ({user_id: [(book_id, weight), ...]}, books with a loan or
+    review newer than the given IDs, the highest record and review IDs).
+    """
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute('BEGIN')
+    try:
+        borrowed, ratings, changed = set(), {}, set()
+        max_record_id, max_review_id = last_record_id, last_review_id
+        for record_id, user_id, book_id in cursor.execute(
+                'SELECT record_id, user_id, book_id FROM borrowing_records'):
+            borrowed.add((user_id, book_id))
+            if record_id > last_record_id:
+                changed.add(book_id)
+                max_record_id = max(max_record_id, record_id)
+        for review_id, user_id, book_id, rating in cursor.execute(
+                'SELECT review_id, user_id, book_id, rating FROM reviews ORDER BY review_id'):
+            ratings[user_id, book_id] = rating
+            if review_id > last_review_id:
+                changed.add(book_id)
+                max_review_id = max(max_review_id, review_id)
+    finally:
+        conn.rollback()
+
+    user_books = defaultdict(list)
+    for user_id, book_id in borrowed | ratings.keys():
+        weight = interaction_weight((user_id, book_id) in borrowed, ratings.get((user_id, book_id)))
+        if weight:
+            user_books[user_id].append((book_id, weight))
+    for user_id, books in user_books.items():
+        if len(books) > MAX_USER_BOOKS:
+            user_books[user_id] = heapq.nlargest(MAX_USER_BOOKS, books,
+                                                 key=lambda item: (item[1], -item[0]))
+    return user_books, changed, max_record_id, max_review_id
+
+def _book_users(user_books):
+    book_users = defaultdict(list)
+    for user_id, books in user_books.items():
+        for book_id, weight in books:
+            book_users[book_id].append((user_id, weight))
+    return book_users
+
+def _score(dot, common, norm, other_norm):
+    return dot / (norm * other_norm) * common / (common + SHRINKAGE)
+
+def _neighbours_python(user_books, book_ids):
+    """Yield (book_id, [(similar_book_id, score), ...]) by dict accumulation"""
+    book_users = _book_users(user_books)
+    norms = {book_id: math.sqrt(sum(weight * weight for _, weight in users))
+             for book_id, users in book_users.items()}
+    for book_id in book_ids:
+        dots, common = defaultdict(float), defaultdict(int)
+        for user_id, weight in book_users.get(book_id, ()):
+            for other, other_weight in user_books[user_id]:
+                if other != book_id:
+                    dots[other] += weight * other_weight
+                    common[other] += 1
+        norm = norms.get(book_id)
+        scores = ((other, _score(dot, common[other], norm, norms[other]))
+                  for other, dot in dots.items())
+        yield book_id, heapq.nlargest(NEIGHBOURS, scores, key=lambda item: (item[1], -item[0]))
+
+def _neighbours_sparse(user_books, book_ids):
+    """Yield (book_id, [(similar_book_id, score), ...]) from sparse products"""
+    columns = sorted({book_id for books in user_books.values() for book_id, _ in books})
+    index = {book_id: i for i, book_id in enumerate(columns)}
+    rows, cols, weights = [], [], []
+    for row, books in enumerate(user_books.values()):
+        for book_id, weight in books:
+            rows.append(row)
+            cols.append(index[book_id])
+            weights.append(weight)
+    shape = (len(user_books), len(columns))
+    weighted = sparse.csr_matrix((weights, (rows, cols)), shape=shape, dtype=np.float64)
+    readers = sparse.csr_matrix((np.ones(len(weights)), (rows, cols)), shape=shape)
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=0)).ravel())
+    weighted_t, readers_t = weighted.T.tocsr(), readers.T.tocsr()
+    column_ids = np.asarray(columns)
+
+    targets = [book_id for book_id in book_ids if book_id in index]
+    for book_id in book_ids:
+        if book_id not in index:
+            yield book_id, []
+    for start in range(0, len(targets), CHUNK_SIZE):
+        chunk = [index[book_id] for book_id in targets[start:start + CHUNK_SIZE]]
+        dots = (weighted_t[chunk] @ weighted).tocsr()
+        common = (readers_t[chunk] @ readers).tocsr()
+        dots.sort_indices()
+        common.sort_indices()  # All weights are positive, so both share one pattern
+        for row, i in enumerate(chunk):
+            span = slice(dots.indptr[row], dots.indptr[row + 1])
+            others, dot, shared = dots.indices[span], dots.data[span], common.data[span]
+            keep = others != i
+            others, dot, shared = others[keep], dot[keep], shared[keep]
+            scores = dot / (norms[i] * norms[others]) * shared / (shared + SHRINKAGE)
+            order = np.lexsort((column_ids[others], -scores))[:NEIGHBOURS]
+            yield columns[i], [(int(column_ids[others[j]]), float(scores[j])) for j in order]
+
+def compute_neighbours(user_books, book_ids):
+    """Top NEIGHBOURS similar books for each of book_ids"""
+    if sparse is not None:
+        return _neighbours_sparse(user_books, book_ids)
+    return _neighbours_python(user_books, book_ids)
+
+def _write(conn, batch):
+    conn.executemany('DELETE FROM book_similarities WHERE book_id = ?',
+                     [(book_id,) for book_id, _ in batch])
+    conn.executemany('''
+        INSERT INTO book_similarities (book_id, rank, similar_book_id, score)
+        VALUES (?, ?, ?, ?)
+    ''', [(book_id, rank, other, round(score, 6))
+          for book_id, neighbours in batch
+          for rank, (other, score) in enumerate(neighbours, 1)])
+
+def store_neighbours(results):
+    """Replace the stored neighbours of each book, WRITE_BATCH_SIZE books
+    per short transaction; returns the number of books written"""
+    batch, written = [], 0
+    for item in results:
+        batch.append(item)
+        if len(batch) >= WRITE_BATCH_SIZE:
+            run_in_transaction(lambda conn: _write(conn, batch))
+            written += len(batch)
+            batch = []
+    if batch:
+        run_in_transaction(lambda conn: _write(conn, batch))
+        written += len(batch)
+    return written
+
+def refresh(full=None):
+    """Bring book_similarities up to date; returns the number of books updated.
+
+    full=None rebuilds everything only when there is no recent full build.
+    """
+    with read_connection() as conn:
+        state = conn.execute(f'''
+            SELECT last_record_id, last_review_id,
+                   full_built_at IS NULL
+                   OR full_built_at < datetime('now', '-{FULL_REBUILD_INTERVAL} seconds')
+            FROM recommendation_state WHERE id = 1
+        ''').fetchone()
+        if full is None:
+            full = bool(state[2])
+        if not full:
+            newest = conn.execute('''
+                SELECT (SELECT MAX(record_id) FROM borrowing_records),
+                       (SELECT MAX(review_id) FROM reviews)
+            ''').fetchone()
+            if (newest[0] or 0) <= state[0] and (newest[1] or 0) <= state[1]:
+                return 0  # Nothing borrowed or reviewed since the last run
+        since = (0, 0) if full else (state[0], state[1])
+        user_books, changed, last_record_id, last_review_id = load_interactions(conn, *since)
+        stored = {row[0] for row in conn.execute(
+            'SELECT DISTINCT book_id FROM book_similarities')} if full else set()
+
+    if full:
+        book_ids = sorted({book_id for books in user_books.values() for book_id, _ in books})
+    else:
+        # A new loan or review moves the scores of every pair it is part of
+        book_users = _book_users(user_books)
+        affected = set(changed)
+        for book_id in changed:
+            for user_id, _ in book_users.get(book_id, ()):
+                affected.update(other for other, _ in user_books[user_id])
+        book_ids = sorted(affected)
+
+    written = store_neighbours(compute_neighbours(user_books, book_ids))
+    if full:
+        # Books nobody borrows or likes any more
+        store_neighbours((book_id, []) for book_id in sorted(stored - set(book_ids)))
+
+    run_in_transaction(lambda conn: conn.execute(f'''
+        UPDATE recommendation_state
+        SET last_record_id = ?, last_review_id = ?, built_at = CURRENT_TIMESTAMP
+            {', full_built_at = CURRENT_TIMESTAMP' if full else ''}
+        WHERE id = 1
+    ''', (last_record_id, last_review_id)))
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh the precomputed book recommendations')
+    parser.add_argument('--full', action='store_true', help='rebuild every book')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    books = refresh(full=True if args.full else None)
+    print(f'Updated neighbours of {books} books in {time.perf_counter() - started:.2f}s '
+          f'({engine()})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Aggregate reports for librarians, computed from the database snapshot.
+
+Reports read the snapshot made by database.refresh_snapshot() (which the
+scheduler refreshes every LIBRARY_SNAPSHOT_INTERVAL seconds), never the
+live database, so their full-table aggregates cannot hold up the API.
+Figures are as of the snapshot's taken_at time.
+
+    python reporting.py history --period week --since 2026-01-01
+    python reporting.py popular --limit 20
+    python reporting.py fines --refresh      # refresh the snapshot first
+
+Every report takes an optional snapshot connection, so several reports
+can be computed from the same copy.
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+
+import database
+
+# strftime() formats for borrowing_history periods
+PERIODS = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'month': '%Y-%m', 'year': '%Y'}
+
+def _rows(sql, params, conn=None):
+    """Run a report query on conn, or on a fresh snapshot connection"""
+    if conn is not None:
+        return [dict(row) for row in conn.execute(sql, params)]
+    conn = database.snapshot_connection()
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+def snapshot_info():
+    """Path, size and time of the current snapshot, or None if there is none"""
+    path = database.snapshot_path()
+    if not os.path.exists(path):
+        return None
+    taken_at = datetime.fromtimestamp(os.path.getmtime(path))
+    return {'path': path, 'taken_at': taken_at.isoformat(timespec='seconds'),
+            'size_bytes': os.path.getsize(path)}
+
+def borrowing_history(period='month', since=None, until=None, conn=None):
+    """Loans per period: loans made, distinct borrowers, returns, late
+    returns and fines charged, oldest period first"""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    return _rows('''
+        SELECT strftime(?, borrow_date) AS period,
+               COUNT(*) AS loans,
+               COUNT(DISTINCT user_id) AS borrowers,
+               SUM(status = 'returned') AS returned,
+               SUM(return_date > due_date) AS late_returns,
+               ROUND(SUM(fine_amount), 2) AS fines
+        FROM borrowing_records
+        WHERE borrow_date >= ? AND borrow_date < ?
+        GROUP BY period
+        ORDER BY period
+    ''', (PERIODS[period], str(since or ''), str(until or '9999-12-31')), conn)
+
+def popular_books(limit=20, since=None, conn=None):
+    """Most borrowed books, with distinct borrowers, copies out and ratings"""
+    return _rows('''
+        SELECT b.book_id, b.title, b.author, b.category,
+               COUNT(*) AS loans,
+               COUNT(DISTINCT br.user_id) AS borrowers,
+               SUM(br.status = 'borrowed') AS on_loan,
+               s.average_rating, COALESCE(s.review_count, 0) AS review_count
+        FROM borrowing_records br
+        JOIN books b ON b.book_id = br.book_id
+        LEFT JOIN book_rating_stats s ON s.book_id = b.book_id
+        WHERE br.borrow_date >= ?
+        GROUP BY b.book_id
+        ORDER BY loans DESC, b.book_id
+        LIMIT ?
+    ''', (str(since or ''), limit), conn)
+
+def fines_by_user(limit=50, min_fine=0.01, conn=None):
+    """Users by fines charged: in total, on loans still out, and how many
+    of those loans are overdue"""
+    return _rows('''
+        SELECT u.user_id, u.username, u.full_name, u.email,
+               ROUND(SUM(br.fine_amount), 2) AS fines_total,
+               ROUND(SUM(CASE WHEN br.status = 'borrowed' THEN br.fine_amount ELSE 0 END), 2)
+                   AS fines_open,
+               SUM(br.status = 'borrowed' AND br.due_date < ?) AS overdue_loans,
+               MAX(br.borrow_date) AS last_borrowed
+        FROM borrowing_records br
+        JOIN users u ON u.user_id = br.user_id
+        GROUP BY u.user_id
+        HAVING fines_total >= ?
+        ORDER BY fines_total DESC, u.user_id
+        LIMIT ?
+    ''', (str(datetime.now()), min_fine, limit), conn)
+
+def main():
+    parser = argparse.ArgumentParser(description='Library reports from the database snapshot')
+    parser.add_argument('--refresh', action='store_true', help='refresh the snapshot first')
+    reports = parser.add_subparsers(dest='report', required=True)
+
+    history = reports.add_parser('history', help='loans per period')
+    history.add_argument('--period', choices=list(PERIODS), default='month')
+    history.add_argument('--since', help='first borrow date (YYYY-MM-DD)')
+    history.add_argument('--until', help='borrow dates before this (YYYY-MM-DD)')
+
+    popular = reports.add_parser('popular', help='most borrowed books')
+    popular.add_argument('--limit', type=int, default=20)
+    popular.add_argument('--since', help='count loans from this date (YYYY-MM-DD)')
+
+    fines = reports.add_parser('fines', help='fines by user')
+    fines.add_argument('--limit', type=int, default=50)
+    fines.add_argument('--min-fine', type=float, default=0.01)
+
+    args = parser.parse_args()
+    if args.refresh:
+        database.refresh_snapshot()
+    conn = database.snapshot_connection()
+    try:
+        if args.report == 'history':
+            rows = borrowing_history(args.period, args.since, args.until, conn)
+        elif args.report == 'popular':
+            rows = popular_books(args.limit, args.since, conn)
+        else:
+            rows = fines_by_user(args.limit, args.min_fine, conn)
+    finally:
+        conn.close()
+    print(json.dumps({'snapshot': snapshot_info(), 'rows': rows}, indent=2))
+
+if __name__ == '__main__':
+    main()
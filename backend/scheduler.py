@@ -0,0 +1,168 @@
+"""In-process background jobs.
+
+A daemon thread sweeps expired reservations, accrues overdue fines,
+refreshes the reporting snapshot and updates book recommendations on
+configurable intervals. Each job works in small batched transactions,
+and the thread uses its own pooled connection. When several worker
+processes share a database, only the one holding the scheduler lock file
+runs the jobs; the others take over if it exits.
+
+    python scheduler.py            # run every job once and exit (e.g. from cron)
+"""
+import os
+import threading
+import time
+
+import database
+import recommendations
+from database import close_db_connection, lock_file
+from models import BorrowingRecord, Reservation
+
+# Set LIBRARY_SCHEDULER=0 to run the sweeps from cron instead
+SCHEDULER_ENABLED = os.environ.get('LIBRARY_SCHEDULER', '1') != '0'
+
+# Seconds between sweeps
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get('LIBRARY_RESERVATION_SWEEP_INTERVAL', 300))
+FINE_SWEEP_INTERVAL = float(os.environ.get('LIBRARY_FINE_SWEEP_INTERVAL', 3600))
+SNAPSHOT_INTERVAL = float(os.environ.get('LIBRARY_SNAPSHOT_INTERVAL', 900))  # 0: on demand only
+RECOMMENDATION_INTERVAL = float(os.environ.get('LIBRARY_RECOMMENDATION_INTERVAL', 3600))  # 0: off
+
+# Rows per transaction
+SWEEP_BATCH_SIZE = int(os.environ.get('LIBRARY_SWEEP_BATCH_SIZE', 500))
+
+# Seconds between attempts to take over from another process's scheduler
+LEADER_RETRY_INTERVAL = 30.0
+
+class Job:
+    """A function run every interval seconds, with its run metrics"""
+
+    def __init__(self, name, fn, interval):
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.next_run = 0.0
+        self.metrics = {'runs': 0, 'errors': 0, 'rows': 0, 'last_rows': 0,
+                        'last_duration': 0.0, 'total_duration': 0.0,
+                        'last_run': None, 'last_error': None}
+
+class Scheduler:
+    """Runs jobs on a single background thread"""
+
+    def __init__(self):
+        self.jobs = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._leader_lock = None
+
+    def add(self, name, fn, interval):
+        """Schedule fn(), which returns the number of rows it processed"""
+        self.jobs.append(Job(name, fn, interval))
+
+    def run_job(self, job):
+        """Run one job now and record how it went"""
+        started = time.perf_counter()
+        rows, error = 0, None
+        try:
+            rows = job.fn()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+        duration = time.perf_counter() - started
+
+        with self._lock:
+            metrics = job.metrics
+            metrics['runs'] += 1
+            metrics['rows'] += rows
+            metrics['last_rows'] = rows
+            metrics['last_duration'] = round(duration, 4)
+            metrics['total_duration'] = round(metrics['total_duration'] + duration, 4)
+            metrics['last_run'] = time.time()
+            if error:
+                metrics['errors'] += 1
+                metrics['last_error'] = error
+        job.next_run = time.monotonic() + job.interval
+        return rows
+
+    def run_pending(self):
+        """Run every job that is due; returns seconds until the next one"""
+        for job in self.jobs:
+            if job.next_run <= time.monotonic() and not self._wakeup.is_set():
+                self.run_job(job)
+        if not self.jobs:
+            return 60.0
+        return max(0.0, min(job.next_run for job in self.jobs) - time.monotonic())
+
+    def _lead(self):
+        """True if this process runs the jobs for its database"""
+        if self._leader_lock is None:
+            self._leader_lock = lock_file(database.DATABASE_NAME + '.scheduler-lock',
+                                          blocking=False)
+        return self._leader_lock is not None
+
+    def _loop(self):
+        try:
+            while not self._wakeup.is_set():
+                wait = self.run_pending() if self._lead() else LEADER_RETRY_INTERVAL
+                self._wakeup.wait(wait)
+        finally:
+            close_db_connection()
+            if self._leader_lock is not None:
+                self._leader_lock.close()
+                self._leader_lock = None
+
+    def _reset_after_fork(self):
+        """The thread does not survive fork() and the leader lock is the parent's"""
+        if self._leader_lock is not None:
+            self._leader_lock.close()  # Our copy only; the parent keeps the lock
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._leader_lock = None
+
+    def start(self):
+        """Start the background thread (no-op if already running)"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._wakeup.clear()
+            self._thread = threading.Thread(target=self._loop, name='library-scheduler',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Stop the background thread after the batch in progress"""
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        """Per-job metrics: rows processed and sweep durations"""
+        with self._lock:
+            jobs = {job.name: dict(job.metrics, interval=job.interval) for job in self.jobs}
+        running = self._thread is not None and self._thread.is_alive()
+        return {'running': running, 'leader': self._leader_lock is not None, 'jobs': jobs}
+
+scheduler = Scheduler()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=scheduler._reset_after_fork)
+scheduler.add('expire_reservations',
+              lambda: Reservation.expire_overdue(batch_size=SWEEP_BATCH_SIZE),
+              RESERVATION_SWEEP_INTERVAL)
+scheduler.add('accrue_fines',
+              lambda: BorrowingRecord.accrue_fines(batch_size=SWEEP_BATCH_SIZE),
+              FINE_SWEEP_INTERVAL)
+if SNAPSHOT_INTERVAL > 0:
+    # "Rows" for this job are the pages copied
+    scheduler.add('refresh_snapshot', lambda: database.refresh_snapshot(), SNAPSHOT_INTERVAL)
+if RECOMMENDATION_INTERVAL > 0:
+    # Incremental unless the last full rebuild is a day old; "rows" are books updated
+    scheduler.add('refresh_recommendations', lambda: recommendations.refresh(),
+                  RECOMMENDATION_INTERVAL)
+
+if __name__ == '__main__':
+    for job in scheduler.jobs:
+        rows = scheduler.run_job(job)
+        metrics = job.metrics
+        status = f" (error: {metrics['last_error']})" if metrics['last_error'] else ''
+        print(f"{job.name}: {rows} rows in {metrics['last_duration']}s{status}")
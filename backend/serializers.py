@@ -0,0 +1,125 @@
+"""Response encodings, chosen by content negotiation.
+
+JSON is encoded with orjson when it is installed, falling back to the
+standard library, and MessagePack is offered when msgpack is installed.
+List endpoints can also send a columnar body that names each column
+once instead of repeating the keys on every row:
+
+    {"columns": ["book_id", "title", ...], "rows": [[1, "Dune", ...], ...]}
+
+Columnar bodies are encoded straight from a Page's row tuples, without
+building a dict per row.
+
+    Accept: application/json                          objects (default)
+    Accept: application/msgpack                       objects, as MessagePack
+    Accept: application/vnd.library.columns+json      columnar JSON
+    Accept: application/vnd.library.columns+msgpack   columnar MessagePack
+"""
+import json
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from pagination import Page
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+COLUMNS_JSON = 'application/vnd.library.columns+json'
+COLUMNS_MSGPACK = 'application/vnd.library.columns+msgpack'
+
+# Older clients ask for MessagePack by this name
+MSGPACK_ALIASES = {'application/x-msgpack': MSGPACK}
+
+def _default(value):
+    """Encode what JSON/MessagePack have no type for; dates as Flask does"""
+    if isinstance(value, Page):
+        return list(value)
+    return DefaultJSONProvider.default(value)
+
+if orjson is not None:
+    # Datetimes go through _default so they look the same as with jsonify
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+def dumps_json(obj, indent=False):
+    """Encode obj as JSON bytes"""
+    if orjson is not None:
+        options = _ORJSON_OPTIONS | orjson.OPT_INDENT_2 if indent else _ORJSON_OPTIONS
+        return orjson.dumps(obj, default=_default, option=options)
+    if indent:
+        return json.dumps(obj, default=_default, indent=2).encode()
+    return json.dumps(obj, default=_default, separators=(',', ':')).encode()
+
+def dumps_msgpack(obj):
+    """Encode obj as MessagePack bytes"""
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+def columnar(obj):
+    """A Page as {columns, rows}; anything else unchanged"""
+    if isinstance(obj, Page):
+        return {'columns': obj.columns, 'rows': obj.rows}
+    return obj
+
+def offered():
+    """Media types this server can produce, preferred first"""
+    types = [JSON, COLUMNS_JSON]
+    if msgpack is not None:
+        types += [MSGPACK, COLUMNS_MSGPACK, *MSGPACK_ALIASES]
+    return types
+
+def negotiate():
+    """The media type to answer the current request with"""
+    best = request.accept_mimetypes.best_match(offered(), default=JSON)
+    return MSGPACK_ALIASES.get(best, best)
+
+def encode(obj, mimetype, indent=False):
+    """Body bytes for obj in a media type returned by negotiate()"""
+    if mimetype in (COLUMNS_JSON, COLUMNS_MSGPACK):
+        obj = columnar(obj)
+    if mimetype in (MSGPACK, COLUMNS_MSGPACK):
+        return dumps_msgpack(obj)
+    return dumps_json(obj, indent) + b'\n'
+
+def json_items(rows):
+    """Rows as comma-separated JSON objects, to splice into a streamed array"""
+    return dumps_json(list(rows))[1:-1]
+
+def ndjson_lines(rows):
+    """Rows as newline-delimited JSON"""
+    return b''.join(dumps_json(row) + b'\n' for row in rows)
+
+class JSONProvider(DefaultJSONProvider):
+    """jsonify() with orjson and content negotiation.
+
+    Every jsonify() response is encoded in the negotiated media type and
+    varies on Accept.
+    """
+    sort_keys = False  # Rows keep their column order
+
+    def dumps(self, obj, **kwargs):
+        if orjson is not None and not kwargs:
+            return dumps_json(obj).decode()
+        kwargs.setdefault('default', _default)
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        mimetype = negotiate()
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        response = self._app.response_class(encode(obj, mimetype, indent), mimetype=mimetype)
+        response.vary.add('Accept')
+        return response